@@ -0,0 +1,152 @@
+"""
+jnd_aggregate.py
+
+This module collects the per-trial results files of all subjects of the Just-Noticeable-Difference (JND) experiment
+into one columnar dataset (Parquet), which can be read with pandas or with the arrow package in R.
+
+The results files ('results/<subject>/JND_<task>_*.csv') are parsed in a process pool. Their schemas are normalized:
+practice files have an extra 'run' column, older files name the subject column 'subject_ID' and have no cache or
+timing columns, so all files are mapped to the columns of the practice file, plus the name of the source file. Each
+parsed file is cached together with its path, modification time and size, so that running the aggregation again
+after a new participant only parses the new or changed files.
+
+Functions:
+----------
+- parse_results_file(path): Reads one results file into a DataFrame with the normalized schema.
+
+- aggregate_results(output_path, dataset_path, workers): Parses all results files (using the cache) and writes the
+combined dataset.
+
+Usage:
+------
+    python jnd_aggregate.py [--results results/] [--output results/jnd_results.parquet] [--workers 4]
+"""
+
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+from jnd_configuration import general_experiment_configs
+from jnd_results import practice_columns
+from jnd_timing import timing_columns
+
+
+# name of the directory below the results directory that holds the parsed files
+cache_directory_name = '.aggregate_cache'
+
+dataset_columns = practice_columns + ['source_file']
+
+column_types = {'run': 'Int64',
+                'trial': 'Int64',
+                'difference': 'float64',
+                'step-size': 'float64',
+                'reversals': 'Int64',
+                'cache_hits': 'Int64',
+                'cache_misses': 'Int64'}
+column_types.update({column: 'float64' for column in timing_columns})
+
+
+def parse_results_file(path):
+    """
+    Read one results file and normalize it to the schema of the dataset.
+
+    Args:
+        path (str): The path of the results csv file.
+
+    Returns:
+        pandas.DataFrame: The trials of the file with the columns of dataset_columns.
+    """
+    frame = pd.read_csv(path, dtype=str, keep_default_na=False)
+    frame = frame.rename(columns={'subject_ID': 'subjectID'})
+    for column in practice_columns:
+        if column not in frame.columns:
+            frame[column] = None
+    frame['source_file'] = os.path.basename(path)
+    frame = frame[dataset_columns]
+
+    for column, column_type in column_types.items():
+        frame[column] = pd.to_numeric(frame[column], errors='coerce').astype(column_type)
+    frame['correct'] = frame['correct'].map({'True': True, 'False': False}).astype('boolean')
+    return frame
+
+
+def _file_signature(path):
+    """Return the key under which a parsed file is cached: modification time, size and the columns of the dataset."""
+    stat = os.stat(path)
+    # files parsed with other dataset columns (added, renamed or reordered) are parsed again
+    return {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size, 'columns': list(dataset_columns)}
+
+
+def _cache_file(cache_path, path):
+    """Return the path of the cached parsed version of a results file."""
+    return os.path.join(cache_path, hashlib.sha1(os.path.abspath(path).encode('utf-8')).hexdigest() + '.pkl')
+
+
+def aggregate_results(output_path=None, dataset_path=None, workers=None):
+    """
+    Combine all results files into one dataset, parsing only files that are new or changed since the last run.
+
+    Args:
+        output_path (str, optional): The results directory, containing one directory per subject. Defaults to the
+            experiment configuration.
+        dataset_path (str, optional): The Parquet file to write. Defaults to 'jnd_results.parquet' in the results
+            directory.
+        workers (int, optional): The number of worker processes. Defaults to the number of CPUs.
+
+    Returns:
+        pandas.DataFrame: The combined dataset.
+    """
+    if output_path is None:
+        output_path = general_experiment_configs['output_path']
+    if dataset_path is None:
+        dataset_path = os.path.join(output_path, 'jnd_results.parquet')
+
+    cache_path = os.path.join(output_path, cache_directory_name)
+    os.makedirs(cache_path, exist_ok=True)
+    manifest_path = os.path.join(cache_path, 'manifest.json')
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, encoding='utf-8') as manifest_file:
+            manifest = json.load(manifest_file)
+
+    paths = sorted(glob.glob(os.path.join(output_path, '*', 'JND_*.csv')))
+    signatures = {path: _file_signature(path) for path in paths}
+    stale = [path for path in paths
+             if manifest.get(path) != signatures[path] or not os.path.exists(_cache_file(cache_path, path))]
+
+    if stale:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for path, frame in zip(stale, executor.map(parse_results_file, stale)):
+                frame.to_pickle(_cache_file(cache_path, path))
+                manifest[path] = signatures[path]
+
+    # forget files that were removed from the results directory
+    for path in set(manifest) - set(paths):
+        del manifest[path]
+        if os.path.exists(_cache_file(cache_path, path)):
+            os.remove(_cache_file(cache_path, path))
+    with open(manifest_path, 'w', encoding='utf-8') as manifest_file:
+        json.dump(manifest, manifest_file, indent=1)
+
+    frames = [pd.read_pickle(_cache_file(cache_path, path)) for path in paths]
+    if frames:
+        dataset = pd.concat(frames, ignore_index=True)
+    else:
+        dataset = pd.DataFrame(columns=dataset_columns)
+    dataset.to_parquet(dataset_path, index=False)
+    print(f"Parsed {len(stale)} of {len(paths)} results files, wrote {len(dataset)} trials to {dataset_path}")
+    return dataset
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Combine all JND results files into one Parquet dataset.')
+    parser.add_argument('--results', default=None, help='results directory (default: from the configuration)')
+    parser.add_argument('--output', default=None, help='Parquet file to write')
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes')
+    args = parser.parse_args()
+
+    aggregate_results(args.results, args.output, args.workers)
@@ -0,0 +1,312 @@
+"""
+jnd_audio.py
+
+This module keeps the decoded audio of the stimuli of a Just-Noticeable-Difference (JND) task in memory, so that
+the trial loop does not have to read and decode wav files between the participant's response and the next AXB
+triplet.
+
+Because the staircase only moves by one step per trial, only the baseline and the levels around the current
+difference are needed in the near future. The cache keeps exactly these levels decoded and evicts all others, which
+keeps the memory use bounded even for the large pitch stimulus set.
+
+Functions:
+----------
+- read_wav(path): Reads a 16-bit PCM wav file and returns its samples as float32 array in the range -1 to 1 and its
+sample rate.
+
+- render_axb(samples_A, samples_X, samples_B, sample_rate, isi): Concatenates the three stimuli of a trial with the
+inter stimulus intervals into one contiguous buffer, so that the whole AXB triplet is played as a single sound and
+the intervals are exact to the sample.
+
+- arrange_axb(baseline_path, test_path, ab_order, x_key): Returns the stimuli A, X and B of a trial for a given
+randomization.
+
+Classes:
+--------
+- StimulusCache: Bounded cache of decoded stimuli around the current staircase position, with hit/miss counters.
+
+- AXBPrefetcher: Background worker that prepares the AXB buffers of all possible next trials while the participant
+is still responding to the current one.
+"""
+
+
+import threading
+import wave
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+
+# silence between the three stimuli of a trial in seconds
+inter_stimulus_interval = 0.7
+
+
+def read_wav(path):
+    """
+    Read a 16-bit PCM wav file.
+
+    Args:
+        path (str): The path of the wav file.
+
+    Returns:
+        tuple: The samples as float32 array in the range -1 to 1 (one column per channel for multichannel files)
+        and the sample rate in Hz.
+
+    Raises:
+        Exception: If the file is not 16-bit PCM.
+    """
+    with wave.open(path, 'rb') as wav_file:
+        if wav_file.getsampwidth() != 2:
+            raise Exception(f'Only 16-bit PCM wav files are supported: {path}')
+        channels = wav_file.getnchannels()
+        sample_rate = wav_file.getframerate()
+        frames = wav_file.readframes(wav_file.getnframes())
+
+    samples = np.frombuffer(frames, dtype='<i2').astype(np.float32) / 32768.0
+    if channels > 1:
+        samples = samples.reshape(-1, channels)
+    return samples, sample_rate
+
+
+def render_axb(samples_A, samples_X, samples_B, sample_rate, isi=inter_stimulus_interval):
+    """
+    Render the AXB triplet of a trial into one contiguous buffer.
+
+    Args:
+        samples_A (numpy.ndarray): The samples of the first stimulus.
+        samples_X (numpy.ndarray): The samples of the second stimulus.
+        samples_B (numpy.ndarray): The samples of the third stimulus.
+        sample_rate (int): The sample rate of the stimuli in Hz.
+        isi (float, optional): The inter stimulus interval in seconds. Defaults to 0.7.
+
+    Returns:
+        numpy.ndarray: A, silence, X, silence, B as one float32 array.
+    """
+    silence = np.zeros((int(round(isi * sample_rate)),) + samples_A.shape[1:], dtype=np.float32)
+    return np.concatenate((samples_A, silence, samples_X, silence, samples_B))
+
+
+def arrange_axb(baseline_path, test_path, ab_order, x_key):
+    """
+    Arrange the stimuli of a trial for a given randomization.
+
+    Args:
+        baseline_path (str): The path of the baseline stimulus.
+        test_path (str): The path of the test stimulus.
+        ab_order (list): The order of A and B, e.g. ['test', 'baseline'].
+        x_key (str): The key of the correct answer - 'left' if X equals B (ABB), 'right' if X equals A (AAB).
+
+    Returns:
+        tuple: The paths of the stimuli A, X and B.
+    """
+    recordings = {'baseline': baseline_path, 'test': test_path}
+    recording_A, recording_B = recordings[ab_order[0]], recordings[ab_order[1]]
+    AB_dict = {'left': recording_B, 'right': recording_A}
+    return recording_A, AB_dict[x_key], recording_B
+
+
+class StimulusCache:
+    """
+    Bounded cache of decoded stimuli around the current staircase position.
+
+    The baseline stimulus is kept for the whole session. All other levels are loaded for a window of 'radius'
+    staircase steps around the current difference and evicted once the staircase has moved away from them.
+
+    Attributes:
+        hits (int): Number of requests served from memory.
+        misses (int): Number of requests that had to be read from disk.
+    """
+
+    def __init__(self, stimulus_index, radius=2, max_levels=8):
+        """
+        Create the cache and load the baseline stimulus.
+
+        Args:
+            stimulus_index (StimulusIndex): The in-memory index of the stimulus files of the task.
+            radius (int, optional): Number of staircase steps around the current difference kept in memory.
+                Defaults to 2.
+            max_levels (int, optional): Maximum number of levels kept in memory besides the baseline. Defaults to 8.
+        """
+        self.stimulus_index = stimulus_index
+        self.radius = radius
+        self.max_levels = max_levels
+        self.sample_rate = None
+        self.hits = 0
+        self.misses = 0
+        self._samples = {}  # maps the stimulus path to its decoded samples
+        self._lock = threading.Lock()  # the cache is filled by the prefetch worker and read by the trial loop
+
+        self.baseline_path = stimulus_index.path(stimulus_index.baseline)
+        self._load(self.baseline_path)
+
+    def _load(self, path):
+        """Decode a stimulus (see StimulusIndex.read_samples) and keep it in memory."""
+        samples, sample_rate = self.stimulus_index.read_samples(path)
+        with self._lock:
+            if self.sample_rate is None:
+                self.sample_rate = sample_rate
+            elif sample_rate != self.sample_rate:
+                raise Exception(f'Sample rate of {path} ({sample_rate} Hz) differs from the other stimuli '
+                                f'({self.sample_rate} Hz)')
+            self._samples[path] = samples
+        return samples
+
+    def samples(self, path):
+        """
+        Return the decoded samples of a stimulus, reading the file only if it is not in memory.
+
+        Args:
+            path (str): The path of the stimulus file, as returned by the stimulus index.
+
+        Returns:
+            numpy.ndarray: The samples as float32 array in the range -1 to 1.
+        """
+        with self._lock:
+            samples = self._samples.get(path)
+            if samples is not None:
+                self.hits += 1
+                return samples
+            self.misses += 1
+        return self._load(path)
+
+    def axb_buffer(self, path_A, path_X, path_B):
+        """
+        Render the AXB triplet of a trial from the cached stimuli.
+
+        Args:
+            path_A (str): The path of the first stimulus.
+            path_X (str): The path of the second stimulus.
+            path_B (str): The path of the third stimulus.
+
+        Returns:
+            numpy.ndarray: The whole triplet including the inter stimulus intervals.
+        """
+        return render_axb(self.samples(path_A), self.samples(path_X), self.samples(path_B), self.sample_rate)
+
+    def update_window(self, difference):
+        """
+        Move the cache window to a new staircase position.
+
+        Loads the levels within 'radius' staircase steps of the difference and evicts all levels outside the window,
+        except for the baseline.
+
+        Args:
+            difference (float): The current difference between test and baseline stimulus.
+        """
+        index = self.stimulus_index
+        current_level = index.level(index.baseline + difference)
+        window = {level: index.files[level]
+                  for level in map(index.resolve_level, index.neighbour_levels(difference, radius=self.radius))
+                  if index.has_level(level)}
+        window_paths = set(window.values())
+        window_paths.add(self.baseline_path)
+
+        with self._lock:
+            for path in list(self._samples):
+                if path not in window_paths:
+                    del self._samples[path]
+
+        # load the levels closest to the current difference first
+        for level in sorted(window, key=lambda level: abs(level - current_level)):
+            if len(self) > self.max_levels:
+                break
+            if not self.contains(window[level]):
+                self._load(window[level])
+
+    def contains(self, path):
+        """Return True if the stimulus is decoded in memory, without counting a hit or miss."""
+        with self._lock:
+            return path in self._samples
+
+    def reset_counters(self):
+        """Reset the hit and miss counters, e.g. at the start of a session."""
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        with self._lock:
+            return len(self._samples)
+
+
+class AXBPrefetcher:
+    """
+    Background worker that prepares the next trial while the participant responds to the current one.
+
+    After a response the staircase either moves one step down, stays, or moves one step up, so the three possible
+    test stimuli of the next trial are known before the response is given. The randomization of the next trial does
+    not depend on the response either. The worker moves the cache window, decodes the three candidates and renders
+    their AXB buffers, and the trial loop then picks the buffer matching the outcome.
+
+    Attributes:
+        hits (int): Number of trials whose buffer was prepared in the background.
+        misses (int): Number of trials whose buffer had to be rendered in the trial loop.
+    """
+
+    def __init__(self, stimulus_cache):
+        """
+        Create the prefetcher and its worker thread.
+
+        Args:
+            stimulus_cache (StimulusCache): The cache of decoded stimuli of the task.
+        """
+        self.stimulus_cache = stimulus_cache
+        self.hits = 0
+        self.misses = 0
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='axb_prefetch')
+        self._pending = None
+
+    def prefetch(self, difference, ab_order, x_key, next_differences=None):
+        """
+        Start preparing the candidates of the next trial in the background.
+
+        Args:
+            difference (float): The difference of the current trial.
+            ab_order (list): The order of A and B of the next trial, e.g. ['test', 'baseline'].
+            x_key (str): The key of the correct answer of the next trial.
+            next_differences (set, optional): The possible differences of the next trial, e.g. from
+                PsiEngine.next_differences. Defaults to the staircase steps from the current difference.
+        """
+        self._pending = self._executor.submit(self._prepare, difference, ab_order, x_key, next_differences)
+
+    def _prepare(self, difference, ab_order, x_key, next_differences):
+        """Move the cache window and render the AXB buffers of all possible next test stimuli."""
+        cache = self.stimulus_cache
+        index = cache.stimulus_index
+        cache.update_window(difference)
+
+        if next_differences is None:
+            levels = index.neighbour_levels(difference, radius=1)
+        else:
+            levels = {index.level(index.baseline + next_difference) for next_difference in next_differences}
+        buffers = {}
+        for level in map(index.resolve_level, levels):
+            if not index.has_level(level):
+                continue
+            triplet = arrange_axb(cache.baseline_path, index.files[level], ab_order, x_key)
+            buffers[triplet] = render_axb(*(cache.samples(path) for path in triplet), cache.sample_rate)
+        return buffers
+
+    def axb_buffer(self, path_A, path_X, path_B):
+        """
+        Return the AXB buffer of a trial, from the background worker if it was prepared there.
+
+        Args:
+            path_A (str): The path of the first stimulus.
+            path_X (str): The path of the second stimulus.
+            path_B (str): The path of the third stimulus.
+
+        Returns:
+            numpy.ndarray: The whole triplet including the inter stimulus intervals.
+        """
+        buffers = self._pending.result() if self._pending is not None else {}
+        self._pending = None
+        buffer = buffers.get((path_A, path_X, path_B))
+        if buffer is not None:
+            self.hits += 1
+            return buffer
+        self.misses += 1
+        return self.stimulus_cache.axb_buffer(path_A, path_X, path_B)
+
+    def shutdown(self):
+        """Wait for a pending job and stop the worker thread."""
+        self._executor.shutdown(wait=True)
+        self._pending = None
@@ -24,7 +24,7 @@ based on the current difference between test and baseline stimuli.
 Module Level Variables:
 -----------------------
 - general_experiment_configs: This dictionary stores general configurations for the experiment such as task types,
-number of trials, base stimuli path, output path, and plot path.
+number of trials, adaptive procedure, base stimuli path, output path, and plot path.
 
 - randomized_tasks: This list contains the task types from general_experiment_configs in randomized order.
 This supports a between-subjects experimental design.
@@ -33,7 +33,6 @@ This supports a between-subjects experimental design.
 
 from jnd_instructions import pitch_FL_text, pause_text
 import random
-from psychopy import monitors, visual
 import os
 import sys
 
@@ -53,16 +52,32 @@ def resource_path(relative_path):
 
 # Update paths to be compatible with PyInstaller
 base_stimuli_path = resource_path('audio/')
-print("Calculated path:", resource_path(base_stimuli_path))
 output_path = resource_path('results/')
 plot_path = resource_path('plots/')
 # directory for the pictograms used
 pics_path = resource_path('pics/')
+# base recording of the pause stimuli and the TextGrid that marks its pause, used if "synthesize_pause" is True
+pause_synthesis_source = {"wav_path": resource_path('stimuli/to-be-manipulated/pause/cut_name2_name3/lilli_lisa_ch.wav'),
+                          "textgrid_path": resource_path('stimuli/to-be-manipulated/pause/cut_name2_name3/lilli_lisa_ch.TextGrid'),
+                          "tier": "word",
+                          "interval": "pause3"}
 
 
 # General experiment configurations
 general_experiment_configs = {"task_types": ["pitch", "FL", "pause"],
                               "num_trials": 120,
+                              "procedure": "staircase",  # adaptive procedure of the trial session: 'staircase' or 'psi'
+                              "psi_trials": 50,  # number of trials of the trial session with the psi procedure
+                              # convergence rules that end the staircase early, None = disabled - see StaircaseEngine
+                              # e.g. "reversal_spread": {"reversals": 6, "tolerance": 0.15}, "smallest_step_reversals": 8
+                              "stopping_rules": {"reversal_spread": None,
+                                                 "smallest_step_reversals": None},
+                              "interleaved": False,  # run the trial sessions of all tasks interleaved in one block
+                              "interleaved_break_trials": 120,  # break screen every N trials of the interleaved block
+                              "resume_max_age_hours": 12,  # interrupted sessions older than this are not resumed - see jnd_resume.py
+                              "synthesize_pause": False,  # build the pause stimuli in memory instead of reading the wav files
+                              "frame_monitoring": False,  # redraw the timed screens every frame and record dropped frames - see jnd_frames.py
+                              "max_dropped_frames": 0.01,  # fraction of dropped frames of a phase above which the PC is flagged as too slow
                               "base_stimuli_path": base_stimuli_path,  # input path is generated as base_stimuli_path+task name
                               "output_path": output_path,
                               "plot_path": plot_path,
@@ -81,6 +96,9 @@ def create_window():
     Returns:
     win: A PsychoPy visual.Window object for the experiment.
     """
+    # PsychoPy is only imported here, so that the staircase procedure can be used without a display
+    from psychopy import monitors, visual
+
     # Create a monitor object for the second screen
     second_monitor = monitors.Monitor(name='EA244WMi')
     # Set the appropriate settings for the second monitor
@@ -140,6 +158,8 @@ def get_task_specific_config(task):
         config['stim_prefix'] = f'lilli_lisa_ch_{task}'
         config['baseline'] = 0.000
         config['initial_difference'] = 0.550
+        if general_experiment_configs["synthesize_pause"]:
+            config['synthesis_source'] = pause_synthesis_source
     elif task == "FL":
         config['task'] = "FL"
         config['stim_prefix'] = f'mimmi_ch_{task}'
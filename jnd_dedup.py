@@ -0,0 +1,335 @@
+"""
+jnd_dedup.py
+
+This module stores the stimulus set of a Just-Noticeable-Difference (JND) task compressed, with identical stimuli
+stored only once, and reconstructs any level on demand, bit-exact.
+
+The store ('audio/audio-<task>.jnddedup', next to the stimulus directory) keeps a list of unique segments; each
+stimulus is a list of references (segment, start, length) into them. Stimuli with the same samples, e.g. a level
+copied from another one, refer to the same segment. The stimuli resynthesized with Praat differ in every sample, also
+in the parts of the utterance that were not manipulated, so they share no samples; the store is smaller than the wav
+files because the segments are delta-coded (the difference between consecutive samples, in 16-bit arithmetic, so the
+decoding is exact) and zlib-compressed.
+
+The file consists of the magic bytes b'JNDDDUP1', the length of the JSON header as 8-byte little-endian integer, the
+header (task, sample format, levels of the manipulation csv file, segment table, references of every stimulus and
+the modification time and size of the wav files the store was written from) and the compressed segments. Reading a
+store only reads the header; the segments of a stimulus are read and decoded when it is needed. If a store exists for
+a task (and no stimulus pack, see jnd_pack.py), StimulusIndex (jnd_stimuli.py) uses it instead of the stimulus
+directory, unless the wav files changed after the store was written.
+
+Classes:
+--------
+- DedupStore: Reader of a store, with the interface of StimulusPack.
+
+Functions:
+----------
+- dedup_path_for(stimuli_path): The path of the store of a stimulus directory.
+
+- build_segments(stimuli): Splits the stimuli of a series into unique segments and references.
+
+- write_store(stimulus_index, store_path): Writes all stimuli of a stimulus index into a store.
+
+- verify_store(store, stimulus_index): Compares the reconstructed stimuli sample-for-sample with the wav files.
+
+Usage:
+------
+    python jnd_dedup.py [pitch FL pause] [--verify]
+"""
+
+
+import functools
+import hashlib
+import json
+import os
+import struct
+import threading
+import wave
+import zlib
+import numpy as np
+from jnd_pack import source_signatures, stale_sources
+
+
+store_magic = b'JNDDDUP1'
+store_extension = '.jnddedup'
+
+
+def dedup_path_for(stimuli_path):
+    """
+    Return the path of the store of a stimulus directory, e.g. 'audio/audio-pitch.jnddedup' for 'audio/audio-pitch/'.
+
+    Args:
+        stimuli_path (str): The stimulus directory of a task.
+
+    Returns:
+        str: The path of the store.
+    """
+    return os.path.normpath(stimuli_path) + store_extension
+
+
+def build_segments(stimuli):
+    """
+    Split the stimuli of a manipulation series into unique segments and references to them.
+
+    Stimuli with identical samples are stored as one segment, whatever their levels; they are found by a hash of
+    their samples and compared sample-for-sample.
+
+    Args:
+        stimuli (list): The int16 samples of each stimulus, in level order.
+
+    Returns:
+        tuple: The unique segments (list of numpy.ndarray) and, for each stimulus, its references (list of
+        [segment, start, length]).
+    """
+    segments = []
+    segment_of_hash = {}
+    all_references = []
+    for samples in stimuli:
+        if not len(samples):
+            all_references.append([])
+            continue
+        key = hashlib.sha1(samples.tobytes()).digest()
+        segment = segment_of_hash.get(key)
+        if segment is None or not np.array_equal(segments[segment], samples):
+            segment = len(segments)
+            segments.append(samples)
+            segment_of_hash.setdefault(key, segment)
+        all_references.append([[segment, 0, len(samples)]])
+    return segments, all_references
+
+
+def _encode_segment(samples):
+    """Delta-code and compress the samples of a segment."""
+    deltas = np.diff(samples, prepend=np.int16(0)).astype('<i2')  # wraps around like the cumulative sum in decoding
+    return zlib.compress(deltas.tobytes(), 6)
+
+
+def _decode_segment(data):
+    """Decompress and integrate the samples of a segment."""
+    deltas = np.frombuffer(zlib.decompress(data), dtype='<i2')
+    return np.cumsum(deltas, dtype='<i2')
+
+
+def write_store(stimulus_index, store_path=None):
+    """
+    Write all stimuli of a task into a store.
+
+    Args:
+        stimulus_index (StimulusIndex): The index of the stimulus directory of the task (built with use_pack=False).
+        store_path (str, optional): The store to write. Defaults to dedup_path_for the stimulus directory.
+
+    Returns:
+        dict: The size of the samples ('raw_bytes'), of the store ('stored_bytes') and the number of samples that
+        are references to another, identical stimulus ('shared_samples') and of all samples ('samples').
+
+    Raises:
+        Exception: If a stimulus is not 16-bit PCM or the stimuli differ in sample rate or number of channels.
+    """
+    if store_path is None:
+        store_path = dedup_path_for(stimulus_index.stimuli_path)
+
+    names, levels, stimuli = [], [], []
+    sample_rate = channels = None
+    for level, path in sorted(stimulus_index.files.items()):
+        with wave.open(path, 'rb') as wav_file:
+            if wav_file.getsampwidth() != 2:
+                raise Exception(f'Only 16-bit PCM wav files are supported: {path}')
+            if sample_rate is None:
+                sample_rate, channels = wav_file.getframerate(), wav_file.getnchannels()
+            elif (wav_file.getframerate(), wav_file.getnchannels()) != (sample_rate, channels):
+                raise Exception(f'Sample rate or number of channels of {path} differ from the other stimuli')
+            stimuli.append(np.frombuffer(wav_file.readframes(wav_file.getnframes()), dtype='<i2'))
+        names.append(os.path.basename(path))
+        levels.append(level)
+
+    segments, references = build_segments(stimuli)
+    encoded = [_encode_segment(segment) for segment in segments]
+    segment_table = []
+    offset = 0
+    for segment, data in zip(segments, encoded):
+        segment_table.append([offset, len(data), len(segment)])
+        offset += len(data)
+
+    header = {'task': stimulus_index.task,
+              'stim_prefix': stimulus_index.stim_prefix,
+              'dtype': '<i2',
+              'sample_rate': sample_rate,
+              'channels': channels,
+              'expected_levels': sorted(stimulus_index.expected_levels),
+              'segments': segment_table,
+              'stimuli': [{'name': name, 'level': level, 'frames': len(samples) // (channels or 1),
+                           'references': stimulus_references}
+                          for name, level, samples, stimulus_references in zip(names, levels, stimuli, references)],
+              'sources': source_signatures(stimulus_index.stimuli_path)}
+    header_bytes = json.dumps(header).encode('utf-8')
+
+    # written to a temporary file first so that an interrupted run leaves no store
+    temporary_path = store_path + '.tmp'
+    with open(temporary_path, 'wb') as store_file:
+        store_file.write(store_magic + struct.pack('<Q', len(header_bytes)) + header_bytes)
+        for data in encoded:
+            store_file.write(data)
+    os.replace(temporary_path, store_path)
+
+    unique_samples = sum(len(segment) for segment in segments)
+    total_samples = sum(len(samples) for samples in stimuli)
+    return {'raw_bytes': 2 * total_samples,
+            'stored_bytes': os.path.getsize(store_path),
+            'shared_samples': total_samples - unique_samples,
+            'samples': total_samples}
+
+
+class DedupStore:
+    """
+    Reader of a store, with the interface of StimulusPack (jnd_pack.py).
+
+    Attributes:
+        path (str): The path of the store.
+        task (str): The task of the stimuli.
+        sample_rate (int): The sample rate of all stimuli in Hz.
+        channels (int): The number of channels of all stimuli.
+        expected_levels (list): The levels listed in the manipulation csv file of the task.
+        entries (dict): Maps the file name of each stimulus to its 'level', 'frames' and 'references'.
+        sources (dict): The modification time and size of the wav files the store was written from, or None.
+    """
+
+    def __init__(self, path, cached_segments=16):
+        """
+        Read the header of a store.
+
+        Args:
+            path (str): The path of the store.
+            cached_segments (int, optional): The number of decoded segments kept in memory, so that the segments
+                of stimuli that are played repeatedly are decoded once. Defaults to 16.
+
+        Raises:
+            Exception: If the file is not a store.
+        """
+        self.path = path
+        with open(path, 'rb') as store_file:
+            if store_file.read(len(store_magic)) != store_magic:
+                raise Exception(f'Not a deduplicated stimulus store: {path}')
+            header_length, = struct.unpack('<Q', store_file.read(8))
+            header = json.loads(store_file.read(header_length).decode('utf-8'))
+        self._data_offset = len(store_magic) + 8 + header_length
+
+        self.task = header['task']
+        self.sample_rate = header['sample_rate']
+        self.channels = header['channels']
+        self.expected_levels = header['expected_levels']
+        self.entries = {entry['name']: entry for entry in header['stimuli']}
+        self.sources = header.get('sources')
+        self._segments = header['segments']
+        self._file = open(path, 'rb')
+        self._lock = threading.Lock()  # stimuli are read by the trial loop and by the prefetch worker
+        self._segment = functools.lru_cache(maxsize=cached_segments)(self._read_segment)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def stale_sources(self, stimuli_path):
+        """Return the wav files of the stimulus directory that changed since the store was written, see stale_sources."""
+        return stale_sources(self.sources, stimuli_path)
+
+    def _read_segment(self, segment):
+        """Read and decode one segment."""
+        offset, length, _ = self._segments[segment]
+        with self._lock:
+            self._file.seek(self._data_offset + offset)
+            data = self._file.read(length)
+        return _decode_segment(data)
+
+    def duration(self, name):
+        """Return the duration of a stimulus in seconds."""
+        return self.entries[name]['frames'] / self.sample_rate
+
+    def samples(self, name):
+        """
+        Reconstruct the PCM samples of a stimulus.
+
+        Args:
+            name (str): The file name of the stimulus.
+
+        Returns:
+            numpy.ndarray: The int16 samples (one column per channel for multichannel stimuli).
+        """
+        samples = np.concatenate([self._segment(segment)[start:start + length]
+                                  for segment, start, length in self.entries[name]['references']] or
+                                 [np.zeros(0, dtype='<i2')])
+        if self.channels > 1:
+            samples = samples.reshape(-1, self.channels)
+        return samples
+
+    def float_samples(self, name):
+        """
+        Return the samples of a stimulus as float32 array in the range -1 to 1, like read_wav in jnd_audio.py.
+
+        Args:
+            name (str): The file name of the stimulus.
+
+        Returns:
+            numpy.ndarray: The samples.
+        """
+        return self.samples(name).astype(np.float32) / 32768.0
+
+    def warm_up(self):
+        """Read the whole store into the page cache of the operating system with one sequential read."""
+        with open(self.path, 'rb') as store_file:
+            while store_file.read(1 << 24):
+                pass
+
+    def close(self):
+        """Close the store file. Closing it again has no effect."""
+        with self._lock:
+            self._file.close()
+        self._segment.cache_clear()
+
+
+def verify_store(store, stimulus_index):
+    """
+    Compare every reconstructed stimulus of a store sample-for-sample with the wav files of the stimulus directory.
+
+    Args:
+        store (DedupStore): The store.
+        stimulus_index (StimulusIndex): The index of the stimulus directory (built with use_pack=False).
+
+    Returns:
+        list: The file names of the stimuli that are missing in the store or differ from their wav file.
+    """
+    mismatches = []
+    for path in stimulus_index.files.values():
+        name = os.path.basename(path)
+        with wave.open(path, 'rb') as wav_file:
+            frames = np.frombuffer(wav_file.readframes(wav_file.getnframes()), dtype='<i2')
+        if name not in store.entries or not np.array_equal(store.samples(name).reshape(-1), frames):
+            mismatches.append(name)
+    return mismatches
+
+
+if __name__ == '__main__':
+    import argparse
+    from jnd_configuration import general_experiment_configs, get_task_specific_config
+    from jnd_stimuli import StimulusIndex
+
+    parser = argparse.ArgumentParser(description='Store the stimuli of each task compressed, identical stimuli once.')
+    parser.add_argument('tasks', nargs='*', default=general_experiment_configs["task_types"])
+    parser.add_argument('--verify', action='store_true',
+                        help='only compare existing stores sample-for-sample with the wav files')
+    args = parser.parse_args()
+
+    for task in args.tasks:
+        directory_index = StimulusIndex(get_task_specific_config(task), use_pack=False, synthesize=False)
+        path = dedup_path_for(directory_index.stimuli_path)
+        if args.verify:
+            with DedupStore(path) as dedup_store:
+                mismatches = verify_store(dedup_store, directory_index)
+            print(f"{task}: {len(directory_index.files) - len(mismatches)} of {len(directory_index.files)} stimuli "
+                  f"identical{': differing ' + ', '.join(mismatches) if mismatches else ''}")
+        else:
+            sizes = write_store(directory_index, path)
+            print(f"{task}: {len(directory_index.files)} stimuli, {sizes['raw_bytes'] / 1e6:.1f} MB of samples "
+                  f"stored in {sizes['stored_bytes'] / 1e6:.1f} MB ({path}); "
+                  f"{100 * sizes['shared_samples'] / max(sizes['samples'], 1):.1f}% of the samples are in identical stimuli")
@@ -15,7 +15,9 @@ pattern (AAB or ABB sequences, randomly chosen).
 
 The module checks the necessary paths for input and output, collects participant information, creates an experiment
 window, and then iterates through the randomized tasks, executing practice sessions and trials for each task while
-providing appropriate on-screen feedback and instructions for the participant.
+providing appropriate on-screen feedback and instructions for the participant. If general_experiment_configs
+["interleaved"] is set, the practice sessions of all tasks are run first, followed by one block in which the trials of
+all tasks are interleaved.
 
 Functions:
 ----------
@@ -30,6 +32,12 @@ core of the application.
 - jnd_task_setup: A module that sets up the JND task, it provides a function to run the task and another to get
 participant information.
 - pathchecks: A module that verifies if input and output paths exist.
+- jnd_warmup: A module that, while the participant dialog is open, repairs results files cut off by a crash,
+indexes the stimulus files of each task and decodes the stimuli each task starts with.
+- jnd_resume: A module that finds an interrupted run of the subject and restores its staircase.
+- jnd_visualization: A module that renders the staircase plots in a background process.
+- jnd_startup: A module that times the phases of the startup; the report is printed and appended to
+'results/startup_times.csv'. matplotlib and psychopy.sound are not imported before the participant dialog.
 - instructions: A module that returns the instruction text for a given task.
 
 Original Version by: Yana Palacheva (https://github.com/YanaPalacheva/perturbation_study/tree/main/jnd_experiment)
@@ -37,72 +45,162 @@ Adapted Version by: Andrea Hofmann
 """
 
 
-from psychopy import core, visual, event
-from jnd_configuration import general_experiment_configs, randomized_tasks, create_window
-from jnd_task_setup import run_jnd_task, get_participant_info
-from jnd_path import check_config_paths
-from jnd_instructions import get_instruction_text
-
-
-# Check if input and output paths exist
-check_config_paths(general_experiment_configs["base_stimuli_path"],
-                   general_experiment_configs["task_types"],
-                   general_experiment_configs["output_path"],
-                   general_experiment_configs["plot_path"])  # make sure that in and out paths exist
-
-# load parameter value from function to be set to 1 - parameter will be iterated later
-test_nr = 1
-
-# Open participant information GUI
-exp_data = get_participant_info()
-
-# Create the window
-win = create_window()
-
-win.flip()
+import multiprocessing
+from jnd_startup import StartupReport
+
+# time the imports and the other phases of the startup (see jnd_startup.py)
+startup_report = StartupReport()
+with startup_report.phase('import psychopy'):
+    from psychopy import core, visual, event
+with startup_report.phase('import jnd_task_setup'):
+    from jnd_task_setup import run_jnd_task, run_interleaved_session, get_participant_info, confirm_resume, load_sound
+with startup_report.phase('import other modules'):
+    from jnd_configuration import general_experiment_configs, randomized_tasks, create_window
+    from jnd_path import check_config_paths
+    from jnd_instructions import get_instruction_text, get_interleaved_instruction_text
+    from jnd_warmup import StartupWarmUp
+    from jnd_resume import find_interrupted_session
+    from jnd_visualization import wait_for_visualizations
+
+
+def main():
+    """Run the experiment: check the paths, collect the participant information and run all tasks."""
+    # Check if input and output paths exist
+    with startup_report.phase('check paths'):
+        check_config_paths(general_experiment_configs["base_stimuli_path"],
+                           general_experiment_configs["task_types"],
+                           general_experiment_configs["output_path"],
+                           general_experiment_configs["plot_path"])  # make sure that in and out paths exist
+
+    # While the participant dialog is open, repair results files that were cut off when a previous session crashed,
+    # index the stimulus files of each task and decode the stimuli the sessions start with - in the background
+    warm_up = StartupWarmUp(randomized_tasks, general_experiment_configs["output_path"])
+
+    # load parameter value from function to be set to 1 - parameter will be iterated later
+    test_nr = 1
+
+    # Open participant information GUI
+    exp_data = get_participant_info()
+
+    # Report missing stimuli before the session starts
+    with startup_report.phase('wait for warm-up'):
+        stimulus_indices, stimulus_caches = warm_up.result()
+
+    # Continue an interrupted run of this subject: skip the tasks it completed and resume the interrupted task without
+    # its practice session
+    task_order = list(randomized_tasks)
+    completed_tasks = []
+    resume_paths = {}
+    interrupted_session = None
+    if not general_experiment_configs["interleaved"]:  # an interleaved block is not resumed
+        interrupted_session = find_interrupted_session(general_experiment_configs["output_path"],
+                                                       exp_data['subject'],
+                                                       general_experiment_configs["task_types"])
+    if interrupted_session is not None and not confirm_resume(interrupted_session):
+        print(f"Not resuming {interrupted_session['path']}: declined by the experimenter")
+        interrupted_session = None
+    if interrupted_session is not None:
+        print(f"Resuming task {interrupted_session['task']} after trial {len(interrupted_session['rows'])} "
+              f"from {interrupted_session['path']}")
+        if interrupted_session['date'] is not None:
+            exp_data['cur_date'] = interrupted_session['date']
+        completed_tasks = interrupted_session['completed_tasks']
+        resume_paths[interrupted_session['task']] = interrupted_session['path']
+        task_order = completed_tasks + [interrupted_session['task']] + \
+            [task for task in randomized_tasks if task not in completed_tasks and task != interrupted_session['task']]
+
+    # Create the window
+    with startup_report.phase('create window'):
+        win = create_window()
+        win.flip()
 
-# Iterate through randomized tasks and execute practice sessions and trials
-for ind, task in enumerate(randomized_tasks):
-    # Run practice session
-    run_jnd_task(exp_data, task, win, session_type='practice')
+    # Load the audio library before the first trial, not while it is played
+    with startup_report.phase('import psychopy.sound'):
+        load_sound()
+    startup_report.report(general_experiment_configs["output_path"])
+
+    if general_experiment_configs["interleaved"]:
+        # Practice each task, then run the trials of all tasks interleaved in one block
+        for task in task_order:
+            run_jnd_task(exp_data, task, win, session_type='practice', stimulus_index=stimulus_indices[task],
+                         stimulus_cache=stimulus_caches[task])
+
+        num_trials = general_experiment_configs["psi_trials"] if general_experiment_configs["procedure"] == 'psi' \
+            else general_experiment_configs["num_trials"]
+        visual.TextStim(win, text=get_interleaved_instruction_text(task_order, num_trials),
+                        color='black',
+                        wrapWidth=2,
+                        height=0.1).draw()
+        win.flip()
+        event.waitKeys(keyList=['return'])  # wait for participant to react by pressing return
+        win.flip()
 
-    # Display the appropriate instruction text based on the task
-    instruction_text = get_instruction_text(task, ind)
-    visual.TextStim(win, text=instruction_text,
+        run_interleaved_session(stimulus_indices, stimulus_caches, exp_data, task_order, win)
+    else:
+        # Iterate through randomized tasks and execute practice sessions and trials
+        for ind, task in enumerate(task_order):
+            if task in completed_tasks:  # completed before the run was interrupted
+                test_nr += 1
+                continue
+
+            # Decoded stimuli are shared between the practice session and the experiment of a task
+            stimulus_cache = stimulus_caches[task]
+
+            # Run practice session - not repeated when an interrupted task is resumed
+            if task not in resume_paths:
+                run_jnd_task(exp_data, task, win, session_type='practice', stimulus_index=stimulus_indices[task],
+                             stimulus_cache=stimulus_cache)
+
+            # Display the appropriate instruction text based on the task
+            instruction_text = get_instruction_text(task, ind)
+            visual.TextStim(win, text=instruction_text,
+                            color='black',
+                            wrapWidth=2,
+                            height=0.1).draw()
+
+            win.flip()
+            event.waitKeys(keyList=['return'])  # wait for participant to react by pressing return
+            win.flip()
+
+            # Run the experiment
+            run_jnd_task(exp_data, task, win, stimulus_index=stimulus_indices[task], stimulus_cache=stimulus_cache,
+                         resume_path=resume_paths.get(task))
+
+            # after each task
+            if test_nr <= 2:
+                pause_text = f"Sie haben {test_nr} von 3 Tests geschafft.\n Drücken Sie Enter, sobald Sie bereit sind, weiterzumachen."
+                # display instructions and wait
+                pause_stimulus = visual.TextStim(win,
+                                                 color='black',
+                                                 wrapWidth=2,
+                                                 height=0.1,
+                                                 text=pause_text)
+
+                pause_stimulus.draw()
+                win.flip()
+                event.waitKeys(keyList=['return'])
+                win.flip()
+
+            test_nr += 1
+
+    # Display experiment completion message
+    visual.TextStim(win, text='Hervorragend, Sie haben es geschafft. \n Vielen Dank! \n Drücken Sie Enter zum Beenden.',
                     color='black',
                     wrapWidth=2,
                     height=0.1).draw()
-
-    win.flip()
-    event.waitKeys(keyList=['return'])  # wait for participant to react by pressing return
     win.flip()
+    event.waitKeys(keyList=['return'])
+    win.close()
 
-    # Run the experiment
-    run_jnd_task(exp_data, task, win)
+    # Close the stimulus packs
+    for stimulus_index in stimulus_indices.values():
+        stimulus_index.close()
 
-    # after each task
-    if test_nr <= 2:
-        pause_text = f"Sie haben {test_nr} von 3 Tests geschafft.\n Drücken Sie Enter, sobald Sie bereit sind, weiterzumachen."
-        # display instructions and wait
-        pause_stimulus = visual.TextStim(win,
-                                         color='black',
-                                         wrapWidth=2,
-                                         height=0.1,
-                                         text=pause_text)
+    # Wait until the plots of the last test are saved
+    wait_for_visualizations()
+    core.quit()
 
-        pause_stimulus.draw()
-        win.flip()
-        event.waitKeys(keyList=['return'])
-        win.flip()
 
-    test_nr += 1
-
-# Display experiment completion message
-visual.TextStim(win, text='Hervorragend, Sie haben es geschafft. \n Vielen Dank! \n Drücken Sie Enter zum Beenden.',
-                color='black',
-                wrapWidth=2,
-                height=0.1).draw()
-win.flip()
-event.waitKeys(keyList=['return'])
-win.close()
-core.quit()
+if __name__ == '__main__':
+    multiprocessing.freeze_support()  # plots are rendered in a child process, also in the PyInstaller build
+    main()
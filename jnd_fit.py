@@ -0,0 +1,205 @@
+"""
+jnd_fit.py
+
+This module estimates the JND of each subject and task by fitting a psychometric function to all trials of the
+trial sessions, instead of averaging only the levels of the last six reversals as calculate_threshold does.
+
+The psychometric function is the Weibull function of jnd_simulation.py with a guess rate of 1/2, as in the
+two-alternative AXB design, and a fixed lapse rate. The maximum-likelihood parameters are found on a grid of
+thresholds and slopes. Each subject x task is reduced to the number of trials and correct responses per difference
+level; with the log probabilities of all grid points tabulated per level, the log likelihood of all fits (and of all
+bootstrap samples) is one matrix product, so the whole study is fitted at once.
+
+Confidence intervals come from a nonparametric bootstrap: the trials of a subject x task are resampled with
+replacement and fitted again.
+
+Functions:
+----------
+- parameter_grid(task, n_thresholds, n_slopes): The grid of Weibull thresholds and slopes for a task.
+
+- fit_counts(n_correct, n_total, differences, thresholds, slopes, lapse): Maximum-likelihood grid fit of many sets
+of response counts at once.
+
+- fit_dataset(dataset, n_bootstrap, lapse, confidence, seed): Fits every subject x task of the aggregated results.
+
+Usage:
+------
+    python jnd_fit.py [--dataset results/jnd_results.parquet] [--output results/jnd_fits.csv] [--bootstrap 200]
+"""
+
+
+import argparse
+import os
+import time
+import numpy as np
+import pandas as pd
+from jnd_configuration import general_experiment_configs, get_task_specific_config
+from jnd_simulation import psychometric_function, target_difference
+from jnd_stimuli import level_scales
+
+
+# number of rows of the count matrix whose log likelihoods are computed in one matrix product
+chunk_size = 2048
+
+
+def parameter_grid(task, n_thresholds=100, n_slopes=40):
+    """
+    Grid of Weibull thresholds and slopes for a task.
+
+    The thresholds are log-spaced from the smallest difference that exists on disk (one level) to twice the
+    initial difference of the task, the slopes from 0.5 to 10.
+
+    Args:
+        task (str): The task name ("pitch", "FL", or "pause").
+        n_thresholds (int, optional): The number of thresholds. Defaults to 100.
+        n_slopes (int, optional): The number of slopes. Defaults to 40.
+
+    Returns:
+        tuple: The thresholds and the slopes (numpy.ndarray).
+    """
+    smallest_difference = 1.0 / level_scales[task]
+    initial_difference = get_task_specific_config(task)["initial_difference"]
+    thresholds = np.geomspace(smallest_difference, 2 * initial_difference, n_thresholds)
+    slopes = np.geomspace(0.5, 10.0, n_slopes)
+    return thresholds, slopes
+
+
+def fit_counts(n_correct, n_total, differences, thresholds, slopes, lapse=0.02):
+    """
+    Maximum-likelihood fit of the psychometric function for many sets of response counts at once.
+
+    Args:
+        n_correct (numpy.ndarray): The number of correct responses, one row per fit and one column per difference.
+        n_total (numpy.ndarray): The number of trials, same shape as n_correct.
+        differences (numpy.ndarray): The difference of each column.
+        thresholds (numpy.ndarray): The Weibull thresholds of the grid.
+        slopes (numpy.ndarray): The Weibull slopes of the grid.
+        lapse (float, optional): The lapse rate. Defaults to 0.02.
+
+    Returns:
+        tuple: The threshold, the slope and the maximum log likelihood of each row.
+    """
+    threshold_grid, slope_grid = np.meshgrid(thresholds, slopes, indexing='ij')
+    p_correct = psychometric_function(np.asarray(differences, dtype=float)[:, None],
+                                      threshold_grid.ravel()[None, :], slope_grid.ravel()[None, :], lapse)
+    p_correct = np.clip(p_correct, 1e-12, 1 - 1e-12)
+    # correct responses weigh log p, incorrect responses log (1 - p): one product for both, in single precision,
+    # which is ample to find the maximum
+    log_probabilities = np.concatenate([np.log(p_correct), np.log1p(-p_correct)]).astype(np.float32)
+
+    n_correct = np.asarray(n_correct, dtype=np.float32)
+    counts = np.concatenate([n_correct, np.asarray(n_total, dtype=np.float32) - n_correct], axis=1)
+    best = np.empty(len(counts), dtype=np.int64)
+    log_likelihood = np.empty(len(counts))
+    for start in range(0, len(counts), chunk_size):
+        chunk = counts[start:start + chunk_size] @ log_probabilities  # rows x grid points
+        best[start:start + chunk_size] = np.argmax(chunk, axis=1)
+        log_likelihood[start:start + chunk_size] = chunk[np.arange(len(chunk)), best[start:start + chunk_size]]
+    return threshold_grid.ravel()[best], slope_grid.ravel()[best], log_likelihood
+
+
+def _bootstrap_counts(cell_counts, n_bootstrap, rng):
+    """
+    Resample the trials of each fit with replacement.
+
+    Args:
+        cell_counts (numpy.ndarray): Trials per (difference, response) cell, one row per fit; the first half of the
+            columns are the correct, the second half the incorrect responses.
+        n_bootstrap (int): The number of bootstrap samples per fit.
+        rng (numpy.random.Generator): The random number generator.
+
+    Returns:
+        numpy.ndarray: The resampled cell counts, n_bootstrap rows per fit.
+    """
+    samples = []
+    for counts in cell_counts:
+        n_trials = counts.sum()
+        samples.append(rng.multinomial(n_trials, counts / n_trials, size=n_bootstrap))
+    return np.concatenate(samples)
+
+
+def fit_dataset(dataset, n_bootstrap=200, lapse=0.02, confidence=0.95, seed=None):
+    """
+    Fit the psychometric function to the trial sessions (separate or interleaved) of every subject x task.
+
+    Args:
+        dataset (pandas.DataFrame): The trials, with the columns of the dataset of jnd_aggregate.py.
+        n_bootstrap (int, optional): The number of bootstrap samples per fit; 0 for no confidence intervals.
+            Defaults to 200.
+        lapse (float, optional): The lapse rate. Defaults to 0.02.
+        confidence (float, optional): The level of the confidence intervals. Defaults to 0.95.
+        seed (int, optional): The seed of the bootstrap.
+
+    Returns:
+        pandas.DataFrame: One row per subject x task with the number of trials, the Weibull threshold and slope,
+        the JND (the difference at 70.7% correct, the target of the 2-down-1-up staircase) and its confidence
+        interval.
+    """
+    rng = np.random.default_rng(seed)
+    trials = dataset[dataset['session_type'].isin(['trial', 'interleaved']) & dataset['correct'].notna() &
+                     dataset['difference'].notna()]
+    fits = []
+    for task, task_trials in trials.groupby('task'):
+        if task not in level_scales:
+            continue
+        # all fits of a task share the columns of the count matrix: the difference levels of the task
+        levels = np.rint(task_trials['difference'].to_numpy(dtype=float) * level_scales[task]).astype(np.int64)
+        unique_levels, level_columns = np.unique(levels, return_inverse=True)
+        differences = unique_levels / level_scales[task]
+        fit_rows, fit_keys = pd.factorize(task_trials['subjectID'])
+        correct = task_trials['correct'].to_numpy(dtype=bool)
+
+        cell_counts = np.zeros((len(fit_keys), 2 * len(differences)))
+        np.add.at(cell_counts, (fit_rows, level_columns + len(differences) * ~correct), 1)
+        n_correct = cell_counts[:, :len(differences)]
+        n_total = n_correct + cell_counts[:, len(differences):]
+
+        thresholds, slopes = parameter_grid(task)
+        threshold, slope, _ = fit_counts(n_correct, n_total, differences, thresholds, slopes, lapse)
+        task_fits = pd.DataFrame({'subjectID': fit_keys,
+                                  'task': task,
+                                  'trials': n_total.sum(axis=1).astype(int),
+                                  'threshold': threshold,
+                                  'slope': slope,
+                                  'jnd': target_difference(threshold, slope, lapse)})
+
+        if n_bootstrap:
+            samples = _bootstrap_counts(cell_counts, n_bootstrap, rng)
+            sample_correct = samples[:, :len(differences)]
+            sample_threshold, sample_slope, _ = fit_counts(sample_correct,
+                                                           sample_correct + samples[:, len(differences):],
+                                                           differences, thresholds, slopes, lapse)
+            sample_jnd = target_difference(sample_threshold, sample_slope, lapse).reshape(len(fit_keys), n_bootstrap)
+            tail = 100 * (1 - confidence) / 2
+            task_fits['jnd_ci_low'] = np.percentile(sample_jnd, tail, axis=1)
+            task_fits['jnd_ci_high'] = np.percentile(sample_jnd, 100 - tail, axis=1)
+        fits.append(task_fits)
+
+    if not fits:
+        return pd.DataFrame(columns=['subjectID', 'task', 'trials', 'threshold', 'slope', 'jnd'])
+    return pd.concat(fits, ignore_index=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fit psychometric functions to the JND results of all subjects.')
+    parser.add_argument('--dataset', default=None,
+                        help='Parquet dataset of jnd_aggregate.py (default: aggregate the results directory)')
+    parser.add_argument('--output', default=None, help='csv file to write (default: results/jnd_fits.csv)')
+    parser.add_argument('--bootstrap', type=int, default=200, help='bootstrap samples per fit')
+    parser.add_argument('--lapse', type=float, default=0.02)
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    if args.dataset is None:
+        from jnd_aggregate import aggregate_results
+        results = aggregate_results()
+    else:
+        results = pd.read_parquet(args.dataset)
+    output = args.output or os.path.join(general_experiment_configs['output_path'], 'jnd_fits.csv')
+
+    start = time.perf_counter()
+    psychometric_fits = fit_dataset(results, args.bootstrap, args.lapse, seed=args.seed)
+    elapsed = time.perf_counter() - start
+    psychometric_fits.to_csv(output, index=False)
+    print(f"Fitted {len(psychometric_fits)} subject x task combinations in {elapsed:.2f} s, wrote {output}")
+    print(psychometric_fits.to_string(index=False))
@@ -0,0 +1,144 @@
+"""
+jnd_frames.py
+
+This module monitors the frame intervals of the window of the Just-Noticeable-Difference (JND) experiment, to detect
+computers whose display cannot keep up with the refresh rate of the monitor.
+
+The screens of a trial are static, so by default the window is flipped once per screen and the experiment waits in
+between. With "frame_monitoring" in general_experiment_configs, the screens of the timed phases of a trial - the
+audio icon during the playback ('listening'), the feedback of the practice ('feedback') and the blank screen between
+the trials ('inter-trial') - are redrawn on every frame instead, and PsychoPy records the interval between the
+flips. An interval longer than the refresh threshold of the window means that frames were dropped.
+
+At the end of a session, the number of frames, the dropped frames and the percentiles of the frame intervals of each
+phase are printed and appended to 'frame_intervals.csv' in the results directory of the subject. If more than
+"max_dropped_frames" of the frames of a phase were dropped, the computer is flagged as too slow.
+
+Module Level Variables:
+-----------------------
+- frame_columns: The columns of the frame intervals file.
+
+Classes:
+--------
+- FrameMonitor: Holds the screens of the timed phases of a session and records their frame intervals.
+"""
+
+
+import csv
+import datetime
+import os
+import platform
+import time
+import numpy as np
+from jnd_configuration import general_experiment_configs
+
+
+frame_columns = ['date', 'computer', 'task', 'session_type', 'results_file', 'phase', 'frames', 'dropped_intervals',
+                 'dropped_frames', 'dropped_percent', 'frame_period_ms', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms',
+                 'too_slow']
+
+
+class FrameMonitor:
+    """
+    Holds the screens of the timed phases of a session, flipping on every frame, and records the frame intervals.
+
+    Attributes:
+        win (visual.Window): The window of the experiment.
+        frame_period (float): The refresh period of the monitor in seconds, as measured by PsychoPy.
+        refresh_threshold (float): Frame intervals longer than this (seconds) mean that frames were dropped.
+        intervals (dict): The recorded frame intervals in seconds of each phase.
+    """
+
+    def __init__(self, win):
+        """
+        Start monitoring a session.
+
+        Args:
+            win (visual.Window): The window of the experiment.
+        """
+        self.win = win
+        self.frame_period = win.monitorFramePeriod
+        self.refresh_threshold = win.refreshThreshold
+        self.intervals = {}
+
+    def hold(self, phase, seconds, stimuli=()):
+        """
+        Show the current screen for a time, drawing the stimuli and flipping on every frame.
+
+        Args:
+            phase (str): The phase of the trial the intervals are recorded for, e.g. 'listening'.
+            seconds (float): How long the screen is shown. The last frame ends up to one frame period later.
+            stimuli (tuple, optional): The stimuli of the screen, which are drawn before every flip.
+        """
+        end = time.perf_counter() + seconds
+        first = len(self.win.frameIntervals)
+        self.win.recordFrameIntervals = True  # the interval before the first flip is not recorded
+        while time.perf_counter() < end:
+            for stimulus in stimuli:
+                stimulus.draw()
+            self.win.flip()
+        self.win.recordFrameIntervals = False
+        self.intervals.setdefault(phase, []).extend(self.win.frameIntervals[first:])
+
+    def summary(self):
+        """
+        Summarize the frame intervals of each phase.
+
+        Returns:
+            dict: For each phase, a dictionary with the number of 'frames', the intervals longer than the refresh
+            threshold ('dropped_intervals'), the number of frames they skipped ('dropped_frames'), the fraction of
+            dropped frames ('dropped_fraction'), the 'p50', 'p95', 'p99' and 'max' interval in seconds and whether
+            the fraction exceeds "max_dropped_frames" ('too_slow').
+        """
+        summary = {}
+        for phase, intervals in self.intervals.items():
+            if not intervals:
+                continue
+            intervals = np.asarray(intervals)
+            dropped = intervals > self.refresh_threshold
+            # an interval of n frame periods skipped n - 1 frames
+            dropped_frames = int(np.sum(np.maximum(np.round(intervals[dropped] / self.frame_period) - 1, 1)))
+            dropped_fraction = dropped_frames / (len(intervals) + dropped_frames)
+            p50, p95, p99 = np.percentile(intervals, [50, 95, 99])
+            summary[phase] = {'frames': len(intervals),
+                              'dropped_intervals': int(np.sum(dropped)),
+                              'dropped_frames': dropped_frames,
+                              'dropped_fraction': dropped_fraction,
+                              'p50': p50, 'p95': p95, 'p99': p99, 'max': intervals.max(),
+                              'too_slow': dropped_fraction > general_experiment_configs["max_dropped_frames"]}
+        return summary
+
+    def report(self, task, session_type, results_path):
+        """
+        Print the frame intervals of the session, warn if the computer is too slow and append them to
+        'frame_intervals.csv' next to the results file.
+
+        Args:
+            task (str): The task name.
+            session_type (str): The session type, e.g. 'trial' or 'practice'.
+            results_path (str): The results file of the session.
+        """
+        summary = self.summary()
+        if not summary:
+            return
+        for phase, values in summary.items():
+            print(f"{task} {session_type} {phase}: {values['frames']} frames, {values['dropped_frames']} dropped "
+                  f"({values['dropped_fraction']:.2%}), frame interval p95 {values['p95'] * 1000:.1f} ms, "
+                  f"max {values['max'] * 1000:.1f} ms (refresh period {self.frame_period * 1000:.1f} ms)")
+            if values['too_slow']:
+                print(f"WARNING: {platform.node()} dropped {values['dropped_fraction']:.2%} of the frames during "
+                      f"{phase} ({task} {session_type}); the display of this computer is too slow for the experiment.")
+
+        path = os.path.join(os.path.dirname(results_path), 'frame_intervals.csv')
+        write_header = not os.path.exists(path)
+        date = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        with open(path, 'a', newline='', encoding='utf-8') as frames_file:
+            writer = csv.writer(frames_file)
+            if write_header:
+                writer.writerow(frame_columns)
+            for phase, values in summary.items():
+                writer.writerow([date, platform.node(), task, session_type, os.path.basename(results_path), phase,
+                                 values['frames'], values['dropped_intervals'], values['dropped_frames'],
+                                 round(values['dropped_fraction'] * 100, 3), round(self.frame_period * 1000, 3)] +
+                                [round(values[key] * 1000, 3) for key in ('p50', 'p95', 'p99', 'max')] +
+                                [values['too_slow']])
@@ -5,10 +5,14 @@ in a listening task, and a function to generate the instruction text based on th
 Constants:
     pitch_FL_text (str): Instruction text for tasks related to the pitch and Fundamental Frequency (FL).
     pause_text (str): Instruction text for tasks related to pauses.
+    task_minutes (dict): The duration in minutes of the test of each task with 120 trials, as announced by
+    get_instruction_text.
 
 Functions:
     get_instruction_text(task: str, ind: int) -> str: Returns the instruction text for a particular task, given the
     task type and index.
+    get_interleaved_instruction_text(tasks: list, num_trials: int) -> str: Returns the instruction text of the block in
+    which the trials of all tasks are interleaved, with its duration estimated from the number of trials.
 
 Note:
     The instruction texts are in German and guide the participant through a task involving listening to sequences of
@@ -42,6 +46,9 @@ Wenn Sie denken, die DRITTE Wortgruppe ist anders, \n drücken Sie \u2192 den Pf
 Drücken Sie eine 'Enter', dann starten die Übungsbeispiele.
 """
 
+# duration of the test of each task with 120 trials in minutes, as announced in get_instruction_text
+task_minutes = {'pause': 18, 'pitch': 8, 'FL': 8}
+
 def get_instruction_text(task, ind):
     """
     Generates instruction text for the participant depending on the current task and the index of the task.
@@ -86,3 +93,30 @@ def get_instruction_text(task, ind):
                f"denn die Unterschiede werden immer kleiner. \n" \
                f"Bitte antworten Sie dennoch immer so akkurat, wie möglich.\n\n" \
                f"Drücken Sie eine 'Enter' sobald Sie bereit sind."
+
+
+def get_interleaved_instruction_text(tasks, num_trials):
+    """
+    Generates the instruction text shown before the block in which the trials of all tasks are interleaved.
+
+    Parameters:
+    tasks (list): The tasks of the block.
+    num_trials (int): The number of trials of each task.
+
+    Returns:
+    str: The instruction text to be shown to the participant.
+
+    The duration of the block is the sum of the durations of the tests of its tasks (task_minutes), scaled to the
+    number of trials.
+    """
+    minutes = max(1, round(sum(task_minutes[task] for task in tasks) * num_trials / 120))
+    return f"Sehr gut!\n" \
+           f"Wenn Sie noch Fragen haben, geben Sie der Versuchsleiterin Bescheid.\n\n" \
+           f"Im folgenden Teil hören Sie die Namen und Wortgruppen\n" \
+           f"aller Übungen in zufälliger Reihenfolge.\n" \
+           f"Dieser Teil dauert ca. {minutes} Minuten. Zwischendurch können Sie Pausen machen.\n\n" \
+           f"Beachten Sie: \n" \
+           f"Die Aufgabe wird nach und nach immer schwieriger,\n " \
+           f"denn die Unterschiede werden immer kleiner. \n" \
+           f"Bitte antworten Sie dennoch immer so akkurat, wie möglich.\n\n" \
+           f"Drücken Sie eine 'Enter' sobald Sie bereit sind."
@@ -0,0 +1,325 @@
+"""
+jnd_pack.py
+
+This module stores the stimulus set of a Just-Noticeable-Difference (JND) task in a single pack file instead of
+thousands of loose wav files, and reads the stimuli from the pack at runtime.
+
+A pack ('audio/audio-<task>.jndpack', next to the stimulus directory) consists of:
+    - the magic bytes b'JNDPACK1' and the length of the header as 8-byte little-endian integer,
+    - a JSON header with the task, sample format (16-bit PCM), sample rate, number of channels, the levels of the
+      manipulation csv file, for every stimulus its file name, level, offset and length in frames, and the
+      modification time and size of the wav files the pack was written from,
+    - the PCM samples of all stimuli, contiguous and in level order, starting at a multiple of 4096 bytes.
+
+At runtime the sample data are memory-mapped, so every stimulus is a zero-copy slice of the mapping. Copying the
+stimulus set to a new booth copies one file, and reading all stimuli is one sequential read. If a pack exists for a
+task, StimulusIndex (jnd_stimuli.py) uses it instead of scanning the stimulus directory - unless the wav files in the
+stimulus directory were changed, added or removed after the pack was written (see stale_sources), then the wav files
+are read.
+
+Classes:
+--------
+- StimulusPack: Memory-mapped reader of a pack file.
+
+Functions:
+----------
+- pack_path_for(stimuli_path): The path of the pack of a stimulus directory.
+
+- source_signatures(stimuli_path): The modification time and size of the wav files of a stimulus directory.
+
+- stale_sources(recorded_sources, stimuli_path): The wav files that changed since a pack or store was written.
+
+- pack_stimuli(stimulus_index, pack_path): Writes all stimuli of a stimulus index into a pack.
+
+- verify_pack(pack, stimulus_index): Compares the pack sample-for-sample with the wav files.
+
+Usage:
+------
+    python jnd_pack.py [pitch FL pause] [--verify]
+"""
+
+
+import json
+import mmap
+import os
+import struct
+import wave
+import numpy as np
+
+
+pack_magic = b'JNDPACK1'
+pack_extension = '.jndpack'
+pack_alignment = 4096
+
+
+def pack_path_for(stimuli_path):
+    """
+    Return the path of the pack of a stimulus directory, e.g. 'audio/audio-pitch.jndpack' for 'audio/audio-pitch/'.
+
+    Args:
+        stimuli_path (str): The stimulus directory of a task.
+
+    Returns:
+        str: The path of the pack file.
+    """
+    return os.path.normpath(stimuli_path) + pack_extension
+
+
+def source_signatures(stimuli_path):
+    """
+    Return the modification time and size of the wav files of a stimulus directory.
+
+    Args:
+        stimuli_path (str): The stimulus directory of a task.
+
+    Returns:
+        dict: Maps the file name of each wav file to [modification time in ns, size in bytes], or None if the
+        directory does not exist.
+    """
+    if not os.path.isdir(stimuli_path):
+        return None
+    signatures = {}
+    with os.scandir(stimuli_path) as entries:
+        for entry in entries:
+            if os.path.splitext(entry.name)[1].lower() == '.wav' and entry.is_file():
+                stat = entry.stat()
+                signatures[entry.name] = [stat.st_mtime_ns, stat.st_size]
+    return signatures
+
+
+def stale_sources(recorded_sources, stimuli_path):
+    """
+    Compare the wav files a pack or store was written from with the stimulus directory.
+
+    Args:
+        recorded_sources (dict): The signatures of the wav files when the pack was written (see source_signatures),
+            or None for a pack of an older version, which has none.
+        stimuli_path (str): The stimulus directory of the task.
+
+    Returns:
+        list: The names of the wav files that were changed, added or removed since the pack was written, or
+        ['(not recorded)'] if the pack has no signatures. Empty if the stimulus directory does not exist, e.g.
+        on a booth that only has the pack.
+    """
+    current_sources = source_signatures(stimuli_path)
+    if current_sources is None:
+        return []
+    if recorded_sources is None:
+        return ['(not recorded)']
+    return sorted(name for name in set(recorded_sources) | set(current_sources)
+                  if recorded_sources.get(name) != current_sources.get(name))
+
+
+class StimulusPack:
+    """
+    Memory-mapped reader of a stimulus pack.
+
+    Attributes:
+        path (str): The path of the pack file.
+        task (str): The task of the stimuli.
+        sample_rate (int): The sample rate of all stimuli in Hz.
+        channels (int): The number of channels of all stimuli.
+        expected_levels (list): The levels listed in the manipulation csv file of the task.
+        entries (dict): Maps the file name of each stimulus to its 'level', 'offset' and 'frames'.
+        sources (dict): The modification time and size of the wav files the pack was written from, or None.
+    """
+
+    def __init__(self, path):
+        """
+        Read the header of a pack and map its sample data.
+
+        Args:
+            path (str): The path of the pack file.
+
+        Raises:
+            Exception: If the file is not a stimulus pack.
+        """
+        self.path = path
+        with open(path, 'rb') as pack_file:
+            if pack_file.read(len(pack_magic)) != pack_magic:
+                raise Exception(f'Not a stimulus pack: {path}')
+            header_length, = struct.unpack('<Q', pack_file.read(8))
+            header = json.loads(pack_file.read(header_length).decode('utf-8'))
+
+        self.task = header['task']
+        self.sample_rate = header['sample_rate']
+        self.channels = header['channels']
+        self.expected_levels = header['expected_levels']
+        self.entries = {entry['name']: entry for entry in header['stimuli']}
+        self.sources = header.get('sources')
+        total_frames = sum(entry['frames'] for entry in header['stimuli'])
+        self._mmap = None
+        if total_frames:
+            with open(path, 'rb') as pack_file:
+                self._mmap = mmap.mmap(pack_file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._data = np.frombuffer(self._mmap, dtype=header['dtype'], count=total_frames * self.channels,
+                                       offset=header['data_offset'])
+        else:
+            self._data = np.zeros(0, dtype=header['dtype'])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def stale_sources(self, stimuli_path):
+        """Return the wav files of the stimulus directory that changed since the pack was written, see stale_sources."""
+        return stale_sources(self.sources, stimuli_path)
+
+    def duration(self, name):
+        """Return the duration of a stimulus in seconds."""
+        return self.entries[name]['frames'] / self.sample_rate
+
+    def samples(self, name):
+        """
+        Return the PCM samples of a stimulus as zero-copy view of the mapping.
+
+        Args:
+            name (str): The file name of the stimulus.
+
+        Returns:
+            numpy.ndarray: The int16 samples (one column per channel for multichannel stimuli).
+        """
+        entry = self.entries[name]
+        start = entry['offset'] * self.channels
+        samples = self._data[start:start + entry['frames'] * self.channels]
+        if self.channels > 1:
+            samples = samples.reshape(-1, self.channels)
+        return samples
+
+    def float_samples(self, name):
+        """
+        Return the samples of a stimulus as float32 array in the range -1 to 1, like read_wav in jnd_audio.py.
+
+        Args:
+            name (str): The file name of the stimulus.
+
+        Returns:
+            numpy.ndarray: The samples.
+        """
+        return self.samples(name).astype(np.float32) / 32768.0
+
+    def warm_up(self):
+        """Ask the operating system to read the whole pack into the page cache with one sequential read."""
+        if self._mmap is not None and hasattr(mmap, 'MADV_WILLNEED'):  # not available on Windows
+            self._mmap.madvise(mmap.MADV_WILLNEED)
+        else:
+            with open(self.path, 'rb') as pack_file:
+                while pack_file.read(1 << 24):
+                    pass
+
+    def close(self):
+        """Unmap the pack. Samples returned by samples() must not be used afterwards."""
+        self._data = np.zeros(0, dtype=self._data.dtype)
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:  # views of the samples are still referenced; the mapping is released with them
+                pass
+            self._mmap = None
+
+
+def pack_stimuli(stimulus_index, pack_path=None):
+    """
+    Write all stimuli of a task into a pack.
+
+    Args:
+        stimulus_index (StimulusIndex): The index of the stimulus directory of the task (built with use_pack=False).
+        pack_path (str, optional): The pack file to write. Defaults to pack_path_for the stimulus directory.
+
+    Returns:
+        str: The path of the pack file.
+
+    Raises:
+        Exception: If a stimulus is not 16-bit PCM or the stimuli differ in sample rate or number of channels.
+    """
+    if pack_path is None:
+        pack_path = pack_path_for(stimulus_index.stimuli_path)
+
+    # first pass: the format and length of every stimulus, to write the header in front of the samples
+    stimuli = []
+    sample_rate = channels = None
+    offset = 0
+    for level, path in sorted(stimulus_index.files.items()):
+        with wave.open(path, 'rb') as wav_file:
+            if wav_file.getsampwidth() != 2:
+                raise Exception(f'Only 16-bit PCM wav files are supported: {path}')
+            if sample_rate is None:
+                sample_rate, channels = wav_file.getframerate(), wav_file.getnchannels()
+            elif (wav_file.getframerate(), wav_file.getnchannels()) != (sample_rate, channels):
+                raise Exception(f'Sample rate or number of channels of {path} differ from the other stimuli')
+            frames = wav_file.getnframes()
+        stimuli.append({'name': os.path.basename(path), 'level': level, 'offset': offset, 'frames': frames})
+        offset += frames
+
+    header = {'task': stimulus_index.task,
+              'stim_prefix': stimulus_index.stim_prefix,
+              'dtype': '<i2',
+              'sample_rate': sample_rate,
+              'channels': channels,
+              'expected_levels': sorted(stimulus_index.expected_levels),
+              'stimuli': stimuli,
+              'sources': source_signatures(stimulus_index.stimuli_path),
+              'data_offset': 0}
+    # the header contains the offset of the data, which depends on the length of the header
+    header_bytes = json.dumps(header).encode('utf-8')
+    data_offset = -(-(len(pack_magic) + 8 + len(header_bytes) + 32) // pack_alignment) * pack_alignment
+    header['data_offset'] = data_offset
+    header_bytes = json.dumps(header).encode('utf-8')
+
+    # second pass: copy the samples; written to a temporary file first so that an interrupted run leaves no pack
+    temporary_path = pack_path + '.tmp'
+    with open(temporary_path, 'wb') as pack_file:
+        pack_file.write(pack_magic + struct.pack('<Q', len(header_bytes)) + header_bytes)
+        pack_file.write(b'\0' * (data_offset - pack_file.tell()))
+        for level, path in sorted(stimulus_index.files.items()):
+            with wave.open(path, 'rb') as wav_file:
+                pack_file.write(wav_file.readframes(wav_file.getnframes()))
+    os.replace(temporary_path, pack_path)
+    return pack_path
+
+
+def verify_pack(pack, stimulus_index):
+    """
+    Compare every stimulus of a pack sample-for-sample with the wav files of the stimulus directory.
+
+    Args:
+        pack (StimulusPack): The pack.
+        stimulus_index (StimulusIndex): The index of the stimulus directory (built with use_pack=False).
+
+    Returns:
+        list: The file names of the stimuli that are missing in the pack or differ from their wav file.
+    """
+    mismatches = []
+    for path in stimulus_index.files.values():
+        name = os.path.basename(path)
+        with wave.open(path, 'rb') as wav_file:
+            frames = np.frombuffer(wav_file.readframes(wav_file.getnframes()), dtype='<i2')
+        if name not in pack.entries or not np.array_equal(pack.samples(name).reshape(-1), frames):
+            mismatches.append(name)
+    return mismatches
+
+
+if __name__ == '__main__':
+    import argparse
+    from jnd_configuration import general_experiment_configs, get_task_specific_config
+    from jnd_stimuli import StimulusIndex
+
+    parser = argparse.ArgumentParser(description='Pack the stimulus directory of each task into one file.')
+    parser.add_argument('tasks', nargs='*', default=general_experiment_configs["task_types"])
+    parser.add_argument('--verify', action='store_true',
+                        help='only compare existing packs sample-for-sample with the wav files')
+    args = parser.parse_args()
+
+    for task in args.tasks:
+        directory_index = StimulusIndex(get_task_specific_config(task), use_pack=False)
+        if args.verify:
+            with StimulusPack(pack_path_for(directory_index.stimuli_path)) as stimulus_pack:
+                mismatches = verify_pack(stimulus_pack, directory_index)
+            print(f"{task}: {len(directory_index.files) - len(mismatches)} of {len(directory_index.files)} stimuli "
+                  f"identical{': differing ' + ', '.join(mismatches) if mismatches else ''}")
+        else:
+            written = pack_stimuli(directory_index)
+            print(f"{task}: packed {len(directory_index.files)} stimuli into {written} "
+                  f"({os.path.getsize(written) / 1e6:.1f} MB)")
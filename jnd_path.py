@@ -34,7 +34,8 @@ def check_config_paths(base_input_path, tasks, output_path, plot_path):
     None
 
     Raises:
-    Exception: If the base input directory, or a task-specific input directory does not exist.
+    Exception: If the base input directory, or a task-specific input directory, its stimulus pack and its store do
+               not exist.
                If the output or plot directories do not exist, they are created.
     """
 
@@ -44,9 +45,11 @@ def check_config_paths(base_input_path, tasks, output_path, plot_path):
         print("base input path:", base_input_path)
         raise Exception("No input folder detected. Please make sure that "
                         "'base_stimuli_path' is correctly set in the configurations")
-    # Iterate through tasks and check if the corresponding input folder exists
+    # Iterate through tasks and check if the corresponding input folder (or its stimulus pack or store) exists
     for task in tasks:
-        if not os.path.exists(f'{base_input_path}/audio-{task}'):
+        if not os.path.exists(f'{base_input_path}/audio-{task}') and \
+                not os.path.exists(f'{base_input_path}/audio-{task}.jndpack') and \
+                not os.path.exists(f'{base_input_path}/audio-{task}.jnddedup'):
             raise Exception(f"No input folder for task {task} detected. Please "
                             f"create it or remove task {task} from the configurations")
     # Check if the output directory exists, if not, create it
@@ -0,0 +1,226 @@
+"""
+jnd_psi.py
+
+This module contains a Bayesian adaptive procedure (psi method, Kontsevich & Tyler, 1999) as an alternative to the
+2-down-1-up staircase of the Just-Noticeable-Difference (JND) experiment. It is used for the trial session if
+general_experiment_configs["procedure"] is 'psi'; the staircase remains the default.
+
+The procedure keeps a posterior distribution over the threshold and slope of the Weibull psychometric function of
+jnd_simulation.py (guess rate 1/2, fixed lapse rate) on a grid. The candidate stimuli are the difference levels that
+exist on disk. Before each trial the stimulus with the smallest expected entropy of the posterior after the response
+is chosen; the probability of a correct response for every candidate and grid point is tabulated once, so a posterior
+update is one vector multiplication and the choice of the next stimulus a few small matrix operations.
+
+The first trial is presented at the initial difference of the task, like in the staircase. The run stops after a fixed
+number of trials.
+
+Classes:
+--------
+- PsiEngine: The posterior and the trial history of one run. It has the interface of StaircaseEngine
+(jnd_staircase.py), so the trial session, the results file and the plot work unchanged.
+
+Functions:
+----------
+- candidate_differences(stimulus_index, max_candidates): The differences on disk the procedure can choose from.
+"""
+
+
+import numpy as np
+from jnd_simulation import psychometric_function, target_difference
+from jnd_stimuli import level_scales, quantize_level
+from jnd_staircase import ReversalTracker
+
+
+def candidate_differences(stimulus_index, max_candidates=100):
+    """
+    Select the differences the procedure can present: the levels on disk between the baseline and the initial
+    difference, thinned out to at most max_candidates roughly log-spaced levels.
+
+    Args:
+        stimulus_index (StimulusIndex): The stimulus index of the task.
+        max_candidates (int, optional): The maximum number of candidates. Defaults to 100.
+
+    Returns:
+        numpy.ndarray: The candidate differences, in increasing order.
+
+    Raises:
+        Exception: If there is no stimulus between the baseline and the initial difference.
+    """
+    scale = level_scales[stimulus_index.task]
+    baseline = quantize_level(stimulus_index.baseline, stimulus_index.task)
+    initial = quantize_level(stimulus_index.initial_difference, stimulus_index.task)
+    levels = np.array(sorted(level - baseline for level in stimulus_index.files if 0 < level - baseline <= initial))
+    if len(levels) == 0:
+        raise Exception(f'No stimuli for the psi procedure of task {stimulus_index.task}: no '
+                        f'{stimulus_index.stim_prefix}_*.wav between the baseline and the initial difference in '
+                        f'{stimulus_index.stimuli_path}')
+    if len(levels) > max_candidates:
+        wanted = np.geomspace(levels[0], levels[-1], max_candidates)
+        levels = np.unique(levels[np.abs(levels[None, :] - wanted[:, None]).argmin(axis=1)])
+    return levels / scale
+
+
+class PsiEngine:
+    """
+    State of one run of the psi procedure, with the interface of StaircaseEngine.
+
+    Attributes:
+        procedure (str): 'psi', the value of the procedure column of the results file.
+        task (str): The task name ("pitch", "FL", or "pause").
+        current_difference (float): The difference between test and baseline stimulus of the next trial.
+        step_size (None): The procedure has no step size; the step-size column of its trials is empty.
+        trial_index (int): The number of trials done so far.
+        reversals (int): The number of reversals of the presented differences counted so far.
+        differences (list): The difference of each trial done so far.
+        correct_responses (list): Whether the response of each trial was correct.
+        reversals_list (list): The number of reversals before the first and after each trial.
+        previous_direction (list): The direction of each trial, preceded by the initial direction 'down'.
+        reversal_tracker (ReversalTracker): The reversals of the presented differences.
+        posterior (numpy.ndarray): The posterior probability of each grid point.
+    """
+
+    procedure = 'psi'
+
+    def __init__(self, task, initial_difference, differences, num_trials=50, lapse=0.02, n_thresholds=60,
+                 n_slopes=20):
+        """
+        Set up the uniform prior and tabulate the psychometric function for all candidates and grid points.
+
+        Args:
+            task (str): The task name ("pitch", "FL", or "pause").
+            initial_difference (float): The difference of the first trial.
+            differences (numpy.ndarray): The candidate differences, see candidate_differences.
+            num_trials (int, optional): The number of trials of a run. Defaults to 50.
+            lapse (float, optional): The lapse rate of the psychometric function. Defaults to 0.02.
+            n_thresholds (int, optional): The number of thresholds of the grid, log-spaced from the smallest
+                candidate to twice the initial difference. Defaults to 60.
+            n_slopes (int, optional): The number of slopes of the grid, log-spaced from 0.5 to 10. Defaults to 20.
+        """
+        self.task = task
+        self.initial_difference = initial_difference
+        self.num_trials = num_trials
+        self.lapse = lapse
+        self.candidates = np.asarray(differences, dtype=float)
+
+        thresholds = np.geomspace(self.candidates[0], 2 * initial_difference, n_thresholds)
+        slopes = np.geomspace(0.5, 10.0, n_slopes)
+        threshold_grid, slope_grid = np.meshgrid(thresholds, slopes, indexing='ij')
+        self.grid_thresholds = threshold_grid.ravel()
+        self.grid_slopes = slope_grid.ravel()
+        self.posterior = np.full(self.grid_thresholds.size, 1.0 / self.grid_thresholds.size)
+
+        # candidates x grid points
+        self._p_correct = psychometric_function(self.candidates[:, None], self.grid_thresholds[None, :],
+                                                self.grid_slopes[None, :], lapse)
+        self._p_initial = psychometric_function(initial_difference, self.grid_thresholds, self.grid_slopes, lapse)
+        self._next = {}  # response -> candidate index of the next trial, computed by next_differences
+
+        self.current_difference = initial_difference
+        self._current_p = self._p_initial
+        self.step_size = None
+        self.trial_index = 0
+        self.reversals = 0
+        self.differences = []
+        self.correct_responses = []
+        self.reversals_list = [self.reversals]
+        self.previous_direction = ['down']
+        self.reversal_tracker = ReversalTracker()
+
+    @property
+    def reached_baseline(self):
+        """The procedure only presents differences above the baseline."""
+        return False
+
+    @property
+    def finished(self):
+        """True once the number of trials of the run is done."""
+        return self.stop_reason is not None
+
+    @property
+    def stop_reason(self):
+        """'num_trials' once the number of trials of the run is done, otherwise None."""
+        return 'num_trials' if self.trial_index >= self.num_trials else None
+
+    def _updated_posterior(self, p_correct, correct):
+        """Return the posterior after a response to a stimulus with the given probabilities of a correct response."""
+        posterior = self.posterior * (p_correct if correct else 1.0 - p_correct)
+        return posterior / posterior.sum()
+
+    def _best_candidate(self, posterior):
+        """Return the index of the candidate with the smallest expected entropy of the posterior after the trial."""
+        joint_correct = self._p_correct * posterior  # candidates x grid points
+        joint_incorrect = posterior - joint_correct
+        p_correct = joint_correct.sum(axis=1)
+        p_incorrect = 1.0 - p_correct
+        # expected entropy: sum over the outcomes of -sum(joint * log(joint / p(outcome)))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            entropy = -(np.where(joint_correct > 0, joint_correct * np.log(joint_correct / p_correct[:, None]), 0.0).sum(axis=1) +
+                        np.where(joint_incorrect > 0, joint_incorrect * np.log(joint_incorrect / p_incorrect[:, None]), 0.0).sum(axis=1))
+        return int(np.argmin(entropy))
+
+    def next_differences(self):
+        """
+        Determine the difference of the next trial for both possible responses to the current trial.
+
+        Returns:
+            set: The possible differences of the next trial.
+        """
+        if not self._next:
+            for correct in (True, False):
+                self._next[correct] = self._best_candidate(self._updated_posterior(self._current_p, correct))
+        return {float(self.candidates[candidate]) for candidate in self._next.values()}
+
+    def step(self, correct):
+        """
+        Apply the response of the current trial to the posterior and choose the next trial.
+
+        Args:
+            correct (bool): Whether the participant's response was correct.
+
+        Returns:
+            dict: The values of the trial that was just done - 'difference', 'step_size' (None), 'reversals'
+            (counted before this trial), 'direction' ('down', 'none' or 'up') and 'correct', as
+            StaircaseEngine.step.
+        """
+        self.next_differences()
+        current_difference = self.current_difference
+        self.posterior = self._updated_posterior(self._current_p, correct)
+        next_candidate = self._next[correct]
+        self._next = {}
+        new_difference = float(self.candidates[next_candidate])
+
+        if new_difference < current_difference:
+            direction = 'down'
+        elif new_difference > current_difference:
+            direction = 'up'
+        else:
+            direction = 'none'
+        trial = {'difference': current_difference,
+                 'step_size': None,
+                 'reversals': self.reversals,
+                 'direction': direction,
+                 'correct': correct}
+        self.differences.append(current_difference)
+        self.correct_responses.append(correct)
+
+        # prepare for the next iteration
+        self.trial_index += 1
+        self.current_difference = new_difference
+        self._current_p = self._p_correct[next_candidate]
+        self.reversal_tracker.update(direction, current_difference)
+        self.reversals = self.reversal_tracker.reversals
+        self.previous_direction.append(direction)
+        self.reversals_list.append(self.reversals)
+        return trial
+
+    def threshold(self):
+        """
+        Return the estimate of the run.
+
+        Returns:
+            tuple: The posterior mean of the JND (the difference at 70.7% correct, the target of the 2-down-1-up
+            staircase), and the posterior means of the Weibull threshold and slope.
+        """
+        jnd = target_difference(self.grid_thresholds, self.grid_slopes, self.lapse)
+        return (float(self.posterior @ jnd), float(self.posterior @ self.grid_thresholds),
+                float(self.posterior @ self.grid_slopes))
@@ -0,0 +1,193 @@
+"""
+jnd_replot.py
+
+This module rebuilds the plots of the Just-Noticeable-Difference (JND) experiment from the results files, e.g. after
+the look of the figures was changed or when a session crashed before its plot was saved.
+
+For every trial results file ('results/<subject>/JND_<task>_<subject>_<timestamp>.csv') the staircase plot is drawn
+again, and for every subject a summary figure shows the most recent staircase of each task side by side. The plots
+are rendered in a process pool; every worker process reuses one figure for all plots it draws. A plot is skipped if it
+is newer than its results file(s), so running the command again only redraws plots of new or changed results.
+
+Functions:
+----------
+- read_staircase(path): Reads the differences, responses and reversal counts of one trial results file.
+
+- replot_results(output_path, plot_path, workers, force): Rebuilds all staircase and summary plots.
+
+Usage:
+------
+    python jnd_replot.py [--results results/] [--plots plots/] [--workers 4] [--force]
+"""
+
+
+import argparse
+import glob
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from jnd_configuration import general_experiment_configs
+from jnd_resume import read_results_file
+from jnd_staircase import ReversalTracker
+from jnd_visualization import plot_date_string
+
+
+# trial results files - practice files end in '_practice.csv' and are not plotted
+results_file_pattern = re.compile(r'^JND_(?P<task>[^_]+)_(?P<subject>.+)_(?P<timestamp>\d{8}_\d{6})\.csv$')
+
+# figure of the worker process, reused for all plots it draws
+_worker_figures = {}
+
+
+def read_staircase(path):
+    """
+    Read the staircase of one trial results file.
+
+    The results file records the reversals counted before each trial; the count after the last trial is derived
+    from the recorded directions with a ReversalTracker.
+
+    Args:
+        path (str): The path of the trial results file.
+
+    Returns:
+        tuple: The differences, the correct responses and the reversals list (one more entry than trials), or None
+        if the file has no trials.
+    """
+    rows = read_results_file(path)
+    if not rows:
+        return None
+    differences = [float(row['difference']) for row in rows]
+    correct_responses = [row['correct'] == 'True' for row in rows]
+    reversals_list = [int(row['reversals']) for row in rows]
+
+    # the reversal count after the last trial, counted like during the session
+    reversal_tracker = ReversalTracker()
+    for row, difference in zip(rows, differences):
+        reversal_tracker.update(row['direction'], difference)
+    reversals_list.append(reversal_tracker.reversals)
+    return differences, correct_responses, reversals_list
+
+
+def _worker_figure():
+    """Return the figure of this worker process, creating it on first use."""
+    if 'figure' not in _worker_figures:
+        from jnd_visualization import load_pyplot
+        _worker_figures['figure'] = load_pyplot().figure(figsize=(10, 5))
+    return _worker_figures['figure']
+
+
+def _plot_staircase(job):
+    """Draw the staircase plot of one results file. Returns the plot path, or None if the file has no trials."""
+    from jnd_visualization import create_visualization
+
+    results_path, plot_file, task, subject = job
+    staircase = read_staircase(results_path)
+    if staircase is None:
+        return None
+    differences, correct_responses, reversals_list = staircase
+    create_visualization(differences, correct_responses, reversals_list, task, subject, file_path=plot_file,
+                         fig=_worker_figure())
+    return plot_file
+
+
+def _plot_summary(job):
+    """Draw the summary figure of one subject: the most recent staircase of each task side by side."""
+    from jnd_visualization import draw_staircase
+
+    subject, plot_file, task_files = job
+    staircases = [(task, read_staircase(path)) for task, path in task_files]
+    staircases = [(task, staircase) for task, staircase in staircases if staircase is not None]
+    if not staircases:
+        return None
+
+    fig = _worker_figure()
+    fig.clear()
+    fig.set_size_inches(6 * len(staircases), 4)
+    axes = fig.subplots(1, len(staircases), squeeze=False)[0]
+    for ax, (task, (differences, correct_responses, reversals_list)) in zip(axes, staircases):
+        mean_threshold, median_threshold, selected_reversals = draw_staircase(ax, differences, correct_responses,
+                                                                              reversals_list, task, legend=False)
+        ax.set_title(f'{task}: threshold {round(mean_threshold, 3)} (median {round(median_threshold, 3)}, '
+                     f'{len(selected_reversals)} reversals)', fontsize=10)
+    fig.suptitle(f'Just-Noticeable Difference thresholds of subject: {subject}')
+    fig.savefig(plot_file, dpi=150, bbox_inches='tight')
+    return plot_file
+
+
+def _is_up_to_date(plot_file, source_files):
+    """True if the plot exists and is newer than all of its results files."""
+    if not os.path.exists(plot_file):
+        return False
+    plot_mtime = os.stat(plot_file).st_mtime_ns
+    return all(os.stat(path).st_mtime_ns <= plot_mtime for path in source_files)
+
+
+def replot_results(output_path=None, plot_path=None, workers=None, force=False):
+    """
+    Rebuild the staircase plot of every trial results file and the summary figure of every subject.
+
+    The staircase plots are named like the plots made during the experiment, with the start time of the results file
+    as time stamp ('<subject>_<date>_<task>.png', see plot_date_string), so a rebuilt plot replaces the plot of the
+    same test. The summary figure of a subject is '<subject>_summary.png'.
+
+    Args:
+        output_path (str, optional): The results directory, containing one directory per subject. Defaults to the
+            experiment configuration.
+        plot_path (str, optional): The plot directory. Defaults to the experiment configuration.
+        workers (int, optional): The number of worker processes. Defaults to the number of CPUs.
+        force (bool, optional): Redraw all plots, also those that are newer than their results files.
+
+    Returns:
+        list: The paths of the plots that were drawn.
+    """
+    if output_path is None:
+        output_path = general_experiment_configs['output_path']
+    if plot_path is None:
+        plot_path = general_experiment_configs['plot_path']
+
+    staircase_jobs = []
+    summary_files = {}  # subject -> {task: most recent results file}
+    skipped = 0
+    for results_path in sorted(glob.glob(os.path.join(output_path, '*', 'JND_*.csv'))):
+        match = results_file_pattern.match(os.path.basename(results_path))
+        if match is None:
+            continue
+        subject = os.path.basename(os.path.dirname(results_path))
+        task = match.group('task')
+        plot_file = os.path.join(plot_path, subject, f"{subject}_{plot_date_string(results_path)}_{task}.png")
+        summary_files.setdefault(subject, {})[task] = results_path  # files are sorted, the last one is the latest
+        if force or not _is_up_to_date(plot_file, [results_path]):
+            staircase_jobs.append((results_path, plot_file, task, subject))
+        else:
+            skipped += 1
+
+    summary_jobs = []
+    for subject, task_files in sorted(summary_files.items()):
+        plot_file = os.path.join(plot_path, subject, f"{subject}_summary.png")
+        if force or not _is_up_to_date(plot_file, task_files.values()):
+            summary_jobs.append((subject, plot_file, sorted(task_files.items())))
+        else:
+            skipped += 1
+
+    for job in staircase_jobs + summary_jobs:
+        os.makedirs(os.path.dirname(job[1]), exist_ok=True)
+
+    drawn = []
+    if staircase_jobs or summary_jobs:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            drawn += executor.map(_plot_staircase, staircase_jobs)
+            drawn += executor.map(_plot_summary, summary_jobs)
+    drawn = [plot_file for plot_file in drawn if plot_file is not None]
+    print(f"Drew {len(drawn)} plots, {skipped} plots were up to date")
+    return drawn
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Rebuild the staircase and summary plots from the results files.')
+    parser.add_argument('--results', default=None, help='results directory (default: from the configuration)')
+    parser.add_argument('--plots', default=None, help='plot directory (default: from the configuration)')
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes')
+    parser.add_argument('--force', action='store_true', help='redraw plots that are up to date')
+    args = parser.parse_args()
+
+    replot_results(args.results, args.plots, args.workers, args.force)
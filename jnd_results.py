@@ -0,0 +1,203 @@
+"""
+jnd_results.py
+
+This module writes the per-trial results of the Just-Noticeable-Difference (JND) experiment without blocking the
+trial loop, and repairs results files that were cut off by a crash.
+
+Trial records are put on a queue and written by a background thread with the csv module, so that fields are quoted
+properly (e.g. a comma in a subject ID). The results files are append-only: every record is flushed when it is
+written and the file is fsynced periodically and when the session ends. If the program crashes in the middle of a
+record, recover_results_files removes the incomplete last line on the next launch.
+
+Module Level Variables:
+-----------------------
+- trial_columns: The columns of the results file of a trial session.
+
+- practice_columns: The columns of the results file of a practice session, which has an extra 'run' column.
+
+Classes:
+--------
+- ResultsWriter: Queue-based, crash-safe writer of one results csv file. Can be used as a context manager.
+
+Functions:
+----------
+- recover_results_file(path): Removes an incomplete last record from a results file.
+
+- recover_results_files(output_path): Checks all results files below the output directory.
+"""
+
+
+import csv
+import glob
+import os
+import queue
+import threading
+import time
+from jnd_timing import timing_columns
+
+
+trial_columns = ['experiment', 'subjectID', 'date', 'task', 'session_type', 'trial', 'start_time', 'end_time',
+                 'duration', 'recording_A', 'recording_X', 'recording_B', 'response', 'correct', 'difference',
+                 'step-size', 'reversals', 'direction', 'cache_hits', 'cache_misses', 'stop_rule',
+                 'procedure', 'early_keys'] + timing_columns
+
+practice_columns = trial_columns[:5] + ['run'] + trial_columns[5:]
+
+
+class ResultsWriter:
+    """
+    Background writer of one results csv file.
+
+    write_row only puts the record on a queue and returns immediately; a writer thread appends it to the file.
+    """
+
+    def __init__(self, path, header, fsync_interval=5.0):
+        """
+        Create the results file, write its header and start the writer thread.
+
+        Args:
+            path (str): The path of the results csv file.
+            header (list): The column names.
+            fsync_interval (float, optional): Maximum number of seconds between two fsyncs. Defaults to 5.
+
+        Raises:
+            Exception: If the file exists and has other columns - records are only appended under their own header.
+        """
+        self.path = path
+        self.header = list(header)
+        self.fsync_interval = fsync_interval
+        self._queue = queue.Queue()
+        self._error = None
+        self._closed = False
+
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            with open(path, newline='', encoding='utf-8') as existing_file:
+                existing_header = next(csv.reader(existing_file), [])
+            if existing_header != self.header:
+                raise Exception(f'Cannot append to {path}: its columns differ from the columns of this version')
+        self._file = open(path, 'a', newline='', encoding='utf-8')
+        self._csv_writer = csv.writer(self._file)
+        if self._file.tell() == 0:
+            self._csv_writer.writerow(self.header)
+            self._sync()
+        self._last_sync = time.monotonic()
+
+        self._thread = threading.Thread(target=self._run, name='results_writer', daemon=True)
+        self._thread.start()
+
+    def _sync(self):
+        """Flush the file and force it to disk."""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._last_sync = time.monotonic()
+
+    def _run(self):
+        """Write the queued records until close() puts None on the queue."""
+        while True:
+            try:
+                row = self._queue.get(timeout=self.fsync_interval)
+            except queue.Empty:
+                row = ()
+            try:
+                if row is None:
+                    self._sync()
+                    return
+                if row:
+                    self._csv_writer.writerow(row)
+                    self._file.flush()
+                if time.monotonic() - self._last_sync >= self.fsync_interval:
+                    self._sync()
+            except Exception as error:  # e.g. a full disk or an unwritable value, raised by write_row and close
+                self._error = error
+                return
+
+    def write_row(self, row):
+        """
+        Queue one record for writing.
+
+        Args:
+            row (list): The values of the record, in the order of the header.
+
+        Raises:
+            Exception: If the writer thread failed to write an earlier record.
+        """
+        if self._error is not None:
+            raise Exception(f'Writing results to {self.path} failed: {self._error}')
+        if len(row) != len(self.header):
+            raise Exception(f'Results record has {len(row)} values, expected {len(self.header)}')
+        self._queue.put(list(row))
+
+    def close(self):
+        """Write all queued records, fsync and close the file. Calling close() more than once has no effect."""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+        self._file.close()
+        if self._error is not None:
+            raise Exception(f'Writing results to {self.path} failed: {self._error}')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def recover_results_file(path):
+    """
+    Remove an incomplete last record from a results file.
+
+    A record is complete when it ends with a line break, so everything after the last line break is the part of a
+    record that was being written when the program stopped.
+
+    Args:
+        path (str): The path of the results csv file.
+
+    Returns:
+        bool: True if the file had to be repaired.
+    """
+    with open(path, 'rb+') as results_file:
+        results_file.seek(0, os.SEEK_END)
+        size = results_file.tell()
+        if size == 0:
+            return False
+        results_file.seek(size - 1)
+        if results_file.read(1) == b'\n':
+            return False
+
+        # search backwards for the end of the last complete record
+        position = size
+        while position > 0:
+            chunk_start = max(0, position - 4096)
+            results_file.seek(chunk_start)
+            chunk = results_file.read(position - chunk_start)
+            newline = chunk.rfind(b'\n')
+            if newline != -1:
+                results_file.truncate(chunk_start + newline + 1)
+                break
+            position = chunk_start
+        else:
+            results_file.truncate(0)
+        results_file.flush()
+        os.fsync(results_file.fileno())
+    return True
+
+
+def recover_results_files(output_path):
+    """
+    Repair all results files below the output directory whose last record is incomplete.
+
+    Args:
+        output_path (str): The results directory, containing one directory per subject.
+
+    Returns:
+        list: The paths of the repaired files.
+    """
+    repaired = []
+    for path in glob.glob(os.path.join(output_path, '*', 'JND_*.csv')):
+        if recover_results_file(path):
+            print(f"Removed incomplete last record from {path}")
+            repaired.append(path)
+    return repaired
@@ -0,0 +1,170 @@
+"""
+jnd_resume.py
+
+This module finds a session of the Just-Noticeable-Difference (JND) experiment that was interrupted (e.g. by a crash
+or the machine going to sleep) and restores the state of its staircase from the results file, so that the
+experiment can continue with the next trial instead of repeating the whole task and its practice.
+
+The staircase state is not stored separately: the recorded responses are replayed through a StaircaseEngine, which
+rebuilds the difference, step size, reversals and direction history exactly as they were, and the recorded AXB
+patterns rebuild the list of the last two combinations.
+
+Only results files with the columns of the current version (trial_columns), whose trials were all chosen by the
+staircase, and that were written to within the last general_experiment_configs["resume_max_age_hours"] hours are
+resumed; the experimenter confirms the resumption in a dialog (see confirm_resume in jnd_task_setup.py).
+
+Functions:
+----------
+- read_results_file(path): Reads the records of a results csv file.
+
+- restore_staircase(rows, exp_config): Replays the recorded responses and returns the staircase and the last two
+AXB combinations.
+
+- find_interrupted_session(output_path, subject, tasks): Looks for an interrupted run of the subject and returns the
+tasks that were already completed in that run and the task to resume.
+"""
+
+
+import csv
+import glob
+import os
+import re
+import time
+from jnd_configuration import get_task_specific_config, general_experiment_configs
+from jnd_staircase import StaircaseEngine
+from jnd_results import trial_columns
+
+
+def read_results_file(path):
+    """
+    Read the records of a results csv file.
+
+    Args:
+        path (str): The path of the results file.
+
+    Returns:
+        list: One dictionary per trial, with the column names as keys.
+    """
+    with open(path, newline='', encoding='utf-8') as results_file:
+        return list(csv.DictReader(results_file))
+
+
+def read_results_header(path):
+    """Return the column names of a results csv file (an empty list for an empty file)."""
+    with open(path, newline='', encoding='utf-8') as results_file:
+        return next(csv.reader(results_file), [])
+
+
+def restore_staircase(rows, exp_config):
+    """
+    Rebuild the staircase state of a trial session from its records.
+
+    Args:
+        rows (list): The records of the results file, as returned by read_results_file.
+        exp_config (dict): The task-specific configuration.
+
+    Returns:
+        tuple: The StaircaseEngine after the last recorded trial and the list of the last two AXB combinations.
+
+    Raises:
+        Exception: If the recorded differences do not match the replayed staircase.
+    """
+    staircase = StaircaseEngine(exp_config["task"], exp_config["initial_difference"],
+                                num_trials=general_experiment_configs["num_trials"],
+                                stopping_rules=general_experiment_configs["stopping_rules"])
+    last_two_combinations = []
+    for row in rows:
+        if abs(float(row['difference']) - staircase.current_difference) > 1e-9:
+            raise Exception(f"Cannot resume: trial {row['trial']} was recorded at difference {row['difference']}, "
+                            f"but the staircase is at {staircase.current_difference}")
+        staircase.step(row['correct'] == 'True')
+
+        # X equals B for the ABB pattern (correct key 'left') and A for the AAB pattern (correct key 'right')
+        x_key = 'left' if row['recording_X'] == row['recording_B'] else 'right'
+        current_combination = f"left{x_key}right"
+        if len(last_two_combinations) < 2:
+            last_two_combinations.append(current_combination)
+        elif last_two_combinations[0] == last_two_combinations[1]:
+            last_two_combinations[0] = last_two_combinations[1]
+            last_two_combinations[1] = current_combination
+
+    return staircase, last_two_combinations
+
+
+def _trial_files(output_path, subject, task):
+    """Return the trial (not practice) results files of a subject and task, oldest first."""
+    prefix = f"JND_{task}_{subject}_"
+    pattern = re.compile(r'^\d{8}_\d{6}\.csv$')
+    paths = [path for path in glob.glob(os.path.join(output_path, glob.escape(subject), glob.escape(prefix) + '*.csv'))
+             if pattern.match(os.path.basename(path)[len(prefix):])]
+    return sorted(paths, key=lambda path: os.path.basename(path)[len(prefix):])
+
+
+def find_interrupted_session(output_path, subject, tasks):
+    """
+    Look for an interrupted run of the experiment for a subject.
+
+    A run is interrupted if the most recent trial results file of the subject belongs to a staircase that has not
+    reached any of its stopping rules. All files of one run share the value of the 'date' column (the start of the
+    run), which is used to find the tasks that were completed earlier in the same run.
+
+    The file is not resumed if its columns differ from trial_columns (it was written by another version of the
+    experiment, and new records would not match its header), if a trial was not chosen by the staircase procedure,
+    or if it was last written more than general_experiment_configs["resume_max_age_hours"] hours ago.
+
+    Args:
+        output_path (str): The results directory, containing one directory per subject.
+        subject (str): The subject ID.
+        tasks (list): The task names.
+
+    Returns:
+        dict: None if there is nothing to resume, otherwise 'date' (the start of the interrupted run),
+        'completed_tasks' (list), 'task' (the task to resume), 'path' (its results file), 'rows' (its records) and
+        'age_hours' (the time since the file was last written).
+    """
+    latest_files = []  # (timestamp, task, path) of the most recent file of each task
+    for task in tasks:
+        paths = _trial_files(output_path, subject, task)
+        if paths:
+            prefix = f"JND_{task}_{subject}_"
+            latest_files.append((os.path.basename(paths[-1])[len(prefix):], task, paths[-1]))
+    if not latest_files:
+        return None
+
+    _, interrupted_task, interrupted_path = max(latest_files)
+    age_hours = (time.time() - os.path.getmtime(interrupted_path)) / 3600
+    if age_hours > general_experiment_configs["resume_max_age_hours"]:
+        return None
+    if read_results_header(interrupted_path) != trial_columns:
+        print(f"Not resuming {interrupted_path}: it was written by another version of the experiment")
+        return None
+    rows = read_results_file(interrupted_path)
+    if rows and rows[0]['session_type'] == 'interleaved':
+        print(f"Not resuming {interrupted_path}: interleaved blocks are not resumed")
+        return None
+    if any(row['procedure'] != 'staircase' for row in rows):
+        print(f"Not resuming {interrupted_path}: only sessions of the staircase procedure are resumed")
+        return None
+    try:
+        staircase, _ = restore_staircase(rows, get_task_specific_config(interrupted_task))
+    except Exception as error:
+        print(f"Not resuming {interrupted_path}: {error}")
+        return None
+    if staircase.finished:
+        return None
+
+    run_date = rows[0]['date'] if rows else None
+    completed_tasks = []
+    for _, task, path in latest_files:
+        if task == interrupted_task or run_date is None:
+            continue
+        task_rows = read_results_file(path)
+        if task_rows and task_rows[0]['date'] == run_date:
+            completed_tasks.append(task)
+
+    return {'date': run_date,
+            'completed_tasks': completed_tasks,
+            'task': interrupted_task,
+            'path': interrupted_path,
+            'rows': rows,
+            'age_hours': age_hours}
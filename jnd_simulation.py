@@ -0,0 +1,306 @@
+"""
+jnd_simulation.py
+
+This module simulates the adaptive staircase procedure of the Just-Noticeable-Difference (JND) experiment for many
+observers at once, to estimate the bias and variance of the threshold returned by calculate_threshold before the
+step sizes in get_step_size or the stopping rules are changed.
+
+All observers are simulated in parallel as NumPy arrays: the state of the staircase is one array entry per observer,
+and the recorded data are matrices with one row per observer and one column per trial. The step, reversal and
+stopping rules are the same as in StaircaseEngine (jnd_staircase.py); differences are handled as integer levels
+(see jnd_stimuli.py), so there is no floating point drift between observers.
+
+The simulated observers answer according to a Weibull psychometric function with a guess rate of 1/2, as in the
+two-alternative AXB design of the experiment:
+    p(correct) = 0.5 + (0.5 - lapse) * (1 - exp(-(difference / threshold) ** slope))
+
+Functions:
+----------
+- psychometric_function(difference, threshold, slope, lapse): Probability of a correct response.
+
+- target_difference(threshold, slope, lapse, p_target): The difference at which an observer answers correctly with
+probability p_target - the true value the staircase is expected to converge to.
+
+- simulate_staircase(task, n_observers, threshold, slope, lapse, ...): Runs the staircase for n_observers simulated
+observers and returns the trial-by-trial data and the estimated thresholds.
+
+- summarize_simulation(result, true_threshold): Summarizes bias, spread and trial counts of a simulation.
+
+Usage:
+------
+    python jnd_simulation.py pause --observers 100000 --threshold 0.05 --slope 2
+"""
+
+
+import argparse
+import time
+import numpy as np
+from jnd_configuration import get_step_size, get_task_specific_config, general_experiment_configs
+from jnd_stimuli import level_scales, quantize_level
+
+
+# direction codes of the simulation
+DOWN, NONE, UP = 1, 0, -1
+
+# target probability of a correct response of the 2-down-1-up staircase
+two_down_one_up_target = 0.5 ** 0.5
+
+
+def psychometric_function(difference, threshold, slope, lapse=0.0):
+    """
+    Probability of a correct response in the AXB task.
+
+    Args:
+        difference (float or numpy.ndarray): The difference between test and baseline stimulus.
+        threshold (float or numpy.ndarray): The scale parameter of the Weibull function.
+        slope (float or numpy.ndarray): The shape parameter of the Weibull function.
+        lapse (float or numpy.ndarray, optional): The lapse rate. Defaults to 0.
+
+    Returns:
+        numpy.ndarray: The probability of a correct response, between 0.5 and 1 - lapse.
+    """
+    difference = np.maximum(difference, 0.0)
+    return 0.5 + (0.5 - lapse) * (1.0 - np.exp(-(difference / threshold) ** slope))
+
+
+def target_difference(threshold, slope, lapse=0.0, p_target=two_down_one_up_target):
+    """
+    Difference at which the psychometric function reaches p_target.
+
+    Args:
+        threshold (float or numpy.ndarray): The scale parameter of the Weibull function.
+        slope (float or numpy.ndarray): The shape parameter of the Weibull function.
+        lapse (float or numpy.ndarray, optional): The lapse rate. Defaults to 0.
+        p_target (float, optional): The target probability. Defaults to 0.707, the target of 2-down-1-up.
+
+    Returns:
+        float or numpy.ndarray: The difference.
+    """
+    return threshold * (-np.log(1.0 - (p_target - 0.5) / (0.5 - lapse))) ** (1.0 / slope)
+
+
+def _step_table(task, initial_level):
+    """
+    Tabulate get_step_size as quantized steps for all levels the staircase can visit.
+
+    Returns:
+        tuple: The table and the level of its first entry.
+    """
+    scale = level_scales[task]
+    max_step = max(quantize_level(get_step_size(task, test_difference=level / scale), task)
+                   for level in range(0, initial_level + 1))
+    lowest_level = -2 * max_step
+    levels = range(lowest_level, initial_level + 2 * max_step + 1)
+    table = np.array([quantize_level(get_step_size(task, test_difference=level / scale), task) for level in levels],
+                     dtype=np.int64)
+    return table, lowest_level
+
+
+def simulate_staircase(task, n_observers, threshold, slope, lapse=0.0, initial_difference=None, num_trials=None,
+                       max_reversals=18, num_reversals=6, stopping_rules=None, seed=None):
+    """
+    Run the adaptive staircase for n_observers simulated observers in parallel.
+
+    Args:
+        task (str): The task name ("pitch", "FL", or "pause").
+        n_observers (int): The number of simulated observers.
+        threshold (float or numpy.ndarray): The Weibull scale parameter, one value or one value per observer.
+        slope (float or numpy.ndarray): The Weibull shape parameter, one value or one value per observer.
+        lapse (float or numpy.ndarray, optional): The lapse rate. Defaults to 0.
+        initial_difference (float, optional): The difference of the first trial. Defaults to the task configuration.
+        num_trials (int, optional): The trial limit of a run. Defaults to the experiment configuration.
+        max_reversals (int, optional): The reversal limit of a run. Defaults to 18.
+        num_reversals (int, optional): The number of last reversals averaged by calculate_threshold. Defaults to 6.
+        stopping_rules (dict, optional): The convergence rules of StaircaseEngine. Defaults to None (no early stop).
+        seed (int, optional): The seed of the random number generator.
+
+    Returns:
+        dict: 'differences' (n_observers x trials, NaN after the run stopped), 'correct' (n_observers x trials),
+        'reversal_trials' (n_observers x trials, True where the trial caused a reversal), 'trial_counts',
+        'reversal_counts', 'mean_thresholds' and 'median_thresholds' (NaN for runs without reversals),
+        'stopped_early' (True where a convergence rule ended the run) and the 'max_reversals' of the runs.
+    """
+    if initial_difference is None:
+        initial_difference = get_task_specific_config(task)["initial_difference"]
+    if num_trials is None:
+        num_trials = general_experiment_configs["num_trials"]
+
+    rng = np.random.default_rng(seed)
+    scale = level_scales[task]
+    initial_level = quantize_level(initial_difference, task)
+    step_table, lowest_level = _step_table(task, initial_level)
+    max_columns = num_trials + 1  # the run stops once more than num_trials trials are done
+
+    threshold = np.broadcast_to(np.asarray(threshold, dtype=float), (n_observers,))
+    slope = np.broadcast_to(np.asarray(slope, dtype=float), (n_observers,))
+    lapse = np.broadcast_to(np.asarray(lapse, dtype=float), (n_observers,))
+
+    # staircase state - one entry per observer
+    level = np.full(n_observers, initial_level, dtype=np.int64)
+    step = np.full(n_observers, quantize_level(get_step_size(task), task), dtype=np.int64)
+    two_down_one_up = np.zeros(n_observers, dtype=bool)
+    correct_in_a_row = np.ones(n_observers, dtype=np.int64)
+    reversals = np.zeros(n_observers, dtype=np.int64)
+    trial_counts = np.zeros(n_observers, dtype=np.int64)
+    # the last three directions, initialized like previous_direction = ['down']
+    last_1 = np.full(n_observers, DOWN, dtype=np.int8)
+    last_2 = np.full(n_observers, DOWN, dtype=np.int8)
+    last_3 = np.full(n_observers, DOWN, dtype=np.int8)
+    active = level != 0
+
+    # convergence rules - see StaircaseEngine.stop_reason
+    stopping_rules = stopping_rules or {}
+    reversal_spread = stopping_rules.get('reversal_spread')
+    smallest_step_reversals = stopping_rules.get('smallest_step_reversals')
+    smallest_step = quantize_level(get_step_size(task, test_difference=0), task)
+    small_step_reversals = np.zeros(n_observers, dtype=np.int64)
+    if reversal_spread:
+        # levels of the last reversals of each observer, as ring buffer
+        recent_levels = np.zeros((n_observers, reversal_spread['reversals']))
+    stopped_early = np.zeros(n_observers, dtype=bool)
+
+    differences = np.full((n_observers, max_columns), np.nan)
+    correct_matrix = np.zeros((n_observers, max_columns), dtype=bool)
+    reversal_trials = np.zeros((n_observers, max_columns), dtype=bool)
+
+    for column in range(max_columns):
+        if not active.any():
+            break
+        difference = level / scale
+        correct = rng.random(n_observers) < psychometric_function(difference, threshold, slope, lapse)
+
+        correct_in_a_row = np.where(active & correct, correct_in_a_row + 1, correct_in_a_row)
+        move_down = correct & (~two_down_one_up | ((correct_in_a_row >= 2) & (correct_in_a_row % 2 == 0)))
+        move_up = ~correct & (level != initial_level)
+        direction = np.where(move_down, DOWN, np.where(move_up, UP, NONE)).astype(np.int8)
+        two_down_one_up |= active & move_up
+        correct_in_a_row = np.where(active & move_up, 0, correct_in_a_row)
+
+        differences[active, column] = difference[active]
+        correct_matrix[:, column] = correct & active
+
+        trial_step = step
+        new_level = level - step * (direction == DOWN) + step * (direction == UP)
+        level = np.where(active, new_level, level)
+        step = np.where(active, step_table[np.clip(level - lowest_level, 0, len(step_table) - 1)], step)
+        trial_counts += active
+
+        # counts as reversal only when sequence True-False or False-True-True
+        reversal = (((last_1 == DOWN) & (direction == UP)) |
+                    ((last_1 == UP) & (direction == DOWN)) |
+                    ((last_2 == DOWN) & (last_1 == NONE) & (direction == UP)) |
+                    ((last_2 == UP) & (last_1 == NONE) & (direction == DOWN)) |
+                    ((last_3 == UP) & (last_2 == NONE) & (last_1 == NONE) & (direction == DOWN)))
+        reversal &= active
+        reversals += reversal
+        reversal_trials[:, column] = reversal
+
+        last_3 = np.where(active, last_2, last_3)
+        last_2 = np.where(active, last_1, last_2)
+        last_1 = np.where(active, direction, last_1)
+
+        converged = np.zeros(n_observers, dtype=bool)
+        if reversal_spread:
+            rows = np.flatnonzero(reversal)
+            recent_levels[rows, (reversals[rows] - 1) % reversal_spread['reversals']] = difference[rows]
+            spread_rows = rows[reversals[rows] >= reversal_spread['reversals']]
+            converged[spread_rows] = (recent_levels[spread_rows].std(axis=1) <=
+                                      reversal_spread['tolerance'] * recent_levels[spread_rows].mean(axis=1))
+        if smallest_step_reversals:
+            small_step_reversals += reversal & (trial_step == smallest_step)
+            converged |= small_step_reversals >= smallest_step_reversals
+
+        active &= (trial_counts <= num_trials) & (reversals <= max_reversals) & (level != 0)
+        stopped_early |= active & converged
+        active &= ~converged
+
+    mean_thresholds, median_thresholds = _last_reversal_thresholds(differences, reversal_trials, num_reversals)
+    return {'differences': differences,
+            'correct': correct_matrix,
+            'reversal_trials': reversal_trials,
+            'trial_counts': trial_counts,
+            'reversal_counts': reversals,
+            'mean_thresholds': mean_thresholds,
+            'median_thresholds': median_thresholds,
+            'stopped_early': stopped_early,
+            'max_reversals': max_reversals}
+
+
+def _last_reversal_thresholds(differences, reversal_trials, num_reversals):
+    """Mean and median of the differences at the last num_reversals reversals of each row, as calculate_threshold."""
+    n_observers = differences.shape[0]
+    ordinal = np.cumsum(reversal_trials, axis=1)
+    totals = ordinal[:, -1]
+    first_selected = totals - np.minimum(totals, num_reversals)
+    selected = reversal_trials & (ordinal > first_selected[:, None])
+
+    rows, columns = np.nonzero(selected)
+    positions = ordinal[rows, columns] - first_selected[rows] - 1
+    selected_differences = np.full((n_observers, num_reversals), np.nan)
+    selected_differences[rows, positions] = differences[rows, columns]
+
+    has_reversals = totals > 0
+    mean_thresholds = np.full(n_observers, np.nan)
+    median_thresholds = np.full(n_observers, np.nan)
+    mean_thresholds[has_reversals] = np.nanmean(selected_differences[has_reversals], axis=1)
+    median_thresholds[has_reversals] = np.nanmedian(selected_differences[has_reversals], axis=1)
+    return mean_thresholds, median_thresholds
+
+
+def summarize_simulation(result, true_threshold):
+    """
+    Summarize the estimated thresholds and trial counts of a simulation.
+
+    Args:
+        result (dict): The result of simulate_staircase.
+        true_threshold (float or numpy.ndarray): The difference the staircase should converge to, e.g. from
+            target_difference.
+
+    Returns:
+        dict: Bias, standard deviation and percentiles of the mean thresholds, and the distribution of trial counts.
+    """
+    estimates = result['mean_thresholds']
+    valid = ~np.isnan(estimates)
+    errors = estimates[valid] - np.broadcast_to(true_threshold, estimates.shape)[valid]
+    trial_counts = result['trial_counts']
+    return {'observers': len(estimates),
+            'without_reversals': int((~valid).sum()),
+            'bias': float(np.mean(errors)),
+            'sd': float(np.std(errors)),
+            'rmse': float(np.sqrt(np.mean(errors ** 2))),
+            'threshold_percentiles': dict(zip((5, 25, 50, 75, 95),
+                                              np.percentile(estimates[valid], (5, 25, 50, 75, 95)).tolist())),
+            'mean_trials': float(np.mean(trial_counts)),
+            'trial_percentiles': dict(zip((5, 50, 95), np.percentile(trial_counts, (5, 50, 95)).tolist())),
+            'stopped_by_reversals': float(np.mean(result['reversal_counts'] > result['max_reversals'])),
+            'stopped_early': float(np.mean(result['stopped_early']))}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Monte Carlo simulation of the JND staircase procedure.')
+    parser.add_argument('task', choices=general_experiment_configs["task_types"])
+    parser.add_argument('--observers', type=int, default=100000)
+    parser.add_argument('--threshold', type=float, required=True, help='Weibull scale parameter of the observers')
+    parser.add_argument('--slope', type=float, default=2.0, help='Weibull shape parameter of the observers')
+    parser.add_argument('--lapse', type=float, default=0.0)
+    parser.add_argument('--spread-reversals', type=int, default=None,
+                        help='stop once the last N reversals are within --spread-tolerance (see StaircaseEngine)')
+    parser.add_argument('--spread-tolerance', type=float, default=0.15)
+    parser.add_argument('--smallest-step-reversals', type=int, default=None,
+                        help='stop after N reversals at the smallest step size')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    rules = {'reversal_spread': None, 'smallest_step_reversals': args.smallest_step_reversals}
+    if args.spread_reversals:
+        rules['reversal_spread'] = {'reversals': args.spread_reversals, 'tolerance': args.spread_tolerance}
+
+    start = time.perf_counter()
+    simulation = simulate_staircase(args.task, args.observers, args.threshold, args.slope, args.lapse,
+                                    stopping_rules=rules, seed=args.seed)
+    elapsed = time.perf_counter() - start
+
+    target = target_difference(args.threshold, args.slope, args.lapse)
+    print(f"Simulated {args.observers} observers in {elapsed:.2f} s; 70.7% point of the observers: {target:.4f}")
+    for key, value in summarize_simulation(simulation, target).items():
+        print(f"{key}: {value}")
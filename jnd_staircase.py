@@ -0,0 +1,285 @@
+"""
+jnd_staircase.py
+
+This module contains the adaptive staircase procedure of the Just-Noticeable-Difference (JND) experiment without any
+PsychoPy dependency. The trial and practice sessions in jnd_task_setup.py feed the participant's responses into a
+StaircaseEngine, and the same engine can be driven by simulated observers to test changes to the procedure without a
+display.
+
+The staircase follows the 1-down-1-up protocol up to the first incorrect response, and a 2-down-1-up protocol
+thereafter. Step sizes are taken from get_step_size for the current difference. An incorrect response at the initial
+difference does not move the staircase.
+
+A run stops after num_trials trials, after max_reversals reversals or when the test stimulus equals the baseline.
+Optional convergence rules (see StaircaseEngine) stop it earlier once the reversals have settled. They are checked
+after each trial from the last reversals only; the rule that ended a run is available as stop_reason.
+
+Classes:
+--------
+- ReversalTracker: Counts the reversals of a staircase incrementally, in constant time per trial, and keeps the
+reversal indices, the reversal levels and a running threshold estimate.
+
+- StaircaseEngine: Explicit state of one staircase run and a step(correct) method that applies a response and
+returns the values to be written to the results file.
+"""
+
+
+import statistics
+from collections import deque
+from jnd_configuration import get_step_size
+from jnd_stimuli import level_scales
+
+
+class ReversalTracker:
+    """
+    Incremental reversal counting of the staircase.
+
+    Only the directions of the last three trials are needed to decide whether a trial is a reversal, so update() is
+    constant time. The threshold is the mean (and median) of the levels of the last num_reversals reversals; the sum
+    of these levels is kept up to date, so the estimate is available after every trial without a rescan.
+
+    Attributes:
+        reversals (int): The number of reversals counted so far.
+        reversal_indices (list): The index (from 0) of each trial that was a reversal.
+        reversal_levels (list): The difference of each trial that was a reversal.
+        num_reversals (int): The number of last reversals that make up the threshold.
+    """
+
+    def __init__(self, num_reversals=6):
+        """
+        Start without reversals; the direction before the first trial is 'down'.
+
+        Args:
+            num_reversals (int, optional): The number of last reversals that make up the threshold. Defaults to 6.
+        """
+        self.num_reversals = num_reversals
+        self.reversals = 0
+        self.reversal_indices = []
+        self.reversal_levels = []
+        self.trial_index = 0
+        self._directions = deque(['down'], maxlen=3)
+        self._selected = deque(maxlen=num_reversals)
+        self._selected_sum = 0.0
+
+    def update(self, direction, level):
+        """
+        Count the reversal of one trial.
+
+        A trial is a reversal if its direction turns the staircase around: down-up or up-down, also with one 'none'
+        in between, and up-none-none-down.
+
+        Args:
+            direction (str): The direction of the trial ('down', 'none' or 'up').
+            level (float): The difference of the trial.
+
+        Returns:
+            bool: True if the trial is a reversal.
+        """
+        previous = self._directions[-1]
+        before_previous = self._directions[-2] if len(self._directions) >= 2 else None
+        third_previous = self._directions[-3] if len(self._directions) >= 3 else None
+        # counts as reversal only when sequence True-False or False-True-True
+        is_reversal = (
+                (previous == 'down' and direction == 'up') or
+                (previous == 'up' and direction == 'down') or
+                (before_previous == 'down' and previous == 'none' and direction == 'up') or
+                (before_previous == 'up' and previous == 'none' and direction == 'down') or
+                (third_previous == 'up' and before_previous == 'none' and previous == 'none' and direction == 'down')
+        )
+        if is_reversal:
+            self.reversals += 1
+            self.reversal_indices.append(self.trial_index)
+            self.reversal_levels.append(level)
+            if len(self._selected) == self.num_reversals:
+                self._selected_sum -= self._selected[0]
+            self._selected.append(level)
+            self._selected_sum += level
+        self._directions.append(direction)
+        self.trial_index += 1
+        return is_reversal
+
+    def threshold(self):
+        """
+        Return the current threshold estimate, as calculate_threshold in jnd_visualization.py does for a list.
+
+        Returns:
+            tuple: Mean and median of the levels of the last num_reversals reversals (nan before the first
+            reversal), and these levels.
+        """
+        selected_reversals = list(self._selected)
+        if not selected_reversals:
+            return float('nan'), float('nan'), selected_reversals
+        return self._selected_sum / len(selected_reversals), statistics.median(selected_reversals), selected_reversals
+
+
+class StaircaseEngine:
+    """
+    State of one run of the adaptive staircase procedure.
+
+    Attributes:
+        procedure (str): 'staircase', the value of the procedure column of the results file.
+        task (str): The task name ("pitch", "FL", or "pause").
+        current_difference (float): The difference between test and baseline stimulus of the next trial.
+        step_size (float): The step size of the next trial.
+        trial_index (int): The number of trials done so far.
+        reversals (int): The number of reversals counted so far.
+        differences (list): The difference of each trial done so far.
+        correct_responses (list): Whether the response of each trial was correct.
+        reversals_list (list): The number of reversals before the first and after each trial.
+        previous_direction (list): The direction of each trial, preceded by the initial direction 'down'.
+        reversal_tracker (ReversalTracker): The reversal indices, levels and threshold estimate of the run.
+        smallest_step_reversals (int): The number of reversals at the smallest step size of the task.
+    """
+
+    procedure = 'staircase'
+
+    def __init__(self, task, initial_difference, num_trials=120, max_reversals=18, practice=False,
+                 practice_correct=4, stopping_rules=None):
+        """
+        Set up the staircase at the initial difference.
+
+        Args:
+            task (str): The task name ("pitch", "FL", or "pause").
+            initial_difference (float): The difference between test and baseline stimulus of the first trial.
+            num_trials (int, optional): The run stops once more than num_trials trials are done. Defaults to 120.
+            max_reversals (int, optional): The run stops once more than max_reversals reversals are counted.
+                Defaults to 18.
+            practice (bool, optional): Use the rules of the practice session: after the first incorrect response
+                every further correct response in a row moves the staircase down, reversals are not counted, and the
+                run stops after practice_correct correct responses. Defaults to False.
+            practice_correct (int, optional): Number of correct responses that end a practice run. Defaults to 4.
+            stopping_rules (dict, optional): Convergence rules that end the run early, None or missing entries are
+                disabled. 'reversal_spread': {'reversals': k, 'tolerance': t} stops once the standard deviation of
+                the levels of the last k reversals is at most t times their mean. 'smallest_step_reversals': n stops
+                once n reversals happened at the smallest step size of the task. Defaults to None (no early stop).
+        """
+        self.task = task
+        self.initial_difference = initial_difference
+        self.num_trials = num_trials
+        self.max_reversals = max_reversals
+        self.practice = practice
+        self.practice_correct = practice_correct
+
+        self.current_difference = initial_difference
+        self.step_size = get_step_size(task)
+        self.two_down_one_up = False
+        self.correct_in_a_row = 1
+        self.correct_count = 0
+        self.incorrect_trials = 0
+        self.trial_index = 0
+        self.reversals = 0
+        self.differences = []
+        self.correct_responses = []
+        self.reversals_list = [self.reversals]
+        self.previous_direction = ['down']
+        self.reversal_tracker = ReversalTracker()
+        self.stopping_rules = stopping_rules or {}
+        self.smallest_step = get_step_size(task, test_difference=0)
+        self.smallest_step_reversals = 0
+        self._level_scale = level_scales[task]
+
+    @property
+    def reached_baseline(self):
+        """True if the test stimulus of the next trial is the baseline stimulus."""
+        return round(self.current_difference * self._level_scale) == 0
+
+    @property
+    def finished(self):
+        """True if one of the stopping rules of the run applies."""
+        return self.stop_reason is not None
+
+    @property
+    def stop_reason(self):
+        """
+        The stopping rule that applies after the last trial: 'practice_correct', 'num_trials', 'max_reversals',
+        'baseline', 'reversal_spread' or 'smallest_step_reversals', or None while the run continues.
+        """
+        if self.practice:
+            return 'practice_correct' if self.correct_count >= self.practice_correct else None
+        if self.trial_index > self.num_trials:
+            return 'num_trials'
+        if self.reversals > self.max_reversals:
+            return 'max_reversals'
+        if self.reached_baseline:
+            return 'baseline'
+
+        reversal_spread = self.stopping_rules.get('reversal_spread')
+        if reversal_spread and self.reversals >= reversal_spread['reversals']:
+            levels = self.reversal_tracker.reversal_levels[-reversal_spread['reversals']:]
+            mean = statistics.mean(levels)
+            if statistics.pstdev(levels) <= reversal_spread['tolerance'] * mean:
+                return 'reversal_spread'
+        smallest_step_reversals = self.stopping_rules.get('smallest_step_reversals')
+        if smallest_step_reversals and self.smallest_step_reversals >= smallest_step_reversals:
+            return 'smallest_step_reversals'
+        return None
+
+    def next_differences(self):
+        """
+        Determine the possible differences of the next trial: one step down, the same difference or one step up.
+
+        Returns:
+            set: The possible differences of the next trial.
+        """
+        return {round(self.current_difference + change, 4) for change in (-self.step_size, 0.0, self.step_size)}
+
+    def step(self, correct):
+        """
+        Apply the response of the current trial and move the staircase to the next trial.
+
+        Args:
+            correct (bool): Whether the participant's response was correct.
+
+        Returns:
+            dict: The values of the trial that was just done - 'difference', 'step_size', 'reversals' (counted
+            before this trial), 'direction' ('down', 'none' or 'up') and 'correct'.
+        """
+        current_difference = self.current_difference
+        step_size = self.step_size
+
+        if correct:
+            self.correct_in_a_row += 1
+            self.correct_count += 1
+            if not self.two_down_one_up:
+                direction = 'down'
+            elif self.correct_in_a_row >= 2 and (self.practice or self.correct_in_a_row % 2 == 0):
+                direction = 'down'
+            else:
+                direction = 'none'
+        else:
+            if current_difference == self.initial_difference:  # no direction change if at max difference level
+                direction = 'none'
+            else:
+                self.two_down_one_up = True
+                self.correct_in_a_row = 0
+                direction = 'up'
+            self.incorrect_trials += 1
+
+        if direction == 'down':
+            new_difference = current_difference - step_size
+        elif direction == 'up':
+            new_difference = current_difference + step_size
+        else:
+            new_difference = current_difference
+
+        trial = {'difference': current_difference,
+                 'step_size': step_size,
+                 'reversals': self.reversals,
+                 'direction': direction,
+                 'correct': correct}
+        self.differences.append(current_difference)
+        self.correct_responses.append(correct)
+
+        # prepare for the next iteration
+        self.trial_index += 1
+        self.current_difference = round(new_difference, 4)
+        self.step_size = get_step_size(self.task, test_difference=self.current_difference)
+
+        if not self.practice:
+            if self.reversal_tracker.update(direction, current_difference) and step_size == self.smallest_step:
+                self.smallest_step_reversals += 1
+            self.reversals = self.reversal_tracker.reversals
+
+        self.previous_direction.append(direction)
+        self.reversals_list.append(self.reversals)
+        return trial
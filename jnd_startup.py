@@ -0,0 +1,148 @@
+"""
+jnd_startup.py
+
+This module measures how long the Just-Noticeable-Difference (JND) experiment takes to start, so that the startup
+time can be compared from one release to the next.
+
+During the experiment a StartupReport times the phases of the startup (the imports, the path checks, the indexing of
+the stimuli, ...), prints them and appends them to 'results/startup_times.csv'. The time the experimenter spends in
+the participant dialog is not part of any phase.
+
+Run as a script, the module imports the experiment in a fresh interpreter with Python's '-X importtime' option and
+lists the modules whose import takes the longest, including everything they import themselves.
+
+Classes:
+--------
+- StartupReport: Times the phases of the startup, prints them and appends them to the startup times file.
+
+Functions:
+----------
+- profile_imports(module): Imports a module in a fresh interpreter and returns the import time of each module.
+
+Usage:
+------
+    python jnd_startup.py [--module jnd_experiment] [--top 20] [--output results/import_times.csv]
+"""
+
+
+import contextlib
+import csv
+import datetime
+import os
+import platform
+import re
+import subprocess
+import sys
+import time
+
+
+startup_times_columns = ['date', 'phase', 'seconds', 'frozen', 'python']
+
+
+class StartupReport:
+    """
+    Times the phases of the startup of the experiment.
+
+    Attributes:
+        phases (list): The name and the duration in seconds of each phase, in the order they were timed.
+    """
+
+    def __init__(self):
+        """Start the report; phases are timed with phase()."""
+        self.phases = []
+        self._start = time.perf_counter()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """
+        Time the code of a with-block as one phase.
+
+        Args:
+            name (str): The name of the phase, e.g. 'import psychopy'.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - start))
+
+    def report(self, output_path=None):
+        """
+        Print the duration of each phase and append them to the startup times file.
+
+        Args:
+            output_path (str, optional): The results directory. The phases are only printed if it is not given.
+        """
+        total = sum(seconds for _, seconds in self.phases)
+        print(f"Startup took {total:.2f} s:")
+        for name, seconds in self.phases:
+            print(f"    {name:<32} {seconds:7.3f} s")
+
+        if output_path is None:
+            return
+        path = os.path.join(output_path, 'startup_times.csv')
+        write_header = not os.path.exists(path)
+        date = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        with open(path, 'a', newline='', encoding='utf-8') as startup_file:
+            writer = csv.writer(startup_file)
+            if write_header:
+                writer.writerow(startup_times_columns)
+            for name, seconds in self.phases + [('total', total)]:
+                writer.writerow([date, name, round(seconds, 4), getattr(sys, 'frozen', False),
+                                 platform.python_version()])
+
+
+def profile_imports(module='jnd_experiment'):
+    """
+    Import a module in a fresh interpreter with '-X importtime' and collect the import time of every module.
+
+    Args:
+        module (str, optional): The module to import. Defaults to 'jnd_experiment'.
+
+    Returns:
+        list: (module, own time, cumulative time, nesting depth) tuples in seconds, in the order of the report of
+        the interpreter (a module is listed after the modules it imports). Depth 0 are the modules imported directly.
+
+    Raises:
+        Exception: If the module cannot be imported.
+    """
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                             capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    if process.returncode != 0:
+        raise Exception(f'Importing {module} failed:\n{process.stderr[-2000:]}')
+
+    imports = []
+    pattern = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)')
+    for line in process.stderr.splitlines():
+        match = pattern.match(line)
+        if match:
+            own, cumulative, indent, name = match.groups()
+            imports.append((name, int(own) / 1e6, int(cumulative) / 1e6, (len(indent) - 1) // 2))
+    return imports
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='List the slowest imports of the experiment.')
+    parser.add_argument('--module', default='jnd_experiment', help='module to import')
+    parser.add_argument('--top', type=int, default=20, help='number of modules to list')
+    parser.add_argument('--output', default=None, help='csv file to append the import times of all modules to')
+    args = parser.parse_args()
+
+    import_times = profile_imports(args.module)
+    total = sum(cumulative for _, _, cumulative, depth in import_times if depth == 0)
+    print(f"Importing {args.module} took {total:.2f} s. Slowest modules (cumulative, including their imports):")
+    # the packages imported directly or by the modules of the experiment, e.g. numpy or psychopy.visual
+    for name, own, cumulative, depth in sorted(import_times, key=lambda entry: -entry[2])[:args.top]:
+        print(f"    {name:<40} {cumulative:7.3f} s (own {own:.3f} s)")
+
+    if args.output:
+        write_header = not os.path.exists(args.output)
+        date = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        with open(args.output, 'a', newline='', encoding='utf-8') as import_file:
+            writer = csv.writer(import_file)
+            if write_header:
+                writer.writerow(['date', 'module', 'own_seconds', 'cumulative_seconds', 'depth'])
+            for name, own, cumulative, depth in import_times:
+                writer.writerow([date, name, own, cumulative, depth])
@@ -0,0 +1,386 @@
+"""
+jnd_stimuli.py
+
+This module builds an in-memory index of the stimulus files of a Just-Noticeable-Difference (JND) task.
+The index is built once per task at startup from a single scan of the task's stimulus directory plus the
+'manipulation_*.csv' file written by the Praat manipulation scripts. During the session, the stimulus for a given
+difference level is then looked up in a dictionary instead of building a file name and checking it on disk.
+If the stimulus set of the task has been packed into a single file (see jnd_pack.py), the index is read from the
+header of the pack (or of the deduplicated store, see jnd_dedup.py) instead, and the directory of wav files is not
+needed; if the wav files changed after the pack was written, they are read instead of the outdated pack. If the
+stimuli of the task are synthesized (see jnd_synthesis.py), every level from the baseline to the highest level the
+staircase can reach is available.
+
+Difference levels are quantized to integers with the precision of the stimulus file names (thousandths for pitch and
+pause, ten-thousandths for FL), e.g. 'nelli_ch_rise_13_112.wav' has level 13112.
+
+Functions:
+----------
+- quantize_level(value, task): Converts a float value to the integer level used in the stimulus file names.
+
+- level_suffix(level, task): Converts an integer level back to the file name suffix, e.g. 13112 -> '13_112'.
+
+Classes:
+--------
+- StimulusIndex: Maps the integer levels of a task to the stimulus files on disk and reports levels the staircase can
+reach, but for which no stimulus file exists.
+A task with missing levels up to its highest stimulus is refused; above the highest stimulus, which the staircase
+reaches after incorrect responses, the highest stimulus is played instead.
+"""
+
+
+import csv
+import glob
+import os
+import re
+from jnd_configuration import get_step_size, general_experiment_configs
+from jnd_audio import read_wav
+from jnd_dedup import DedupStore, dedup_path_for
+from jnd_pack import StimulusPack, pack_path_for
+from jnd_synthesis import PauseSynthesizer
+
+
+# number of levels per unit - matches the number of decimal places in the stimulus file names
+level_scales = {"pitch": 1000,
+                "pause": 1000,
+                "FL": 10000}
+
+
+def quantize_level(value, task):
+    """
+    Convert a value to the integer level used in the stimulus file names.
+
+    Args:
+        value (float): The value, e.g. baseline + current difference.
+        task (str): The task name ("pitch", "FL", or "pause").
+
+    Returns:
+        int: The quantized level.
+    """
+    return int(round(value * level_scales[task]))
+
+
+def level_suffix(level, task):
+    """
+    Convert an integer level to the suffix of the stimulus file name.
+
+    Args:
+        level (int): The quantized level.
+        task (str): The task name ("pitch", "FL", or "pause").
+
+    Returns:
+        str: The file name suffix, e.g. '13_112' for pitch level 13112 or '0_0003' for FL level 3.
+    """
+    scale = level_scales[task]
+    decimal_places = len(str(scale)) - 1
+    return f"{level // scale}_{level % scale:0{decimal_places}d}"
+
+
+class StimulusIndex:
+    """
+    In-memory index of the stimulus files of one task.
+
+    The stimulus directory is scanned once when the index is created; lookups afterwards are dictionary accesses and
+    do not touch the disk.
+
+    Attributes:
+        task (str): The task name ("pitch", "FL", or "pause").
+        files (dict): Maps the integer level to the path of the stimulus file.
+        expected_levels (set): The levels listed in the manipulation csv file of the task.
+        pack (StimulusPack): The stimulus pack (or DedupStore) of the task, or None if the stimuli are read from the
+            wav files.
+        synthesizer (PauseSynthesizer): The synthesizer of the stimuli of the task, or None if they are read from disk.
+    """
+
+    def __init__(self, exp_config, use_pack=True, synthesize=True):
+        """
+        Build the index for a task.
+
+        Args:
+            exp_config (dict): The task-specific configuration from get_task_specific_config.
+            use_pack (bool, optional): Whether to use the stimulus pack or, if there is none, the deduplicated store
+                of the task if it exists. The paths of the stimuli stay the same ('<stimuli_path>/<name>.wav'), they
+                only identify the stimulus in the pack. Defaults to True.
+            synthesize (bool, optional): Whether to synthesize the stimuli if the configuration has a
+                'synthesis_source'. Defaults to True.
+        """
+        self.task = exp_config["task"]
+        self.stimuli_path = exp_config["stimuli_path"]
+        self.stim_prefix = exp_config["stim_prefix"]
+        self.baseline = exp_config["baseline"]
+        self.initial_difference = exp_config["initial_difference"]
+        self.files = {}
+        self.expected_levels = set()
+        self.pack = None
+        self.synthesizer = None
+        self._clamped_levels = set()
+
+        self._name_pattern = re.compile(rf'^{re.escape(self.stim_prefix)}_(\d+)_(\d+)$')
+        if synthesize and exp_config.get("synthesis_source"):
+            self._set_up_synthesis(exp_config["synthesis_source"])
+        else:
+            pack = self._open_pack() if use_pack else None
+            if pack is not None:
+                self._read_pack(pack)
+            else:
+                self._scan_directory()
+                self._read_manipulation_files()
+
+    def _open_pack(self):
+        """
+        Open the stimulus pack or, if there is none, the deduplicated store of the task.
+
+        Returns:
+            StimulusPack: The pack (or DedupStore), or None if there is none or the wav files of the stimulus
+            directory changed after it was written.
+        """
+        for path, reader in ((pack_path_for(self.stimuli_path), StimulusPack),
+                             (dedup_path_for(self.stimuli_path), DedupStore)):
+            if not os.path.isfile(path):
+                continue
+            pack = reader(path)
+            stale = pack.stale_sources(self.stimuli_path)
+            if not stale:
+                return pack
+            pack.close()
+            print(f"Task {self.task}: {path} is outdated ({len(stale)} wav files changed, e.g. {stale[0]}), reading "
+                  f"the wav files instead - run jnd_pack.py or jnd_dedup.py again")
+        return None
+
+    def _read_pack(self, pack):
+        """Take the stimuli and the expected levels from the header of the stimulus pack."""
+        self.pack = pack
+        for name in self.pack.entries:
+            level = self._parse_level(os.path.splitext(name)[0])
+            if level is not None:
+                self.files[level] = os.path.join(self.stimuli_path, name)
+        self.expected_levels = set(self.pack.expected_levels)
+
+    def _set_up_synthesis(self, synthesis_source):
+        """Make every level from the baseline to the highest level the staircase can reach available."""
+        self.synthesizer = PauseSynthesizer(**synthesis_source)
+        for level in range(quantize_level(self.baseline, self.task), max(self.reachable_levels()) + 1):
+            self.files[level] = os.path.join(self.stimuli_path,
+                                             f'{self.stim_prefix}_{level_suffix(level, self.task)}.wav')
+        self._read_manipulation_files()
+
+    def _parse_level(self, name):
+        """Return the level encoded in a stimulus name (without extension), or None if it does not match."""
+        match = self._name_pattern.match(name)
+        if match is None:
+            return None
+        integer_part, decimal_part = match.groups()
+        scale = level_scales[self.task]
+        if len(decimal_part) != len(str(scale)) - 1:
+            return None
+        return int(integer_part) * scale + int(decimal_part)
+
+    def _scan_directory(self):
+        """Collect all wav files of the task in a single directory scan."""
+        with os.scandir(self.stimuli_path) as entries:
+            for entry in entries:
+                name, extension = os.path.splitext(entry.name)
+                if extension.lower() != '.wav' or not entry.is_file():
+                    continue
+                level = self._parse_level(name)
+                if level is not None:
+                    self.files[level] = os.path.join(self.stimuli_path, entry.name)
+
+    def _read_manipulation_files(self):
+        """Collect the levels listed in the 'nameNew' column of the manipulation csv files."""
+        for csv_path in glob.glob(os.path.join(self.stimuli_path, 'manipulation_*.csv')):
+            with open(csv_path, newline='', encoding='utf-8') as csv_file:
+                for row in csv.DictReader(csv_file, delimiter='\t'):
+                    level = self._parse_level(row.get('nameNew') or '')
+                    if level is not None:
+                        self.expected_levels.add(level)
+
+    def level(self, value):
+        """Return the integer level of a value (baseline + difference)."""
+        return quantize_level(value, self.task)
+
+    def value(self, level):
+        """Return the value (baseline + difference) of an integer level, e.g. the pause duration in seconds."""
+        return level / level_scales[self.task]
+
+    def has_level(self, level):
+        """Return True if a stimulus file exists for the integer level."""
+        return level in self.files
+
+    def resolve_level(self, level):
+        """
+        Return the level whose stimulus is played for a level.
+
+        Above the highest level of the stimulus set, the stimulus of the highest level is played. All other levels
+        are returned unchanged.
+
+        Args:
+            level (int): The quantized level (baseline + difference).
+
+        Returns:
+            int: The level of the stimulus to play.
+        """
+        if level in self.files or not self.files:
+            return level
+        return min(level, max(self.files))
+
+    def path(self, value):
+        """
+        Look up the stimulus file for a value (baseline + difference).
+
+        Args:
+            value (float): The value used to identify the stimulus file. Values above the highest stimulus get the
+                highest stimulus, see resolve_level; this is printed once per level.
+
+        Returns:
+            str: The path of the stimulus file.
+
+        Raises:
+            Exception: If there is no stimulus file for the value.
+        """
+        requested_level = self.level(value)
+        level = self.resolve_level(requested_level)
+        if level != requested_level and requested_level not in self._clamped_levels:
+            self._clamped_levels.add(requested_level)
+            print(f"Task {self.task}: no stimulus for level {level_suffix(requested_level, self.task)}, playing the "
+                  f"highest level {level_suffix(level, self.task)} instead")
+        try:
+            return self.files[level]
+        except KeyError:
+            raise Exception(f'No stimulus found: {self.stim_prefix}_{level_suffix(level, self.task)}.wav '
+                            f'in {self.stimuli_path}')
+
+    def read_samples(self, path):
+        """
+        Decode a stimulus - synthesized, from the stimulus pack or from its wav file.
+
+        Args:
+            path (str): The path of the stimulus file, as returned by path().
+
+        Returns:
+            tuple: The samples as float32 array in the range -1 to 1 and the sample rate in Hz.
+        """
+        name = os.path.basename(path)
+        if self.synthesizer is not None:
+            return self.synthesizer.float_samples(self.value(self._parse_level(os.path.splitext(name)[0]))), \
+                self.synthesizer.sample_rate
+        if self.pack is not None:
+            return self.pack.float_samples(name), self.pack.sample_rate
+        return read_wav(path)
+
+    def close(self):
+        """Close the stimulus pack (or DedupStore) of the task, if the stimuli are read from one."""
+        if self.pack is not None:
+            self.pack.close()
+
+    def _step_level(self, difference):
+        """Return the quantized step size of the staircase at a quantized difference."""
+        scale = level_scales[self.task]
+        return quantize_level(get_step_size(self.task, test_difference=difference / scale), self.task)
+
+    def neighbour_levels(self, difference, radius=1):
+        """
+        Determine the levels the staircase can reach from a difference within a number of steps.
+
+        Args:
+            difference (float): The current difference between test and baseline stimulus.
+            radius (int, optional): The number of staircase steps. Defaults to 1.
+
+        Returns:
+            set: The levels (baseline + difference) within reach, including the current one.
+        """
+        seen = {quantize_level(difference, self.task)}
+        frontier = set(seen)
+        for _ in range(radius):
+            next_frontier = set()
+            for current in frontier:
+                if current <= 0:  # test stimulus equals baseline - the session stops here
+                    continue
+                step = self._step_level(current)
+                next_frontier.update((current - step, current + step))
+            frontier = next_frontier - seen
+            seen |= frontier
+
+        baseline = quantize_level(self.baseline, self.task)
+        return {baseline + difference for difference in seen}
+
+    def reachable_levels(self, num_trials=None):
+        """
+        Determine all levels the staircase can reach from the initial difference within a session.
+
+        The staircase moves down or up by the step size returned by get_step_size for the current difference. It
+        does not move up after an incorrect response at the initial difference, but it does move up from every other
+        difference, also above the initial difference. The session stops as soon as the difference reaches zero.
+
+        Args:
+            num_trials (int, optional): The number of trials of the session, which limits how far the staircase can
+                move up. Defaults to general_experiment_configs["num_trials"].
+
+        Returns:
+            set: The reachable levels (baseline + difference), including the baseline.
+        """
+        if num_trials is None:
+            num_trials = general_experiment_configs["num_trials"]
+        start = quantize_level(self.initial_difference, self.task)
+        seen = {start}
+        frontier = {start}
+        for _ in range(num_trials + 1):  # the session stops once more than num_trials trials are done
+            next_frontier = set()
+            for difference in frontier:
+                if difference <= 0:  # test stimulus equals baseline - the session stops here
+                    continue
+                step = self._step_level(difference)
+                next_frontier.add(difference - step)
+                if difference != start:
+                    next_frontier.add(difference + step)
+            frontier = next_frontier - seen
+            if not frontier:
+                break
+            seen |= frontier
+
+        baseline = quantize_level(self.baseline, self.task)
+        return {baseline} | {baseline + difference for difference in seen}
+
+    def missing_levels(self):
+        """
+        Return the levels that are listed in the manipulation csv or reachable by the staircase, but have no file.
+
+        Reachable levels above the highest stimulus are not missing, they are played with the highest stimulus (see
+        resolve_level), unless the stimulus of the initial difference itself is missing.
+
+        Returns:
+            list: The missing levels in ascending order.
+        """
+        highest = max(self.files, default=None)
+        initial = quantize_level(self.baseline + self.initial_difference, self.task)
+        reachable = {level for level in self.reachable_levels()
+                     if highest is not None and level <= highest or level == initial}
+        return sorted((self.expected_levels | reachable) - set(self.files))
+
+    def report_missing_levels(self, missing=None):
+        """
+        Print the stimulus files that are missing for this task and refuse to run it if the staircase can reach one.
+
+        Args:
+            missing (list, optional): The missing levels, if they were already determined with missing_levels().
+
+        Returns:
+            list: The missing levels in ascending order.
+
+        Raises:
+            Exception: If a missing level can be reached by the staircase - the session would stop at this level.
+        """
+        if missing is None:
+            missing = self.missing_levels()
+        if missing:
+            print(f"Task {self.task}: {len(missing)} stimulus files missing in {self.stimuli_path}:")
+            for level in missing:
+                print(f"    {self.stim_prefix}_{level_suffix(level, self.task)}.wav")
+        else:
+            print(f"Task {self.task}: all {len(self.files)} stimulus files found.")
+        reachable_missing = set(missing) & self.reachable_levels()
+        if reachable_missing:
+            raise Exception(f'Task {self.task} cannot be run: the staircase can reach {len(reachable_missing)} levels '
+                            f'without a stimulus in {self.stimuli_path}, the lowest is '
+                            f'{self.stim_prefix}_{level_suffix(min(reachable_missing), self.task)}.wav')
+        return missing
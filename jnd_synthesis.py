@@ -0,0 +1,192 @@
+"""
+jnd_synthesis.py
+
+This module builds the stimuli of the pause task of the Just-Noticeable-Difference (JND) experiment in memory instead
+of reading them from the pre-rendered wav files in 'audio/audio-pause'.
+
+The base recording ('stimuli/to-be-manipulated/pause/cut_name2_name3/lilli_lisa_ch.wav') and its TextGrid are read
+once. The TextGrid marks the pause between the two names (interval 'pause3' of tier 'word'). A stimulus with a given
+pause duration is the base recording with this interval replaced by zero samples of that duration, scaled to the
+intensity of the pre-rendered stimuli (74 dB, like Praat's 'Scale intensity'). Every pause duration is available
+without disk access, at the resolution of one sample.
+
+The pre-rendered files were made with Praat's overlap-add resynthesis, which slightly changes the waveform of the
+whole utterance, so the synthesized stimuli are not sample-identical to them; verify_synthesis reports how much they
+differ.
+
+The synthesis is used for the pause task if general_experiment_configs["synthesize_pause"] is True.
+
+Classes:
+--------
+- PauseSynthesizer: Builds pause stimuli from the base recording and its TextGrid.
+
+Functions:
+----------
+- read_textgrid(path): Reads the interval tiers of a Praat TextGrid.
+
+- verify_synthesis(synthesizer, stimulus_index): Compares the synthesized stimuli with the pre-rendered wav files.
+
+Usage:
+------
+    python jnd_synthesis.py
+"""
+
+
+import re
+import wave
+import numpy as np
+
+
+# intensity of the stimuli in dB SPL (re 2e-5 Pa), as set with Praat's 'Scale intensity' for the pre-rendered stimuli
+target_intensity = 74.0
+
+
+def read_textgrid(path):
+    """
+    Read the interval tiers of a Praat TextGrid (long text format).
+
+    Args:
+        path (str): The path of the TextGrid file.
+
+    Returns:
+        dict: Maps the name of each interval tier to its intervals, a list of (xmin, xmax, text) tuples.
+    """
+    with open(path, encoding='utf-8') as textgrid_file:
+        content = textgrid_file.read()
+
+    tiers = {}
+    # each tier starts with 'item [n]:' and, for interval tiers, lists 'intervals [n]:' with xmin, xmax and text
+    for tier in re.split(r'\n\s*item \[\d+\]:', content)[1:]:
+        if '"IntervalTier"' not in tier:
+            continue
+        name = re.search(r'name = "(.*)"', tier).group(1)
+        tiers[name] = [(float(xmin), float(xmax), text) for xmin, xmax, text in
+                       re.findall(r'intervals \[\d+\]:\s*xmin = (\S+)\s*xmax = (\S+)\s*text = "(.*)"', tier)]
+    return tiers
+
+
+class PauseSynthesizer:
+    """
+    Builds pause stimuli from the base recording and its TextGrid.
+
+    Attributes:
+        sample_rate (int): The sample rate of the base recording in Hz.
+        original_pause (float): The duration of the pause in the base recording in seconds.
+    """
+
+    def __init__(self, wav_path, textgrid_path, tier='word', interval='pause3', intensity=target_intensity):
+        """
+        Read the base recording and the boundaries of the pause.
+
+        Args:
+            wav_path (str): The path of the base recording (16-bit PCM, mono).
+            textgrid_path (str): The path of its TextGrid.
+            tier (str, optional): The tier that marks the pause. Defaults to 'word'.
+            interval (str, optional): The text of the pause interval. Defaults to 'pause3'.
+            intensity (float, optional): The intensity of the stimuli in dB SPL. Defaults to target_intensity.
+
+        Raises:
+            Exception: If the recording is not 16-bit PCM mono or the TextGrid has no such interval.
+        """
+        with wave.open(wav_path, 'rb') as wav_file:
+            if wav_file.getsampwidth() != 2 or wav_file.getnchannels() != 1:
+                raise Exception(f'Only 16-bit PCM mono wav files are supported: {wav_path}')
+            self.sample_rate = wav_file.getframerate()
+            base = np.frombuffer(wav_file.readframes(wav_file.getnframes()), dtype='<i2')
+
+        pause = [(xmin, xmax) for xmin, xmax, text in read_textgrid(textgrid_path).get(tier, []) if text == interval]
+        if not pause:
+            raise Exception(f'No interval "{interval}" in tier "{tier}" of {textgrid_path}')
+        start, end = (int(round(boundary * self.sample_rate)) for boundary in pause[0])
+        self.original_pause = (end - start) / self.sample_rate
+
+        self._before = base[:start].astype(np.float64) / 32768.0
+        self._after = base[end:].astype(np.float64) / 32768.0
+        # the inserted pause is silence, so the energy of a stimulus is the energy of the speech around it
+        self._energy = float(self._before @ self._before + self._after @ self._after)
+        self._amplitude = 2e-5 * 10 ** (intensity / 20)
+
+    def frames(self, pause):
+        """Return the number of samples of the stimulus with a pause of the given duration in seconds."""
+        return len(self._before) + int(round(pause * self.sample_rate)) + len(self._after)
+
+    def duration(self, pause):
+        """Return the duration of the stimulus with a pause of the given duration in seconds."""
+        return self.frames(pause) / self.sample_rate
+
+    def float_samples(self, pause):
+        """
+        Build the stimulus with a pause of the given duration.
+
+        Args:
+            pause (float): The duration of the pause in seconds.
+
+        Returns:
+            numpy.ndarray: The samples as float32 array in the range -1 to 1, like read_wav in jnd_audio.py.
+        """
+        frames = self.frames(pause)
+        gain = self._amplitude * np.sqrt(frames / self._energy)
+        samples = np.zeros(frames, dtype=np.float32)
+        samples[:len(self._before)] = self._before * gain
+        samples[frames - len(self._after):] = self._after * gain
+        return samples
+
+    def samples(self, pause):
+        """
+        Build the stimulus with a pause of the given duration as 16-bit PCM, as it would be written to a wav file.
+
+        Args:
+            pause (float): The duration of the pause in seconds.
+
+        Returns:
+            numpy.ndarray: The int16 samples.
+        """
+        return np.clip(np.round(self.float_samples(pause) * 32768.0), -32768, 32767).astype('<i2')
+
+
+def verify_synthesis(synthesizer, stimulus_index):
+    """
+    Compare the synthesized stimuli sample-for-sample with the pre-rendered wav files of the pause task.
+
+    Args:
+        synthesizer (PauseSynthesizer): The synthesizer.
+        stimulus_index (StimulusIndex): The index of the pre-rendered stimuli (built without synthesis).
+
+    Returns:
+        list: One dictionary per level with the 'level', whether the stimuli are 'identical', the difference in
+        length 'frame_difference' (synthesized - file) and, for stimuli of equal length, the largest absolute
+        difference of the samples 'max_difference'.
+    """
+    comparisons = []
+    for level, path in sorted(stimulus_index.files.items()):
+        with wave.open(path, 'rb') as wav_file:
+            rendered = np.frombuffer(wav_file.readframes(wav_file.getnframes()), dtype='<i2')
+        synthesized = synthesizer.samples(stimulus_index.value(level))
+        same_length = len(synthesized) == len(rendered)
+        max_difference = None
+        if same_length:
+            max_difference = int(np.abs(synthesized.astype(np.int32) - rendered).max(initial=0))
+        comparisons.append({'level': level,
+                            'identical': same_length and max_difference == 0,
+                            'frame_difference': len(synthesized) - len(rendered),
+                            'max_difference': max_difference})
+    return comparisons
+
+
+if __name__ == '__main__':
+    from jnd_configuration import get_task_specific_config, pause_synthesis_source
+    from jnd_stimuli import StimulusIndex
+
+    pause_synthesizer = PauseSynthesizer(**pause_synthesis_source)
+    rendered_index = StimulusIndex(get_task_specific_config('pause'), use_pack=False, synthesize=False)
+    results = verify_synthesis(pause_synthesizer, rendered_index)
+    identical = sum(result['identical'] for result in results)
+    other_length = [result for result in results if result['frame_difference']]
+    differences = [result['max_difference'] for result in results if result['max_difference'] is not None]
+    print(f"{identical} of {len(results)} synthesized pause stimuli are sample-identical to the wav files in "
+          f"{rendered_index.stimuli_path}")
+    if other_length:
+        frame_differences = [result['frame_difference'] for result in other_length]
+        print(f"{len(other_length)} differ in length by {min(frame_differences)} to {max(frame_differences)} samples")
+    if differences:
+        print(f"{len(differences)} have the same length, largest sample difference {max(differences)}")
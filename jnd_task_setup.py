@@ -10,43 +10,92 @@ It uses the psychopy library to generate a graphical user interface and to displ
 Functions:
 ----------
 
+- load_sound(): Imports psychopy.sound with the preferred audio library on first use and returns it.
+
+- load_keyboard(): Creates the keyboard the responses are read from on first use and returns it.
+
 - get_participant_info(): Collect participant details using a dialog box. Returns a dictionary with participant info.
 
-- generate_stimulus_path(path_prefix, value, task): Generates the path for a stimulus based on a given path_prefix,
-value and task.
-    Depending on the task type, the function rounds the value to a specific decimal point, converts the decimal to
-    an underscore, and appends it to the path_prefix.
+- confirm_resume(interrupted_session): Asks the experimenter whether to continue an interrupted session.
+
+- draw_axb_order(last_two_combinations): Randomly chooses the order of baseline and test stimulus and the correct
+answer of a trial, so that the same pattern (AAB or ABB) is not shown more than twice in a row.
 
-- run_jnd_task(exp_data, task, win, session_type='trial'): Runs the JND task. Takes experiment data, task type,
-window and session type as input.
-    Sets up a global visual stimulus, gets the task specific configuration, generates the stimulus path, and then
-    runs the task according to the session type (trial or practice).
+- create_response_stimuli(win): Creates the pictures, arrows and audio icon shown during the trials.
 
-- run_trial_session(path_prefix, exp_data, exp_config, session_type, win): Runs a trial session of the JND task.
-Takes path_prefix, experiment data, experiment configuration, session type and window as input.
-    During the session, stimuli are presented to the participant and their responses are recorded.
+- run_jnd_task(exp_data, task, win, session_type='trial', stimulus_index=None, stimulus_cache=None,
+resume_path=None): Runs the JND task. Takes experiment data, task type, window, session type, the stimulus index and
+cache of the task and optionally the results file of an interrupted session as input.
+    Sets up a global visual stimulus, gets the task specific configuration, builds the stimulus index and cache if
+    none are given, and then runs the task according to the session type (trial or practice).
 
-- run_practice_session(path_prefix, exp_data, exp_config, win): Runs a practice session of the JND task. It is
-similar to run_trial_session, but with fewer trials and additional feedback for participants.
+- run_trial_session(stimulus_index, stimulus_cache, exp_data, exp_config, session_type, win, resume_path=None): Runs
+a trial session of the JND task. Takes the stimulus index and cache, experiment data, experiment configuration,
+session type, window and optionally the results file of an interrupted session as input.
+    During the session, stimuli are presented to the participant and their responses are recorded. An interrupted
+    session is continued with its next trial. The difference of each trial is set by the 2-down-1-up staircase, or by
+    the psi procedure of jnd_psi.py if general_experiment_configs["procedure"] is 'psi'.
+
+- run_interleaved_session(stimulus_indices, stimulus_caches, exp_data, tasks, win): Runs the trial sessions of several
+tasks in one block, with the trials of the tasks interleaved in random order. Each task keeps its own staircase and
+results file.
+
+- run_practice_session(stimulus_index, stimulus_cache, exp_data, exp_config, win): Runs a practice session of the
+JND task. It is similar to run_trial_session, but with fewer trials and additional feedback for participants.
 """
 
 
-# Import necessary libraries
-from psychopy import prefs
-# Set the audio library preference
-prefs.hardware['audioLib'] = ['ptb', 'sounddevice', 'pygame', 'pyo']
-# Now, import sound
-from psychopy import sound, visual, event, core, gui
+# Import necessary libraries - psychopy.sound is imported by load_sound when it is first needed
+from psychopy import visual, event, core, gui
+import functools
 import random
 import time
 import datetime
-from librosa import get_duration
-from jnd_configuration import get_step_size, get_task_specific_config, general_experiment_configs
-from jnd_path import stimulus_exists
-from jnd_visualization import create_visualization, calculate_threshold
+from jnd_configuration import get_task_specific_config, general_experiment_configs
+from jnd_stimuli import StimulusIndex
+from jnd_audio import StimulusCache, AXBPrefetcher, arrange_axb
+from jnd_staircase import StaircaseEngine
+from jnd_psi import PsiEngine, candidate_differences
+from jnd_results import ResultsWriter, trial_columns, practice_columns
+from jnd_resume import read_results_file, restore_staircase
+from jnd_visualization import submit_visualization, plot_date_string
+from jnd_timing import TrialTiming, SessionTiming
+from jnd_frames import FrameMonitor
 import os
 
 
+@functools.lru_cache(maxsize=None)
+def load_sound():
+    """
+    Import psychopy.sound on first use. Loading the audio library takes a while, so it is kept off the startup path
+    of the experiment; the audio library preference is set right before, as it has to be.
+
+    Returns:
+        module: psychopy.sound.
+    """
+    from psychopy import prefs
+    # Set the audio library preference
+    prefs.hardware['audioLib'] = ['ptb', 'sounddevice', 'pygame', 'pyo']
+    # Now, import sound
+    from psychopy import sound
+    return sound
+
+
+@functools.lru_cache(maxsize=None)
+def load_keyboard():
+    """
+    Create the keyboard the responses are read from on first use.
+
+    The keyboard timestamps the key-down events (in hardware with the Psychtoolbox backend) and buffers them until they
+    are read, so keys pressed during the playback are not lost. It is shared by all sessions.
+
+    Returns:
+        keyboard.Keyboard: The response keyboard.
+    """
+    from psychopy.hardware import keyboard
+    return keyboard.Keyboard()
+
+
 def get_participant_info():
     """
     Open a dialogue box with 3 fields: current date and time, subject_ID and experiment name.
@@ -69,70 +118,65 @@ def get_participant_info():
         core.quit()
 
 
-def generate_stimulus_path(path_prefix, value, task):
+def confirm_resume(interrupted_session):
+    """
+    Ask the experimenter in a dialog box whether to continue an interrupted session.
+
+    Args:
+        interrupted_session (dict): The interrupted session, as returned by find_interrupted_session.
+
+    Returns:
+        bool: True if the session is to be continued, False if the task is to start again with a new results file.
+    """
+    resume_dialog = gui.Dlg(title='Just-Noticeable-Difference Experiment')
+    resume_dialog.addText(f"An interrupted session of task {interrupted_session['task']} was found "
+                          f"({len(interrupted_session['rows'])} trials, last written "
+                          f"{interrupted_session['age_hours']:.1f} hours ago):")
+    resume_dialog.addText(os.path.basename(interrupted_session['path']))
+    resume_dialog.addText("OK continues this session, Cancel starts the task again.")
+    resume_dialog.show()
+    return bool(resume_dialog.OK)
+
+
+def draw_axb_order(last_two_combinations):
     """
-        Generate the stimulus file path based on the given value and task.
+        Randomly choose the order of baseline and test stimulus and the correct answer of a trial.
 
-        This function adjusts the precision of the value based on the task type
-        and appends it to the path prefix to create the full stimulus file path.
-        It then checks if the stimulus file exists before returning the file path.
+        The randomization does not depend on the participant's response, so it is drawn one trial ahead and the next
+        trial can be prepared while the participant is still responding.
 
         Args:
-            path_prefix (str): The prefix of the stimulus file path.
-            value (float): The value used to identify the stimulus file.
-            task (str): The type of task, either 'pitch' or 'duration'.
+            last_two_combinations (list): The patterns of the previous trials, updated in place.
 
         Returns:
-            str: The generated stimulus file path if the file exists.
-
-        Raises:
-            Exception: If the stimulus file does not exist.
+            tuple: The order of A and B (e.g. ['test', 'baseline']) and the key of the correct answer ('left' or
+            'right').
     """
-    if task == 'FL':
-        value = round(value, 4)
-        value_suffix = str(value).replace('.', '_')
-        decimal_places = str(value)[::-1].find('.')
-        if decimal_places == 3:
-            value_suffix += '0'
-        elif decimal_places == 2:
-            value_suffix += '00'
-        elif decimal_places == 1:
-            value_suffix += "000"
-        elif decimal_places == -1:  # no decimal places
-            value_suffix += "0000"
-    else:
-        value = round(value, 3)
-        value_suffix = str(value).replace('.', '_')
-        decimal_places = str(value)[::-1].find('.')
-        if decimal_places == 2:
-            value_suffix += '0'
-        elif decimal_places == 1:
-            value_suffix += "00"
-        elif decimal_places == -1:  # no decimal places
-            value_suffix += "000"
-
-    stim_path = f'{path_prefix}_{value_suffix}.wav'
-    if stimulus_exists(stim_path):
-        return stim_path
-    raise Exception(f'No stimulus found: {stim_path}')
-
-
-def run_jnd_task(exp_data, task, win, session_type='trial'):
+    ab_order = random.sample(['baseline', 'test'], k=2)
+    x_key = random.choice(['left', 'right'])
+    current_combination = f"left{x_key}right"
+
+    # making sure: same pattern AAB or ABB not more than twice in a row
+    if len(last_two_combinations) < 2:
+        last_two_combinations.append(current_combination)
+    elif last_two_combinations[0] == last_two_combinations[1]:
+        while current_combination == last_two_combinations[0]:
+            x_key = random.choice(['left', 'right'])
+            current_combination = f"left{x_key}right"
+        last_two_combinations[0] = last_two_combinations[1]
+        last_two_combinations[1] = current_combination
+
+    return ab_order, x_key
+
+
+def create_response_stimuli(win):
     """
-        Run the Just-Noticeable Difference (JND) task for the given task type and session type.
+        Create the visual stimuli of the trials: the AAB and ABB pictures, the arrows and the audio icon.
 
-        This function initializes the visual stimuli and then runs either the trial or practice session
-        based on the given session type.
+        They are kept in module level variables, which are used by all trials.
 
         Args:
-            exp_data (dict): The experiment data containing relevant information.
-            test_nr (int): number of tests that are run.
-            task (str): The type of task, either 'pitch' or 'duration'.
             win (visual.Window): The PsychoPy window used for displaying the stimuli.
-            session_type (str, optional): The type of session, either 'trial' or 'practice'. Defaults to 'trial'.
-
-        Raises:
-            Exception: If the session type is neither 'trial' nor 'practice'.
     """
     # AAB pattern pic
     global AAB
@@ -174,18 +218,52 @@ def run_jnd_task(exp_data, task, win, session_type='trial'):
                                   pos=(0, 0),
                                   name='audio_center')
 
-    exp_config = get_task_specific_config(task)
-    path_prefix = f'{exp_config["stimuli_path"]}{exp_config["stim_prefix"]}'
 
-    if session_type == 'trial':
-        run_trial_session(path_prefix, exp_data, exp_config, session_type, win)
-    elif session_type == 'practice':
-        run_practice_session(path_prefix, exp_data, exp_config, win)
-    else:
-        raise Exception(f"Run type can be either 'trial' or 'practice', received {type}")
+def run_jnd_task(exp_data, task, win, session_type='trial', stimulus_index=None, stimulus_cache=None,
+                 resume_path=None):
+    """
+        Run the Just-Noticeable Difference (JND) task for the given task type and session type.
+
+        This function initializes the visual stimuli and then runs either the trial or practice session
+        based on the given session type.
+
+        Args:
+            exp_data (dict): The experiment data containing relevant information.
+            test_nr (int): number of tests that are run.
+            task (str): The type of task, either 'pitch' or 'duration'.
+            win (visual.Window): The PsychoPy window used for displaying the stimuli.
+            session_type (str, optional): The type of session, either 'trial' or 'practice'. Defaults to 'trial'.
+            stimulus_index (StimulusIndex, optional): The stimulus index of the task. Built from the stimulus
+                directory if not given.
+            stimulus_cache (StimulusCache, optional): The cache of decoded stimuli of the task. Created if not given.
+            resume_path (str, optional): The results file of an interrupted trial session to continue.
 
+        Raises:
+            Exception: If the session type is neither 'trial' nor 'practice'.
+    """
+    create_response_stimuli(win)
 
-def run_trial_session(path_prefix, exp_data, exp_config, session_type, win):
+    exp_config = get_task_specific_config(task)
+    own_index = stimulus_index is None  # an index built here is closed after the session
+    if own_index:
+        stimulus_index = StimulusIndex(exp_config)
+    if stimulus_cache is None:
+        stimulus_cache = StimulusCache(stimulus_index)
+
+    try:
+        if session_type == 'trial':
+            run_trial_session(stimulus_index, stimulus_cache, exp_data, exp_config, session_type, win,
+                              resume_path=resume_path)
+        elif session_type == 'practice':
+            run_practice_session(stimulus_index, stimulus_cache, exp_data, exp_config, win)
+        else:
+            raise Exception(f"Run type can be either 'trial' or 'practice', received {type}")
+    finally:
+        if own_index:
+            stimulus_index.close()
+
+
+def run_trial_session(stimulus_index, stimulus_cache, exp_data, exp_config, session_type, win, resume_path=None):
     """
         Run the trial session of the Just-Noticeable Difference (JND) task.
 
@@ -193,36 +271,144 @@ def run_trial_session(path_prefix, exp_data, exp_config, session_type, win):
         responses. It also handles the staircase procedure, adaptive step sizes, and stopping conditions.
 
         Args:
-            path_prefix (str): The path prefix for the stimulus files.
+            stimulus_index (StimulusIndex): The in-memory index of the stimulus files of the task.
+            stimulus_cache (StimulusCache): The cache of decoded stimuli of the task.
             exp_data (dict): The experiment data containing relevant information.
             exp_config (dict): The configuration dictionary for the specific task.
             session_type (str): The type of session, either 'trial' or 'practice'.
             win (visual.Window): The PsychoPy window used for displaying the stimuli.
-            test_nr (int): number of tests that are run.
+            resume_path (str, optional): The results file of an interrupted session. The staircase is restored from
+                its records and the new trials are appended to it.
     """
-    # Generate stimulus paths
-    baseline_stimulus = generate_stimulus_path(path_prefix, exp_config["baseline"], exp_config["task"])
-    test_value = exp_config["baseline"] + exp_config["initial_difference"]
-    test_stimulus = generate_stimulus_path(path_prefix, test_value, exp_config["task"])
-
-    # Initialize variables for the staircase procedure
-    current_difference = exp_config["initial_difference"]
-    differences = []
-    first_incorrect = False
-    step_size = get_step_size(exp_config["task"])
-    two_down_one_up = False
-    correct_in_a_row = 1
-    correct_responses = []
-    trial_index = 0  # the number of trials aka choices
-    incorrect_trials = 0  # for the first two trials if incorrect-they are repeated-the direction is not switched
-    reversals = 0  # number of times the direction of the staircase is changed (up/down or down/up or down/none/up or up/none/down)
-    reversals_list = [reversals]
-    previous_direction = ['down']
-    last_two_combinations = []  # to make sure there's no more than 3 in a row (AAB or ABB)
+    session = _open_trial_session(stimulus_index, stimulus_cache, exp_data, exp_config, win, resume_path=resume_path)
+    session['ab_order'], session['x_key'] = draw_axb_order(session['last_two_combinations'])
+    try:
+        # Main loop for each trial
+        while not session['staircase'].finished:  # stop conditions: number of trials, reversals, test stimulus
+            # equals baseline, or a convergence rule - see StaircaseEngine.stop_reason
+            _run_trial(session, session, exp_data, session_type, win)
+    finally:
+        # Close the output file and stop the prefetch worker
+        _close_trial_session(session)
+
+    _report_trial_session(session, exp_data, session_type)
+
+
+def run_interleaved_session(stimulus_indices, stimulus_caches, exp_data, tasks, win):
+    """
+        Run the trial sessions of several tasks interleaved in one block.
+
+        Every trial belongs to a randomly chosen task whose staircase has not finished yet. Each task keeps its own
+        staircase, stimulus cache, prefetch worker and results file, so the results are the same as those of
+        separate sessions; only the AAB/ABB pattern is randomized across the whole block. The session_type column
+        of the results is 'interleaved'. A break screen is shown every
+        general_experiment_configs["interleaved_break_trials"] trials.
+
+        Args:
+            stimulus_indices (dict): The stimulus index of each task.
+            stimulus_caches (dict): The cache of decoded stimuli of each task.
+            exp_data (dict): The experiment data containing relevant information.
+            tasks (list): The tasks of the block.
+            win (visual.Window): The PsychoPy window used for displaying the stimuli.
+    """
+    create_response_stimuli(win)
+    last_two_combinations = []  # shared by all tasks - the participant hears one sequence of trials
+    sessions = []
+    try:
+        for task in tasks:
+            sessions.append(_open_trial_session(stimulus_indices[task], stimulus_caches[task], exp_data,
+                                                get_task_specific_config(task), win,
+                                                last_two_combinations=last_two_combinations))
+
+        active = [session for session in sessions if not session['staircase'].finished]
+        session = random.choice(active) if active else None
+        if session is not None:
+            session['ab_order'], session['x_key'] = draw_axb_order(last_two_combinations)
+        trial_count = 0
+        while session is not None:
+            # the task of the next trial is chosen before the response, so that its trial can be prepared meanwhile
+            next_session = random.choice(active)
+            _run_trial(session, next_session, exp_data, 'interleaved', win)
+            trial_count += 1
+
+            active = [candidate for candidate in active if not candidate['staircase'].finished]
+            if not active:
+                break
+            if next_session not in active:  # the task of the next trial has just finished
+                replacement = random.choice(active)
+                replacement['ab_order'], replacement['x_key'] = next_session['ab_order'], next_session['x_key']
+                next_session = replacement
+            session = next_session
+
+            if trial_count % general_experiment_configs["interleaved_break_trials"] == 0:
+                visual.TextStim(win,
+                                color='black',
+                                wrapWidth=2,
+                                height=0.1,
+                                text="Sie können eine kurze Pause machen.\n"
+                                     "Drücken Sie Enter, sobald Sie bereit sind, weiterzumachen.").draw()
+                win.flip()
+                event.waitKeys(keyList=['return'])
+                win.flip()
+    finally:
+        for session in sessions:
+            _close_trial_session(session)
+
+    for session in sessions:
+        _report_trial_session(session, exp_data, 'interleaved')
 
+
+def _open_trial_session(stimulus_index, stimulus_cache, exp_data, exp_config, win, resume_path=None,
+                        last_two_combinations=None):
+    """
+        Set up the staircase, the prefetch worker and the results file of a trial session.
+
+        Args:
+            stimulus_index (StimulusIndex): The in-memory index of the stimulus files of the task.
+            stimulus_cache (StimulusCache): The cache of decoded stimuli of the task.
+            exp_data (dict): The experiment data containing relevant information.
+            exp_config (dict): The configuration dictionary for the specific task.
+            win (visual.Window): The PsychoPy window, whose frame intervals are monitored if enabled.
+            resume_path (str, optional): The results file of an interrupted session to continue.
+            last_two_combinations (list, optional): The AAB/ABB patterns of the previous trials, shared by
+                interleaved sessions. Defaults to a new list (or the list restored from the interrupted session).
+
+        Returns:
+            dict: The state of the session, used by _run_trial. 'ab_order' and 'x_key' of the first trial are
+            drawn by the caller.
+    """
     start_time = time.time()  # record for each task - start timer
     start_time_str = datetime.datetime.fromtimestamp(start_time).strftime('%H:%M:%S')
 
+    if resume_path is None and general_experiment_configs["procedure"] == 'psi':
+        # Bayesian adaptive procedure - see jnd_psi.py; it has the interface of the staircase
+        staircase = PsiEngine(exp_config["task"], exp_config["initial_difference"],
+                              candidate_differences(stimulus_index),
+                              num_trials=general_experiment_configs["psi_trials"])
+        restored_combinations = []
+    elif resume_path is None:
+        # Initialize the staircase procedure - see jnd_staircase.py for the step and reversal rules
+        staircase = StaircaseEngine(exp_config["task"], exp_config["initial_difference"],
+                                    num_trials=general_experiment_configs["num_trials"],
+                                    stopping_rules=general_experiment_configs["stopping_rules"])
+        restored_combinations = []  # to make sure there's no more than 3 in a row (AAB or ABB)
+    else:
+        # Replay the recorded responses to continue where the interrupted session stopped
+        rows = read_results_file(resume_path)
+        staircase, restored_combinations = restore_staircase(rows, exp_config)
+        if rows:
+            start_time_str = rows[0]['start_time']
+            hours, minutes, seconds = (int(value) for value in rows[-1]['duration'].split(':'))
+            start_time -= hours * 3600 + minutes * 60 + seconds  # the duration column continues to count up
+    if last_two_combinations is None:
+        last_two_combinations = restored_combinations
+
+    # Generate stimulus paths
+    baseline_stimulus = stimulus_index.path(exp_config["baseline"])
+    test_stimulus = stimulus_index.path(exp_config["baseline"] + staircase.current_difference)
+    stimulus_cache.reset_counters()
+    stimulus_cache.update_window(staircase.current_difference)
+
     # path setup results per participant
     # Define the path in results for each subject
     subj_path_results = os.path.join(general_experiment_configs['output_path'], exp_data['subject'])
@@ -230,409 +416,380 @@ def run_trial_session(path_prefix, exp_data, exp_config, session_type, win):
     if not os.path.exists(subj_path_results):
         os.makedirs(subj_path_results)
 
-    # Set up the output file
-    output_filename = os.path.join(subj_path_results,
-                                   f"JND_{exp_config['task']}_{exp_data['subject']}_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.csv")
-
-    with open(output_filename, 'w') as experiment_output:
-        # Write to file here
-        experiment_output.write(
-            'experiment,'
-            'subjectID,'
-            'date,'
-            'task,'
-            'session_type,'
-            'trial,'
-            'start_time,'
-            'end_time,'
-            'duration,'
-            'recording_A,'
-            'recording_X,'
-            'recording_B,'
-            'response,'
-            'correct,'
-            'difference,'
-            'step-size,'
-            'reversals,'
-            'direction\n')
+    # Set up the output file - an interrupted session is continued in its own file
+    if resume_path is None:
+        output_filename = os.path.join(subj_path_results,
+                                       f"JND_{exp_config['task']}_{exp_data['subject']}_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.csv")
+    else:
+        output_filename = resume_path
+
+    return {'exp_config': exp_config,
+            'stimulus_index': stimulus_index,
+            'stimulus_cache': stimulus_cache,
+            'staircase': staircase,
+            'last_two_combinations': last_two_combinations,
+            'ab_order': None,
+            'x_key': None,
+            'baseline_stimulus': baseline_stimulus,
+            'test_stimulus': test_stimulus,
+            'start_time': start_time,
+            'start_time_str': start_time_str,
+            'prefetcher': AXBPrefetcher(stimulus_cache),
+            'experiment_output': ResultsWriter(output_filename, trial_columns),
+            'timing': SessionTiming(),
+            'frames': FrameMonitor(win) if general_experiment_configs["frame_monitoring"] else None}
+
+
+def _run_trial(session, next_session, exp_data, session_type, win):
+    """
+        Present one trial of a trial session, record the response and move its staircase.
 
-        # Main loop for each trial
-        while trial_index <= general_experiment_configs["num_trials"] and reversals <= 18 and baseline_stimulus != test_stimulus:  # stop conditions
+        While the participant responds, the order of the next trial is drawn and the next trial is prepared by the
+        prefetch worker of next_session, which is the same session unless sessions are interleaved.
 
-            # randomization phase
-            recording_A, recording_B = random.sample([baseline_stimulus, test_stimulus], k=2)
-            AB_dict = {'left': recording_B, 'right': recording_A}
-            x_key = random.choice(['left', 'right'])
-            current_combination = f"left{x_key}right"
+        Args:
+            session (dict): The state of the session of this trial, see _open_trial_session.
+            next_session (dict): The state of the session of the next trial.
+            exp_data (dict): The experiment data containing relevant information.
+            session_type (str): The value of the session_type column.
+            win (visual.Window): The PsychoPy window used for displaying the stimuli.
+    """
+    exp_config = session['exp_config']
+    staircase = session['staircase']
+    stimulus_cache = session['stimulus_cache']
+    prefetcher = session['prefetcher']
+    x_key = session['x_key']
+
+    # randomization phase - drawn one trial ahead, see draw_axb_order
+    recording_A, recording_X, recording_B = arrange_axb(session['baseline_stimulus'], session['test_stimulus'],
+                                                        session['ab_order'], x_key)
+
+    # listening phase - A, 700ms silence, X, 700ms silence and B are played as one sound
+    axb_buffer = prefetcher.axb_buffer(recording_A, recording_X, recording_B)
+    stimulus_AXB = load_sound().Sound(value=axb_buffer, sampleRate=stimulus_cache.sample_rate)
+
+    # Play the triplet and show rec_center - stays on until all stimuli played
+    timing = TrialTiming(len(axb_buffer) / stimulus_cache.sample_rate)  # see jnd_timing.py
+    response_keyboard = load_keyboard()
+    response_keyboard.clearEvents()  # keys pressed from now on are kept, see _wait_for_response
+    timing.mark('play_call')
+    stimulus_AXB.play()
+    timing.mark('play_return')
+    audio_center.draw()
+    win.flip()
+    timing.mark('audio_flip')
+    _hold_screen(session['frames'], 'listening', len(axb_buffer) / stimulus_cache.sample_rate + 0.2,
+                 (audio_center,), time.sleep)  # after 3rd stimulus wait 200ms
+    win.flip()
+    timing.mark('blank_flip')
+
+    # Draw response options on screen
+    AAB.draw()
+    rightArrow.draw()
+    ABB.draw()
+    leftArrow.draw()
+    win.callOnFlip(response_keyboard.clock.reset)  # key-down times are relative to the response screen
+    win.flip()
+    timing.mark('response_flip')
+    # prepare all possible next trials while the participant responds
+    next_ab_order, next_x_key = draw_axb_order(session['last_two_combinations'])
+    next_staircase = next_session['staircase']
+    next_session['prefetcher'].prefetch(next_staircase.current_difference, next_ab_order, next_x_key,
+                                        next_differences=next_staircase.next_differences())
+    response, early_keys = _wait_for_response(response_keyboard)
+    timing.mark_response(response.rt)
+    session['timing'].add(timing)
+
+    # evaluation phase
+    key_choice_map = {'left': 'left', 'right': 'right'}
+    participant_choice = key_choice_map.get(response.name, None)
+    correct = participant_choice == x_key
+    trial = staircase.step(correct)
+    if isinstance(staircase, PsiEngine):
+        print(f"{exp_config['task']} trial {staircase.trial_index}: JND estimate {staircase.threshold()[0]:.4f}")
+    elif staircase.reversals > trial['reversals']:
+        # live threshold estimate for the experimenter
+        print(f"{exp_config['task']} trial {staircase.trial_index}: reversal {staircase.reversals} at "
+              f"{trial['difference']}, threshold estimate {staircase.reversal_tracker.threshold()[0]:.4f}")
+    win.flip()
+    if exp_config["task"]== 'pause':
+        _hold_screen(session['frames'], 'inter-trial', 1.5)  # inter trial interval
+    else:
+        _hold_screen(session['frames'], 'inter-trial', 1)  # inter trial interval
+    end_time = time.time()
+    end_time_str = datetime.datetime.fromtimestamp(end_time).strftime('%H:%M:%S')
+    duration = end_time - session['start_time']
+    # Convert duration to hours, minutes, and seconds
+    hours, remainder = divmod(duration, 3600)
+    minutes, seconds = divmod(remainder, 60)
+    # Format the duration string without the fractional part
+    duration_str = '{:02d}:{:02d}:{:02d}'.format(int(hours), int(minutes), int(seconds))
+
+    # write the trial data to the output file
+    session['experiment_output'].write_row([
+        exp_data['experiment'],
+        exp_data['subject'],
+        exp_data['cur_date'],
+        exp_config['task'],
+        session_type,
+        str(staircase.trial_index),
+        session['start_time_str'],
+        end_time_str,
+        duration_str,
+        os.path.basename(recording_A),
+        os.path.basename(recording_X),
+        os.path.basename(recording_B),
+        participant_choice,
+        str(correct),
+        str(trial['difference']),
+        '' if trial['step_size'] is None else str(trial['step_size']),
+        str(trial['reversals']),
+        trial['direction'],
+        str(stimulus_cache.hits),
+        str(stimulus_cache.misses),
+        staircase.stop_reason or '',
+        staircase.procedure,
+        early_keys] + timing.columns())
+
+    # prepare for the next iteration
+    if not staircase.finished:
+        session['test_stimulus'] = session['stimulus_index'].path(exp_config['baseline'] +
+                                                                  staircase.current_difference)
+    next_session['ab_order'], next_session['x_key'] = next_ab_order, next_x_key
+
+
+def _wait_for_response(response_keyboard):
+    """
+        Wait for the response to the response screen.
 
-            # making sure: same pattern AAB or ABB not more than twice in a row
-            if len(last_two_combinations) < 2:
-                last_two_combinations.append(current_combination)
-            elif last_two_combinations[0] == last_two_combinations[1]:
-                while current_combination == last_two_combinations[0]:
-                    x_key = random.choice(['left', 'right'])
-                    current_combination = f"left{x_key}right"
-                last_two_combinations[0] = last_two_combinations[1]
-                last_two_combinations[1] = current_combination
-
-            recording_X = AB_dict[x_key]
-
-            # listening phase
-            stimulus_A = sound.Sound(recording_A)
-            stimulus_B = sound.Sound(recording_B)
-            stimulus_X = sound.Sound(recording_X)
-
-            # Play stimulus_A and show rec_center - stays on until all stimuli played
-            stimulus_A.play()
-            audio_center.draw()
-            win.flip()
-            time.sleep(get_duration(filename=recording_A) + 0.7)  # inter stimulus interval 700ms
-            # Play stimulus_X
-            stimulus_X.play()
-            time.sleep(get_duration(filename=recording_X) + 0.7)  # inter stimulus interval 700ms
-            # Play stimulus_B
-            stimulus_B.play()
-            time.sleep(get_duration(filename=recording_B) + 0.2)  # after 3rd stimulus wait 200ms
-            win.flip()
-
-            # Draw response options on screen
-            AAB.draw()
-            rightArrow.draw()
-            ABB.draw()
-            leftArrow.draw()
-            win.flip()
-            keys = event.waitKeys(keyList=['left', 'right'])
-
-            # evaluation phase
-            key_choice_map = {'left': 'left', 'right': 'right'}
-            participant_choice = key_choice_map.get(keys[0], None)
-            if participant_choice == x_key:  # correct
-                correct = True
-                correct_in_a_row += 1
-                correct_responses.append(correct)
-                if not two_down_one_up:
-                    direction = 'down'
-                    new_difference = current_difference - step_size
-                else:
-                    if correct_in_a_row >= 2 and correct_in_a_row % 2 == 0:
-                        direction = 'down'
-                        new_difference = current_difference - step_size
-                    else:
-                        direction = 'none'
-                        new_difference = current_difference
-            else:  # false
-                correct = False
-                correct_responses.append(correct)
-                if current_difference == exp_config["initial_difference"]:  # no direction change if at max difference level
-                    direction = 'none'
-                    new_difference = current_difference  # Keep new_difference the same
-                else:  # no direction change if trial 1-2 incorrect-test difference not out of range
-                    first_incorrect = True
-                    two_down_one_up = True
-                    correct_in_a_row = 0
-                    direction = 'up'
-                    new_difference = current_difference + step_size
-                incorrect_trials += 1  # Increment the incorrect_trials counter
-            win.flip()
-            if exp_config["task"]== 'pause':
-                core.wait(1.5)  # inter trial interval
-                end_time = time.time()
-                end_time_str = datetime.datetime.fromtimestamp(end_time).strftime('%H:%M:%S')
-                duration = end_time - start_time
-                # Convert duration to hours, minutes, and seconds
-                hours, remainder = divmod(duration, 3600)
-                minutes, seconds = divmod(remainder, 60)
-                # Format the duration string without the fractional part
-                duration_str = '{:02d}:{:02d}:{:02d}'.format(int(hours), int(minutes), int(seconds))
-            else:
-                core.wait(1)  # inter trial interval
-                end_time = time.time()
-                end_time_str = datetime.datetime.fromtimestamp(end_time).strftime('%H:%M:%S')
-                duration = end_time - start_time
-                # Convert duration to hours, minutes, and seconds
-                hours, remainder = divmod(duration, 3600)
-                minutes, seconds = divmod(remainder, 60)
-                # Format the duration string without the fractional part
-                duration_str = '{:02d}:{:02d}:{:02d}'.format(int(hours), int(minutes), int(seconds))
+        Keys pressed before the response screen appeared (during the playback) are buffered by the keyboard and have a
+        negative time; they are logged but do not count as the response.
+
+        Args:
+            response_keyboard (keyboard.Keyboard): The response keyboard, whose clock was reset on the flip of the
+                response screen.
 
-            # write the trial data to the output file
-            experiment_output.write(','.join([
-                exp_data['experiment'],
-                exp_data['subject'],
-                exp_data['cur_date'],
-                exp_config['task'],
-                session_type,
-                str(trial_index + 1),
-                start_time_str,
-                end_time_str,
-                duration_str,
-                os.path.basename(recording_A),
-                os.path.basename(recording_X),
-                os.path.basename(recording_B),
-                participant_choice,
-                str(correct),
-                str(current_difference),
-                str(step_size),
-                str(reversals),
-                direction]) + '\n')
-
-            experiment_output.flush()
-            differences.append(current_difference)
-
-            # prepare for the next iteration
-            trial_index += 1
-            current_difference = round(new_difference, 4)
-            step_size = get_step_size(exp_config["task"], test_difference=current_difference)
-            # IDE output for checking
-            """print("current-difference: " + str(current_difference) + " at " + str(trial_index))
-            print("step_size: " + str(step_size) + " at " + str(trial_index))"""
-            # counts as reversal only when sequence True-False or False-True-True
-            if (
-                    (previous_direction[trial_index - 1] == 'down' and direction == 'up') or
-                    (previous_direction[trial_index - 1] == 'up' and direction == 'down') or
-                    (previous_direction[trial_index - 2] == 'down' and previous_direction[trial_index - 1] == 'none' and direction == 'up') or
-                    (previous_direction[trial_index - 2] == 'up' and previous_direction[trial_index - 1] == 'none' and direction == 'down') or
-                    (trial_index >= 3 and previous_direction[trial_index - 3] == 'up' and previous_direction[trial_index - 2] == 'none' and previous_direction[trial_index - 1] == 'none' and direction == 'down')
-    ):
-                reversals += 1
-
-            previous_direction.append(direction)
-            reversals_list.append(reversals)
-            test_stimulus = generate_stimulus_path(path_prefix, exp_config['baseline'] + current_difference,
-                                                   exp_config["task"])
-
-    # Close the output file
-    experiment_output.close()
-
-    # To get the selected_reversals value for the legend
-    # Calculate the reversal differences
-    reversal_indices = [i - 1 for i in range(1, len(reversals_list)) if reversals_list[i] != reversals_list[i - 1]]
-    reversal_difference = [differences[index] for index in reversal_indices]
-    # Calculate the threshold values and get the selected_reversals
-    mean_threshold, median_threshold, selected_reversals = calculate_threshold(reversal_difference)
-
-    # Create visualization for the current test
-    create_visualization(differences, correct_responses, reversals_list, exp_config["task"], exp_data['subject'])
-
-
-def run_practice_session(path_prefix, exp_data, exp_config, win):
+        Returns:
+            tuple: The KeyPress of the response (name and rt, the time after the response screen in seconds) and the
+            early keys as 'key:ms' separated by ';' (e.g. 'left:-812.4'), or '' if there were none.
+    """
+    keys = response_keyboard.getKeys(keyList=['left', 'right'], waitRelease=False)
+    early_keys = [key for key in keys if key.rt < 0]
+    responses = [key for key in keys if key.rt >= 0]
+    if not responses:
+        responses = response_keyboard.waitKeys(keyList=['left', 'right'], waitRelease=False)
+    return responses[0], ';'.join(f"{key.name}:{key.rt * 1000:.1f}" for key in early_keys)
+
+
+def _hold_screen(frame_monitor, phase, seconds, stimuli=(), wait=None):
+    """
+        Keep the current screen for a number of seconds.
+
+        Args:
+            frame_monitor (FrameMonitor): The frame monitor of the session, or None if frames are not monitored.
+            phase (str): The phase of the trial, under which the frame intervals are recorded.
+            seconds (float): How long the screen is kept.
+            stimuli (tuple, optional): The stimuli of the screen, redrawn on every frame by the frame monitor.
+            wait (function, optional): How to wait without frame monitoring. Defaults to core.wait.
+    """
+    if frame_monitor is None:
+        (wait or core.wait)(seconds)
+    else:
+        frame_monitor.hold(phase, seconds, stimuli)
+
+
+def _close_trial_session(session):
+    """Write the remaining records, close the results file and stop the prefetch worker of a trial session."""
+    session['experiment_output'].close()
+    session['prefetcher'].shutdown()
+
+
+def _report_trial_session(session, exp_data, session_type):
+    """Print the threshold and the timing summary of a finished trial session and plot its staircase."""
+    exp_config = session['exp_config']
+    staircase = session['staircase']
+
+    # The reversals and the threshold are counted by the staircase during the session - see ReversalTracker
+    mean_threshold, median_threshold, selected_reversals = staircase.reversal_tracker.threshold()
+    if isinstance(staircase, PsiEngine):
+        print(f"{exp_config['task']}: JND estimate of the psi procedure {staircase.threshold()[0]:.4f}")
+    session['timing'].report(exp_config['task'], session_type, session['experiment_output'].path)
+    if session['frames'] is not None:
+        session['frames'].report(exp_config['task'], session_type, session['experiment_output'].path)
+
+    # Create visualization for the current test - rendered in the background, the experiment continues meanwhile
+    submit_visualization(staircase.differences, staircase.correct_responses, staircase.reversals_list,
+                         exp_config["task"], exp_data['subject'],
+                         reversal_indices=staircase.reversal_tracker.reversal_indices,
+                         date_string=plot_date_string(session['experiment_output'].path))
+
+
+def run_practice_session(stimulus_index, stimulus_cache, exp_data, exp_config, win):
     """
         Run a practice session for the experiment.
 
         Args:
-            path_prefix (str): The path prefix for the stimulus files.
+            stimulus_index (StimulusIndex): The in-memory index of the stimulus files of the task.
+            stimulus_cache (StimulusCache): The cache of decoded stimuli of the task.
             exp_data (dict): A dictionary containing experiment data (e.g., subjectID, date, experiment).
             exp_config (dict): A dictionary containing experiment configuration (e.g., baseline, task).
             win (visual.Window): A PsychoPy window object for rendering stimuli.
     """
     session_type = "practice"
     # Initialize variables
-    correct_responses_count = 0  # Incremented; practice session stops after 4 correct responses
     run = 0  # Practice session has only one run
-    current_difference = exp_config["initial_difference"]
-    first_incorrect = False
-    step_size = get_step_size(exp_config["task"])
-    two_down_one_up = False
-    correct_in_a_row = 1
-    trial_index = 0  # number of trials
-    incorrect_trials = 0  # for the first two trials if incorrect-they are repeated-the direction is not switched
-    reversals = 0  # number of times the direction of the staircase is changed (up/down or down/up or none/down)
+    # practice session stops after 4 correct responses, reversals are not counted
+    staircase = StaircaseEngine(exp_config["task"], exp_config["initial_difference"], practice=True)
 
     # Generate baseline and test stimulus paths
-    baseline_stimulus = generate_stimulus_path(path_prefix, exp_config["baseline"], exp_config["task"])
+    baseline_stimulus = stimulus_index.path(exp_config["baseline"])
     test_value = exp_config["baseline"] + exp_config["initial_difference"]
-    test_stimulus = generate_stimulus_path(path_prefix, test_value, exp_config["task"])
-
-    # List to ensure there's no more than 3 in a row (AAB or ABB)
-    last_two_combinations = []
-
-    # Display instructions and wait
-    instructions = visual.TextStim(win,
-                                   color='black',
-                                   wrapWidth=2,
-                                   height=0.1,
-                                   text=exp_config["instructions"])
-
-    instructions.draw()
-    win.flip()  # display the message
-    event.waitKeys(keyList=['return'])  # wait until button is pressed
-    win.flip()
-
-    start_time = time.time()  # record duration of run of each task - start timer
-    start_time_str = datetime.datetime.fromtimestamp(start_time).strftime('%H:%M:%S')
-
-    # path setup results per participant
-    # Define the path in results for each subject
-    subj_path_results = os.path.join(general_experiment_configs['output_path'], exp_data['subject'])
-    print(f'subject path: {subj_path_results}')
-    # Create the directory if it doesn't exist
-    if not os.path.exists(subj_path_results):
-        os.makedirs(subj_path_results)
-        print(f'subject path created')
-    print(f'subject path not created')
-    # Set up the output file
-    output_filename = os.path.join(subj_path_results,
-                                   f"JND_{exp_config['task']}_{exp_data['subject']}_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}_practice.csv")
-
-    with open(output_filename, 'w') as experiment_output:
-        # Write to file here
-        experiment_output.write(
-            'experiment,'
-            'subjectID,'
-            'date,'
-            'task,'
-            'session_type,'
-            'run,'
-            'trial,'
-            'start_time,'
-            'end_time,'
-            'duration,'
-            'recording_A,'
-            'recording_X,'
-            'recording_B,'
-            'response,'
-            'correct,'
-            'difference,'
-            'step-size,'
-            'reversals,'
-            'direction\n')
-
-        # Continue until 4 correct responses are reached
-        while correct_responses_count < 4:
-            # randomization phase
-            recording_A, recording_B = random.sample([baseline_stimulus, test_stimulus], k=2)
-            AB_dict = {'left': recording_B, 'right': recording_A}
-            x_key = random.choice(['left', 'right'])
-            current_combination = f"left{x_key}right"
-
-            # Update last_two_combinations
-            if len(last_two_combinations) < 2:
-                last_two_combinations.append(current_combination)
-            elif last_two_combinations[0] == last_two_combinations[1]:
-                while current_combination == last_two_combinations[0]:
-                    x_key = random.choice(['left', 'right'])
-                    current_combination = f"left{x_key}right"
-                last_two_combinations[0] = last_two_combinations[1]
-                last_two_combinations[1] = current_combination
-
-            recording_X = AB_dict[x_key]
-
-            # listening phase
-            stimulus_A = sound.Sound(recording_A)
-            stimulus_B = sound.Sound(recording_B)
-            stimulus_X = sound.Sound(recording_X)
-            # Play stimulus_A and show rec_center
-            stimulus_A.play()
-            audio_center.draw()
-            win.flip()
-            time.sleep(get_duration(filename=recording_A) + 0.7)  # inter stimulus interval 500ms
-            # Play stimulus_X
-            stimulus_X.play()
-            time.sleep(get_duration(filename=recording_X) + 0.7)  # inter stimulus interval 500ms
-            # Play stimulus_B
-            stimulus_B.play()
-            time.sleep(get_duration(filename=recording_B) + 0.2)  # after 3rd stimulus wait 200ms
-            win.flip()
-
-            # Draw response options on screen
-            AAB.draw()
-            rightArrow.draw()
-            ABB.draw()
-            leftArrow.draw()
-            win.flip()
-            keys = event.waitKeys(keyList=['left', 'right'])
-
-            # evaluation phase
-            key_choice_map = {'left': 'left', 'right': 'right'}
-            participant_choice = key_choice_map.get(keys[0], None)
-
-            # Check if participant's choice is correct
-            if participant_choice == x_key:  # correct
-                feedback = visual.TextStim(win, text="Richtig!",
-                                           color='black',
-                                           wrapWidth=2,
-                                           height=0.2)
-                feedback.draw()
+    test_stimulus = stimulus_index.path(test_value)
+    stimulus_cache.reset_counters()
+    stimulus_cache.update_window(exp_config["initial_difference"])
+    prefetcher = AXBPrefetcher(stimulus_cache)
+
+    try:
+        # List to ensure there's no more than 3 in a row (AAB or ABB)
+        last_two_combinations = []
+        ab_order, x_key = draw_axb_order(last_two_combinations)
+        session_timing = SessionTiming()  # timing of the audio onsets, flips and responses - see jnd_timing.py
+        frame_monitor = FrameMonitor(win) if general_experiment_configs["frame_monitoring"] else None
+
+        # Display instructions and wait
+        instructions = visual.TextStim(win,
+                                       color='black',
+                                       wrapWidth=2,
+                                       height=0.1,
+                                       text=exp_config["instructions"])
+
+        instructions.draw()
+        win.flip()  # display the message
+        event.waitKeys(keyList=['return'])  # wait until button is pressed
+        win.flip()
+
+        start_time = time.time()  # record duration of run of each task - start timer
+        start_time_str = datetime.datetime.fromtimestamp(start_time).strftime('%H:%M:%S')
+
+        # path setup results per participant
+        # Define the path in results for each subject
+        subj_path_results = os.path.join(general_experiment_configs['output_path'], exp_data['subject'])
+        print(f'subject path: {subj_path_results}')
+        # Create the directory if it doesn't exist
+        if not os.path.exists(subj_path_results):
+            os.makedirs(subj_path_results)
+            print(f'subject path created')
+        print(f'subject path not created')
+        # Set up the output file
+        output_filename = os.path.join(subj_path_results,
+                                       f"JND_{exp_config['task']}_{exp_data['subject']}_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}_practice.csv")
+
+        with ResultsWriter(output_filename, practice_columns) as experiment_output:
+
+            # Continue until 4 correct responses are reached
+            while not staircase.finished:
+                # randomization phase - drawn one trial ahead, see draw_axb_order
+                recording_A, recording_X, recording_B = arrange_axb(baseline_stimulus, test_stimulus, ab_order, x_key)
+
+                # listening phase - A, 700ms silence, X, 700ms silence and B are played as one sound
+                axb_buffer = prefetcher.axb_buffer(recording_A, recording_X, recording_B)
+                stimulus_AXB = load_sound().Sound(value=axb_buffer, sampleRate=stimulus_cache.sample_rate)
+
+                # Play the triplet and show rec_center - stays on until all stimuli played
+                timing = TrialTiming(len(axb_buffer) / stimulus_cache.sample_rate)  # see jnd_timing.py
+                response_keyboard = load_keyboard()
+                response_keyboard.clearEvents()  # keys pressed from now on are kept, see _wait_for_response
+                timing.mark('play_call')
+                stimulus_AXB.play()
+                timing.mark('play_return')
+                audio_center.draw()
+                win.flip()
+                timing.mark('audio_flip')
+                _hold_screen(frame_monitor, 'listening', len(axb_buffer) / stimulus_cache.sample_rate + 0.2,
+                             (audio_center,), time.sleep)  # after 3rd stimulus wait 200ms
+                win.flip()
+                timing.mark('blank_flip')
+
+                # Draw response options on screen
+                AAB.draw()
+                rightArrow.draw()
+                ABB.draw()
+                leftArrow.draw()
+                win.callOnFlip(response_keyboard.clock.reset)  # key-down times are relative to the response screen
                 win.flip()
-                core.wait(1)
-                correct = True
-                correct_in_a_row += 1
-                correct_responses_count += 1
-                if not two_down_one_up:
-                    direction = 'down'
-                    new_difference = current_difference - step_size
+                timing.mark('response_flip')
+                # prepare all possible next trials while the participant responds
+                next_ab_order, next_x_key = draw_axb_order(last_two_combinations)
+                prefetcher.prefetch(staircase.current_difference, next_ab_order, next_x_key)
+                response, early_keys = _wait_for_response(response_keyboard)
+                timing.mark_response(response.rt)
+                session_timing.add(timing)
+
+                # evaluation phase
+                key_choice_map = {'left': 'left', 'right': 'right'}
+                participant_choice = key_choice_map.get(response.name, None)
+
+                # Check if participant's choice is correct
+                correct = participant_choice == x_key
+                if correct:
+                    feedback_text = "Richtig!"
                 else:
-                    if correct_in_a_row >= 2:
-                        direction = 'down'
-                        new_difference = current_difference - step_size
-                    else:
-                        direction = 'none'
-                        new_difference = current_difference
-            else:
-                feedback = visual.TextStim(win, text="Falsch, versuchen Sie es bitte nochmal.",
+                    feedback_text = "Falsch, versuchen Sie es bitte nochmal."
+                feedback = visual.TextStim(win, text=feedback_text,
                                            color='black',
                                            wrapWidth=2,
                                            height=0.2)
                 feedback.draw()
                 win.flip()
-                core.wait(1)
-                correct = False
-                if current_difference == exp_config["initial_difference"]:  # no direction change if at max difference level
-                    direction = 'none'
-                    new_difference = current_difference  # Keep new_difference the same
-                else:  # no direction change if trial 1-2 incorrect-test difference not out of range
-                    first_incorrect = True
-                    two_down_one_up = True
-                    correct_in_a_row = 0
-                    direction = 'up'
-                    new_difference = current_difference + step_size
-
-            win.flip()
-            core.wait(1)  # inter trial interval
-
-            end_time = time.time()
-            end_time_str = datetime.datetime.fromtimestamp(end_time).strftime('%H:%M:%S')
-            duration = end_time - start_time
-            # Convert duration to hours, minutes, and seconds
-            hours, remainder = divmod(duration, 3600)
-            minutes, seconds = divmod(remainder, 60)
-            # Format the duration string without the fractional part
-            duration_str = '{:02d}:{:02d}:{:02d}'.format(int(hours), int(minutes), int(seconds))
-
-            # Write trial data to output file
-            experiment_output.write(','.join([
-                exp_data['experiment'],
-                exp_data['subject'],
-                exp_data['cur_date'],
-                exp_config['task'],
-                session_type,
-                str(run),
-                str(trial_index),
-                start_time_str,
-                end_time_str,
-                duration_str,
-                os.path.basename(recording_A),
-                os.path.basename(recording_X),
-                os.path.basename(recording_B),
-                participant_choice,
-                str(correct),
-                str(current_difference),
-                str(step_size),
-                str(reversals),
-                direction]) + '\n')
-            experiment_output.flush()
-
-            # prepare for the next iteration
-            trial_index += 1
-            current_difference = round(new_difference, 4)
-            step_size = get_step_size(exp_config["task"], test_difference=current_difference)
-
-            # IDE output for checking
-            """print("current-difference: " + str(current_difference) + " at " + str(trial_index))
-            print("step_size: " + str(step_size) + " at " + str(trial_index))"""
-
-            test_stimulus = generate_stimulus_path(path_prefix, exp_config['baseline'] + current_difference,
-                                                   exp_config["task"])
-
-    # Close the output file
-    experiment_output.close()
+                _hold_screen(frame_monitor, 'feedback', 1, (feedback,))
+                trial = staircase.step(correct)
+
+                win.flip()
+                _hold_screen(frame_monitor, 'inter-trial', 1)  # inter trial interval
+
+                end_time = time.time()
+                end_time_str = datetime.datetime.fromtimestamp(end_time).strftime('%H:%M:%S')
+                duration = end_time - start_time
+                # Convert duration to hours, minutes, and seconds
+                hours, remainder = divmod(duration, 3600)
+                minutes, seconds = divmod(remainder, 60)
+                # Format the duration string without the fractional part
+                duration_str = '{:02d}:{:02d}:{:02d}'.format(int(hours), int(minutes), int(seconds))
+
+                # Write trial data to output file
+                experiment_output.write_row([
+                    exp_data['experiment'],
+                    exp_data['subject'],
+                    exp_data['cur_date'],
+                    exp_config['task'],
+                    session_type,
+                    str(run),
+                    str(staircase.trial_index - 1),
+                    start_time_str,
+                    end_time_str,
+                    duration_str,
+                    os.path.basename(recording_A),
+                    os.path.basename(recording_X),
+                    os.path.basename(recording_B),
+                    participant_choice,
+                    str(correct),
+                    str(trial['difference']),
+                    '' if trial['step_size'] is None else str(trial['step_size']),
+                    str(trial['reversals']),
+                    trial['direction'],
+                    str(stimulus_cache.hits),
+                    str(stimulus_cache.misses),
+                    staircase.stop_reason or '',
+                    staircase.procedure,
+                    early_keys] + timing.columns())
+
+                # prepare for the next iteration
+                test_stimulus = stimulus_index.path(exp_config['baseline'] + staircase.current_difference)
+                ab_order, x_key = next_ab_order, next_x_key
+    finally:
+        # Close the output file and stop the prefetch worker, also if the session is aborted
+        prefetcher.shutdown()
+
+    session_timing.report(exp_config['task'], session_type, output_filename)
+    if frame_monitor is not None:
+        frame_monitor.report(exp_config['task'], session_type, output_filename)
@@ -0,0 +1,194 @@
+"""
+jnd_timing.py
+
+This module records the timing of the events of each trial of the Just-Noticeable-Difference (JND) experiment with the
+high-resolution clock time.perf_counter, and summarizes the timing of a session.
+
+Within a trial, the time of the play() call of the AXB triplet, of each win.flip() and of the keypress are recorded.
+All times are written to the results file in milliseconds relative to the play() call. The three stimuli and the
+intervals between them are played as one buffer (see render_axb in jnd_audio.py), so the offset of stimulus B is the
+length of the buffer after the start of the playback; the reaction time is measured from this offset. The keypress is
+timestamped by the keyboard relative to the flip of the response screen (the response latency) and converted to the
+same clock.
+
+At the end of a session, the mean, standard deviation, 95th percentile and range of the timing measures are printed
+and appended to 'timing_summary.csv' in the results directory of the subject. The jitter of the blank screen after
+the playback is its deviation from the planned time, the end of stimulus B plus 200 ms.
+
+Module Level Variables:
+-----------------------
+- timing_columns: The timing columns of the results files.
+
+Classes:
+--------
+- TrialTiming: The timestamps of the events of one trial.
+
+- SessionTiming: Collects the timing of the trials of a session and writes its summary.
+"""
+
+
+import csv
+import os
+import statistics
+import time
+
+
+timing_columns = ['play_call_ms', 'audio_flip_ms', 'blank_flip_ms', 'response_flip_ms', 'stimulus_B_offset_ms',
+                  'key_ms', 'rt_ms', 'response_rt_ms']
+
+summary_columns = ['date', 'task', 'session_type', 'results_file', 'measure', 'trials', 'mean_ms', 'sd_ms', 'min_ms',
+                   'p95_ms', 'max_ms']
+
+# the blank screen after the playback is planned this long after the end of stimulus B
+blank_delay = 0.2
+
+
+class TrialTiming:
+    """
+    The perf_counter timestamps of the events of one trial.
+
+    Attributes:
+        times (dict): Maps the name of each event ('play_call', 'play_return', 'audio_flip', 'blank_flip',
+            'response_flip', 'key') to its perf_counter time in seconds.
+        playback_duration (float): The duration of the AXB buffer in seconds.
+        response_latency (float): The time of the keypress after the flip of the response screen in seconds, as
+            timestamped by the keyboard, or None.
+    """
+
+    def __init__(self, playback_duration):
+        """
+        Start the timing of a trial.
+
+        Args:
+            playback_duration (float): The duration of the AXB buffer in seconds.
+        """
+        self.times = {}
+        self.playback_duration = playback_duration
+        self.response_latency = None
+
+    def mark(self, event):
+        """Record the current time as the time of an event."""
+        self.times[event] = time.perf_counter()
+
+    def mark_response(self, response_latency):
+        """
+        Record the keypress from its timestamp relative to the flip of the response screen.
+
+        Args:
+            response_latency (float): The time of the key-down event after the flip in seconds (KeyPress.rt).
+        """
+        self.response_latency = response_latency
+        self.times['key'] = self.times['response_flip'] + response_latency
+
+    def measures(self):
+        """
+        Return the timing of the trial in milliseconds.
+
+        Returns:
+            dict: The values of timing_columns, relative to the play() call ('play_call_ms' is the duration of the
+            call itself), plus 'blank_jitter_ms', the deviation of the blank screen from its planned time. Events
+            that were not recorded are None.
+        """
+        play_call = self.times['play_call']
+
+        def since_play(event):
+            return (self.times[event] - play_call) * 1000 if event in self.times else None
+
+        stimulus_B_offset = self.playback_duration * 1000
+        key = since_play('key')
+        blank_flip = since_play('blank_flip')
+        return {'play_call_ms': since_play('play_return'),
+                'audio_flip_ms': since_play('audio_flip'),
+                'blank_flip_ms': blank_flip,
+                'response_flip_ms': since_play('response_flip'),
+                'stimulus_B_offset_ms': stimulus_B_offset,
+                'key_ms': key,
+                'rt_ms': key - stimulus_B_offset if key is not None else None,
+                'response_rt_ms': self.response_latency * 1000 if self.response_latency is not None else None,
+                'blank_jitter_ms': blank_flip - stimulus_B_offset - blank_delay * 1000 if blank_flip is not None else None}
+
+    def columns(self):
+        """Return the values of timing_columns as strings for the results file."""
+        measures = self.measures()
+        return ['' if measures[column] is None else f'{measures[column]:.3f}' for column in timing_columns]
+
+
+class SessionTiming:
+    """
+    Collects the timing of the trials of a session.
+
+    Attributes:
+        trials (list): The measures of each trial, see TrialTiming.measures.
+    """
+
+    # measures of the summary: the name and how to compute it from the measures of a trial
+    summary_measures = {'play_call': lambda trial: trial['play_call_ms'],
+                        'audio_flip_after_play': lambda trial: trial['audio_flip_ms'],
+                        'blank_flip_jitter': lambda trial: trial['blank_jitter_ms'],
+                        'response_flip_after_blank': lambda trial: trial['response_flip_ms'] - trial['blank_flip_ms'],
+                        'reaction_time': lambda trial: trial['rt_ms'],
+                        'response_latency': lambda trial: trial['response_rt_ms']}
+
+    def __init__(self):
+        """Start collecting."""
+        self.trials = []
+
+    def add(self, trial_timing):
+        """Add the timing of a trial (TrialTiming)."""
+        self.trials.append(trial_timing.measures())
+
+    def summary(self):
+        """
+        Summarize the timing of the session.
+
+        Returns:
+            dict: For each summary measure, a dictionary with the number of 'trials', 'mean', 'sd', 'min', 'p95' and
+            'max' in milliseconds.
+        """
+        summary = {}
+        for measure, compute in self.summary_measures.items():
+            values = []
+            for trial in self.trials:
+                try:
+                    value = compute(trial)
+                except TypeError:  # an event of the trial was not recorded
+                    continue
+                if value is not None:
+                    values.append(value)
+            if not values:
+                continue
+            values.sort()
+            summary[measure] = {'trials': len(values),
+                                'mean': statistics.fmean(values),
+                                'sd': statistics.stdev(values) if len(values) > 1 else 0.0,
+                                'min': values[0],
+                                'p95': values[min(len(values) - 1, int(0.95 * len(values)))],
+                                'max': values[-1]}
+        return summary
+
+    def report(self, task, session_type, results_path):
+        """
+        Print the timing summary of the session and append it to 'timing_summary.csv' next to the results file.
+
+        Args:
+            task (str): The task name.
+            session_type (str): The session type, e.g. 'trial' or 'practice'.
+            results_path (str): The results file of the session.
+        """
+        summary = self.summary()
+        if not summary:
+            return
+        print(f"{task} {session_type} timing ({len(self.trials)} trials, ms): " +
+              ', '.join(f"{measure} {values['mean']:.1f} +- {values['sd']:.1f} (max {values['max']:.1f})"
+                        for measure, values in summary.items()))
+
+        path = os.path.join(os.path.dirname(results_path), 'timing_summary.csv')
+        write_header = not os.path.exists(path)
+        date = time.strftime('%Y-%m-%d %H:%M:%S')
+        with open(path, 'a', newline='', encoding='utf-8') as summary_file:
+            writer = csv.writer(summary_file)
+            if write_header:
+                writer.writerow(summary_columns)
+            for measure, values in summary.items():
+                writer.writerow([date, task, session_type, os.path.basename(results_path), measure, values['trials']] +
+                                [f"{values[key]:.3f}" for key in ('mean', 'sd', 'min', 'p95', 'max')])
@@ -3,11 +3,27 @@ jnd_visualization.py is a module designed for creating visualizations of adaptiv
 various tasks. It includes functions for calculating the mean and median threshold of an adaptive staircase experiment
 and creating a visualization of the same.
 
+Plots are drawn with the headless Agg backend. During the experiment they are rendered in a background process
+(submit_visualization), so that the participant can continue with the next task while the PNG is written. matplotlib
+is only imported by the functions that draw (see load_pyplot), so the experiment process never imports it.
+
+Classes:
+    CircleHandler, RectangleHandler: Legend handlers that draw the reversal and response markers of the legend. They
+    are defined by _legend_handlers when the first legend is drawn.
+
 Functions:
     calculate_threshold(reversals: list, num_reversals: int) -> tuple: Calculates the mean and median thresholds of
     an adaptive staircase experiment based on the last 'num_reversals' reversal points.
     create_visualization(differences: list, correct_responses: list, reversals_list: list, task: str, subject: str,
-    file_format: str) -> list: Creates and saves a visualization of an adaptive staircase experiment with the given data.
+    file_format: str, date_string: str, file_path: str, fig: Figure) -> list: Creates and saves a visualization of an
+    adaptive staircase experiment with the given data.
+    draw_staircase(ax: Axes, differences: list, correct_responses: list, reversals_list: list, task: str,
+    legend: bool) -> tuple: Draws the staircase of one test into the given axes.
+    submit_visualization(differences: list, correct_responses: list, reversals_list: list, task: str, subject: str,
+    date_string: str) -> Future: Renders the visualization in the background plotting process and returns immediately.
+    plot_date_string(results_path: str) -> str: The time stamp of the plot of a results file.
+    wait_for_visualizations(): Waits until all submitted plots are saved and stops the background plotting process.
+    load_pyplot() -> module: Imports matplotlib.pyplot with the Agg backend.
 
 Note:
     The module primarily serves as a utility for generating visualizations and thus enables the exploration of how
@@ -15,16 +31,23 @@ Note:
 """
 
 
+import functools
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib.lines as mlines
-from matplotlib.patches import Patch, Rectangle, Circle
-from matplotlib.legend_handler import HandlerPatch
-from jnd_configuration import *
+from jnd_configuration import general_experiment_configs
+import multiprocessing
 import os
+import re
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 
 
+# background process that renders the plots of the experiment, started with the first submitted plot
+_plot_executor = None
+
+# start time stamp in the name of a results file, e.g. 'JND_pitch_S1_20240521_101500.csv'
+_results_timestamp_pattern = re.compile(r'_(\d{8}_\d{6})(?:_practice)?\.csv$')
+
+
 def calculate_threshold(reversals, num_reversals=6):
     """
     Calculates the mean and median thresholds of an adaptive staircase experiment.
@@ -48,56 +71,17 @@ def calculate_threshold(reversals, num_reversals=6):
     return mean_threshold, median_threshold, selected_reversals
 
 
-def create_visualization(differences, correct_responses, reversals_list, task, subject, file_format='png'):
+@functools.lru_cache(maxsize=None)
+def _legend_handlers():
     """
-    Creates and saves a visualization of an adaptive staircase experiment with the given data.
-
-    Parameters:
-    differences (list): List of difference values between stimuli for each trial.
-    correct_responses (list): List of boolean values indicating if the response was correct for each trial.
-    reversals_list (list): List of reversal points in the experiment.
-    task (str): The name of the task.
-    subject (str): The subject identifier.
-    file_format (str, optional): The file format for saving the plot. Defaults to 'png'.
+    Define the legend handlers on first use, so that importing this module does not import matplotlib.
 
     Returns:
-    list: Selected reversals points considered for calculating the mean and median thresholds.
+    tuple: The classes CircleHandler and RectangleHandler.
     """
+    from matplotlib.legend_handler import HandlerPatch
+    from matplotlib.patches import Circle, Rectangle
 
-    # Identify the index positions where the reversals_list values change
-    reversal_indices = [i-1 for i in range(1, len(reversals_list)) if reversals_list[i] != reversals_list[i - 1]]
-
-    # Create a list of reversal differences using the reversal_indices
-    reversal_difference = [differences[index] for index in reversal_indices]
-
-    # Output in IDE - for checking
-    #print("Difference values at reversal_indices:", reversal_difference)
-
-    # Calculate the threshold value = mean and median of difference values at last 6 reversals
-    mean_threshold, median_threshold, selected_reversals = calculate_threshold(reversal_difference)
-
-    # Initialize the plot
-    plt.figure(figsize=(10, 5))
-    plt.plot(differences, color='black', linestyle='-', linewidth=1)
-    y_min = min(differences) - 0.1 * (max(differences) - min(differences)) # adapt y-axis to scale of the data
-    y_max = max(differences) + 0.1 * (max(differences) - min(differences))
-    plt.ylim(y_min, y_max)
-    plt.axhline(y=mean_threshold, color='gray', linestyle='--', linewidth=1)
-
-    # Plot the data points with corresponding markers and colors
-    for i, (difference, correct) in enumerate(zip(differences, correct_responses)):
-        marker = 'o' if i in reversal_indices else 's'
-        color = 'green' if correct else 'red'
-        plt.scatter(i, difference, marker=marker, color=color, s=30, edgecolors='black')
-        if i in reversal_indices:
-            text_offset_y = 10 if i % 2 == 0 else -20  # Alternating the text position above and below the marker
-            plt.annotate(f"{round(difference, 3)}", (i, difference), textcoords="offset points",
-                         xytext=(0, text_offset_y),
-                         ha='center',
-                         fontsize=8)
-
-
-    # Custom legend handlers
     class CircleHandler(HandlerPatch):
         """
             Custom legend handler class for circle-shaped patches.
@@ -124,6 +108,7 @@ def create_visualization(differences, correct_responses, reversals_list, task, s
             p.set_transform(trans)
             return [p]
 
+
     class RectangleHandler(HandlerPatch):
         """
         Custom legend handler class for rectangle-shaped patches.
@@ -148,45 +133,226 @@ def create_visualization(differences, correct_responses, reversals_list, task, s
             self.update_prop(p, orig_handle, legend)
             p.set_transform(trans)
             return [p]
+    return CircleHandler, RectangleHandler
+
+
+def load_pyplot():
+    """
+    Import pyplot with the headless Agg backend. Plotting modules are imported only when the first plot is drawn,
+    which keeps matplotlib off the startup path of the experiment.
+
+    Returns:
+    module: matplotlib.pyplot.
+    """
+    import matplotlib
+    matplotlib.use('Agg')  # render without a display - plots are only saved to file
+    import matplotlib.pyplot as plt
+    return plt
+
+
+def draw_staircase(ax, differences, correct_responses, reversals_list, task, legend=True, reversal_indices=None):
+    """
+    Draws the staircase of one test into the given axes.
+
+    Parameters:
+    ax (matplotlib.axes.Axes): The axes to draw into.
+    differences (list): List of difference values between stimuli for each trial.
+    correct_responses (list): List of boolean values indicating if the response was correct for each trial.
+    reversals_list (list): List of reversal points in the experiment.
+    task (str): The name of the task.
+    legend (bool, optional): Whether to add the legend. Defaults to True.
+    reversal_indices (list, optional): The index of each reversal trial, as counted by the ReversalTracker of the
+    staircase. Derived from reversals_list if not given.
+
+    Returns:
+    tuple: Mean and median threshold and the selected reversal points.
+    """
+    differences = np.asarray(differences, dtype=float)
+    correct_responses = np.asarray(correct_responses, dtype=bool)
+
+    if reversal_indices is None:
+        # Identify the index positions where the reversals_list values change
+        reversal_indices = np.flatnonzero(np.diff(reversals_list))
+    reversal_indices = np.asarray(reversal_indices, dtype=int)
+
+    # Create a list of reversal differences using the reversal_indices
+    reversal_difference = differences[reversal_indices].tolist()
+
+    # Calculate the threshold value = mean and median of difference values at last 6 reversals
+    mean_threshold, median_threshold, selected_reversals = calculate_threshold(reversal_difference)
+
+    ax.plot(differences, color='black', linestyle='-', linewidth=1)
+    y_min = differences.min() - 0.1 * (differences.max() - differences.min())  # adapt y-axis to scale of the data
+    y_max = differences.max() + 0.1 * (differences.max() - differences.min())
+    if y_max > y_min:
+        ax.set_ylim(y_min, y_max)
+    ax.axhline(y=mean_threshold, color='gray', linestyle='--', linewidth=1)
+
+    # Plot the data points with corresponding markers and colors - one call per marker and color
+    trials = np.arange(len(differences))
+    is_reversal = np.zeros(len(differences), dtype=bool)
+    is_reversal[reversal_indices] = True
+    for marker, marker_mask in (('o', is_reversal), ('s', ~is_reversal)):
+        for color, color_mask in (('green', correct_responses), ('red', ~correct_responses)):
+            mask = marker_mask & color_mask
+            if mask.any():
+                ax.scatter(trials[mask], differences[mask], marker=marker, color=color, s=30, edgecolors='black')
+    for i in reversal_indices:
+        text_offset_y = 10 if i % 2 == 0 else -20  # Alternating the text position above and below the marker
+        ax.annotate(f"{round(differences[i], 3)}", (i, differences[i]), textcoords="offset points",
+                    xytext=(0, text_offset_y),
+                    ha='center',
+                    fontsize=8)
+
+    # Set labels
+    ax.set_xlabel('Trial Number')
+    ax.set_ylabel(task + ' difference')
+    ax.grid(True)
+
+    if legend:
+        import matplotlib.lines as mlines
+        from matplotlib.patches import Patch
+        CircleHandler, RectangleHandler = _legend_handlers()
+
+        # Create legend elements
+        staircase_line = mlines.Line2D([], [], color='black', linestyle='-', linewidth=1, label='Staircase')
+        threshold_line = mlines.Line2D([], [], color='gray', linestyle='--', linewidth=1,
+                                       label=f'Threshold (mean: {round(mean_threshold, 2)}, '
+                                             f'median: {round(median_threshold, 2)} of {(len(selected_reversals))} reversals)')
+
+        correct_patch = Patch(facecolor='green', label='Correct Response', linewidth=1, edgecolor='black')
+        incorrect_patch = Patch(facecolor='red', label='Incorrect Response', linewidth=1, edgecolor='black')
+        reversal_patch = Patch(facecolor='white', label='Reversal', linewidth=1, edgecolor='black')
+
+        # Add the legend to the plot
+        ax.legend(handles=[staircase_line, threshold_line, correct_patch, incorrect_patch, reversal_patch],
+                  handler_map={reversal_patch: CircleHandler(),
+                               correct_patch: RectangleHandler(),
+                               incorrect_patch: RectangleHandler()},
+                  loc='upper right')
+
+    return mean_threshold, median_threshold, selected_reversals
+
+
+def create_visualization(differences, correct_responses, reversals_list, task, subject, file_format='png',
+                         date_string=None, file_path=None, fig=None, reversal_indices=None):
+    """
+    Creates and saves a visualization of an adaptive staircase experiment with the given data.
+
+    Parameters:
+    differences (list): List of difference values between stimuli for each trial.
+    correct_responses (list): List of boolean values indicating if the response was correct for each trial.
+    reversals_list (list): List of reversal points in the experiment.
+    task (str): The name of the task.
+    subject (str): The subject identifier.
+    file_format (str, optional): The file format for saving the plot. Defaults to 'png'.
+    date_string (str, optional): The time stamp in the file name. Defaults to the current date and time.
+    file_path (str, optional): The file to save the plot to. Defaults to a file named after subject, date and task in
+    the subject's plot directory.
+    fig (matplotlib.figure.Figure, optional): A figure to draw into, which is cleared first and kept open afterwards.
+    Defaults to a new figure, which is closed after saving.
+    reversal_indices (list, optional): The index of each reversal trial. Derived from reversals_list if not given.
+
+    Returns:
+    list: Selected reversals points considered for calculating the mean and median thresholds.
+    """
+    reuse_figure = fig is not None
+    if reuse_figure:
+        fig.clear()
+        fig.set_size_inches(10, 5)
+    else:
+        plt = load_pyplot()
+        fig = plt.figure(figsize=(10, 5))
+    ax = fig.add_subplot()
+    mean_threshold, median_threshold, selected_reversals = draw_staircase(ax, differences, correct_responses,
+                                                                          reversals_list, task,
+                                                                          reversal_indices=reversal_indices)
+    ax.set_title(f'Just-Noticeable Difference Adaptive Staircase Task for subject: {subject} and cue: {task} ')
+
+    if file_path is None:
+        # path setup results per participant
+        # Define the path in results for each subject
+        subj_path_plots = os.path.join(general_experiment_configs['plot_path'], subject)
+        # Create the directory if it doesn't exist
+        if not os.path.exists(subj_path_plots):
+            os.makedirs(subj_path_plots)
+
+        if date_string is None:
+            # Format the current date and time as a string
+            date_string = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        # Set up the output file
+        file_path = os.path.join(subj_path_plots, f"{subject}_{date_string}_{task}.{file_format}")
+    fig.savefig(file_path, dpi=300, bbox_inches='tight')
+    if not reuse_figure:
+        plt.close(fig)
 
-    # Create legend elements
-    staircase_line = mlines.Line2D([], [], color='black', linestyle='-', linewidth=1, label='Staircase')
-    threshold_line = mlines.Line2D([], [], color='gray', linestyle='--', linewidth=1,
-                                   label=f'Threshold (mean: {round(mean_threshold, 2)}, '
-                                         f'median: {round(median_threshold, 2)} of {(len(selected_reversals))} reversals)')
-
-    correct_patch = Patch(facecolor='green', label='Correct Response', linewidth=1, edgecolor='black')
-    incorrect_patch = Patch(facecolor='red', label='Incorrect Response', linewidth=1, edgecolor='black')
-    reversal_patch = Patch(facecolor='white', label='Reversal', linewidth=1, edgecolor='black')
-
-    # Set labels and title
-    plt.xlabel('Trial Number')
-    plt.ylabel(task + ' difference')
-    plt.title(f'Just-Noticeable Difference Adaptive Staircase Task for subject: {subject} and cue: {task} ')
-    # Add the legend to the plot
-    plt.legend(handles=[staircase_line, threshold_line, correct_patch, incorrect_patch, reversal_patch],
-               handler_map={reversal_patch: CircleHandler(),
-                            correct_patch: RectangleHandler(),
-                            incorrect_patch: RectangleHandler()},
-               loc='upper right')
-    plt.grid(True)
-
-    # path setup results per participant
-    # Define the path in results for each subject
-    subj_path_plots = os.path.join(general_experiment_configs['plot_path'], subject)
-    # Create the directory if it doesn't exist
-    if not os.path.exists(subj_path_plots):
-        os.makedirs(subj_path_plots)
-
-    # Get the current date and time
-    now = datetime.now()
-    # Format it as a string
-    date_string = now.strftime("%Y-%m-%d_%H-%M-%S")
-    # Set up the output file
-    file_name = f"{subject}_{date_string}_{task}.{file_format}"
-    plt.savefig(os.path.join(subj_path_plots, file_name), dpi=300, bbox_inches='tight')
-
-    # Show the plot
-    # plt.show()
     return selected_reversals
 
+
+def plot_date_string(results_path):
+    """
+    Return the time stamp of the plot of a results file: the start time in the name of the results file.
+
+    The plots made during the experiment and those rebuilt by jnd_replot.py use this time stamp, so a rebuilt plot
+    replaces the plot of the same test.
+
+    Parameters:
+    results_path (str): The path of the results file, ending in '_<YYYYmmdd>_<HHMMSS>.csv'.
+
+    Returns:
+    str: The time stamp formatted like '2024-05-21_10-15-00', or None if the file name has no time stamp.
+    """
+    match = _results_timestamp_pattern.search(os.path.basename(results_path))
+    if match is None:
+        return None
+    return datetime.strptime(match.group(1), '%Y%m%d_%H%M%S').strftime('%Y-%m-%d_%H-%M-%S')
+
+
+def _report_failed_visualization(future):
+    """Print the error of a plot that could not be rendered in the background."""
+    if future.exception() is not None:
+        print(f"Creating the visualization failed: {future.exception()}")
+
+
+def submit_visualization(differences, correct_responses, reversals_list, task, subject, reversal_indices=None,
+                         date_string=None):
+    """
+    Render the visualization of a staircase in the background plotting process.
+
+    The plotting process is started with the first call. It is a fresh ('spawn') process, so it does not inherit the
+    window and audio state of the experiment.
+
+    Parameters:
+    differences (list): List of difference values between stimuli for each trial.
+    correct_responses (list): List of boolean values indicating if the response was correct for each trial.
+    reversals_list (list): List of reversal points in the experiment.
+    task (str): The name of the task.
+    subject (str): The subject identifier.
+    reversal_indices (list, optional): The index of each reversal trial. Derived from reversals_list if not given.
+    date_string (str, optional): The time stamp in the file name, see plot_date_string. Defaults to the time the
+    test ends.
+
+    Returns:
+    concurrent.futures.Future: Resolves to the selected reversals once the plot is saved.
+    """
+    global _plot_executor
+    if _plot_executor is None:
+        _plot_executor = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn'))
+
+    if date_string is None:
+        # the time stamp of the file name is taken when the test ends, not when the plot is rendered
+        date_string = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    future = _plot_executor.submit(create_visualization, list(differences), list(correct_responses),
+                                   list(reversals_list), task, subject, date_string=date_string,
+                                   reversal_indices=reversal_indices)
+    future.add_done_callback(_report_failed_visualization)
+    return future
+
+
+def wait_for_visualizations():
+    """Wait until all submitted plots are saved and stop the background plotting process."""
+    global _plot_executor
+    if _plot_executor is not None:
+        _plot_executor.shutdown(wait=True)
+        _plot_executor = None
+
@@ -0,0 +1,92 @@
+"""
+jnd_warmup.py
+
+This module prepares the stimuli of all tasks of the Just-Noticeable-Difference (JND) experiment in the background
+while the experimenter fills in the participant dialog.
+
+For every task a worker thread builds the stimulus index and decodes the baseline and the stimuli around the initial
+difference into the stimulus cache, which is where the practice and the trial session start. A further worker
+repairs results files that were cut off by a crash. When the dialog is closed, the experiment waits for the workers
+(usually they are done by then) and the first trial starts with its stimuli already in memory.
+
+Classes:
+--------
+- StartupWarmUp: Starts the background preparation and hands over its results.
+
+Functions:
+----------
+- warm_up_task(task): Builds the stimulus index and the warm stimulus cache of one task.
+"""
+
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+from jnd_configuration import get_task_specific_config
+from jnd_stimuli import StimulusIndex
+from jnd_audio import StimulusCache
+from jnd_results import recover_results_files
+
+
+def warm_up_task(task):
+    """
+    Build the stimulus index of a task and decode the stimuli its sessions start with.
+
+    Args:
+        task (str): The task name ("pitch", "FL", or "pause").
+
+    Returns:
+        tuple: The StimulusIndex, its missing levels, the StimulusCache holding the baseline and the levels around
+        the initial difference, and the duration of the preparation in seconds.
+    """
+    start = time.perf_counter()
+    stimulus_index = StimulusIndex(get_task_specific_config(task))
+    missing_levels = stimulus_index.missing_levels()
+    if stimulus_index.pack is not None:
+        stimulus_index.pack.warm_up()  # one sequential read of the pack into the page cache
+    stimulus_cache = StimulusCache(stimulus_index)
+    stimulus_cache.update_window(stimulus_index.initial_difference)
+    return stimulus_index, missing_levels, stimulus_cache, time.perf_counter() - start
+
+
+class StartupWarmUp:
+    """
+    Prepares the stimuli of all tasks and the results directory in background threads.
+
+    Attributes:
+        tasks (list): The task names.
+    """
+
+    def __init__(self, tasks, output_path):
+        """
+        Start the background preparation.
+
+        Args:
+            tasks (list): The task names.
+            output_path (str): The results directory, whose cut-off results files are repaired.
+        """
+        self.tasks = list(tasks)
+        self._executor = ThreadPoolExecutor(max_workers=len(self.tasks) + 1, thread_name_prefix='warm_up')
+        self._recovery = self._executor.submit(recover_results_files, output_path)
+        self._task_jobs = {task: self._executor.submit(warm_up_task, task) for task in self.tasks}
+
+    def result(self):
+        """
+        Wait until the preparation is done and report missing stimuli.
+
+        Returns:
+            tuple: The stimulus index and the stimulus cache of each task (two dictionaries keyed by task).
+
+        Raises:
+            Exception: The error of a failed preparation, e.g. a missing baseline stimulus.
+        """
+        try:
+            self._recovery.result()
+            stimulus_indices, stimulus_caches = {}, {}
+            for task in self.tasks:
+                stimulus_index, missing_levels, stimulus_cache, seconds = self._task_jobs[task].result()
+                stimulus_index.report_missing_levels(missing_levels)
+                print(f"Task {task}: {len(stimulus_cache)} stimuli decoded in the background in {seconds:.2f} s")
+                stimulus_indices[task], stimulus_caches[task] = stimulus_index, stimulus_cache
+        finally:
+            self._executor.shutdown(wait=True)
+        return stimulus_indices, stimulus_caches
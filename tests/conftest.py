@@ -0,0 +1,51 @@
+"""Make the modules of the experiment importable from the tests, and provide a small stimulus set."""
+
+
+import os
+import sys
+import wave
+import numpy as np
+import pytest
+
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def write_wav(path, samples, sample_rate=44100):
+    """Write int16 samples (one column per channel) as 16-bit PCM wav file."""
+    with wave.open(str(path), 'wb') as wav_file:
+        wav_file.setnchannels(1 if samples.ndim == 1 else samples.shape[1])
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(sample_rate)
+        wav_file.writeframes(samples.astype('<i2').tobytes())
+
+
+@pytest.fixture
+def stimulus_set(tmp_path):
+    """
+    A pause stimulus directory with ten levels of noise of different lengths, including the extreme sample values and
+    a level that is a copy of another one, and a manipulation csv file that lists one more level than there are files.
+
+    Returns:
+        tuple: The task configuration for StimulusIndex and the samples of each stimulus file name.
+    """
+    stimuli_path = tmp_path / 'audio-pause'
+    stimuli_path.mkdir()
+    rng = np.random.default_rng(0)
+    samples = {}
+    for level in range(10):
+        name = f'lilli_lisa_ch_pause_0_{level:03d}.wav'
+        samples[name] = rng.integers(-32768, 32768, size=1000 + 37 * level).astype('<i2')
+        samples[name][:2] = [-32768, 32767]
+    samples['lilli_lisa_ch_pause_0_009.wav'] = samples['lilli_lisa_ch_pause_0_004.wav'].copy()
+    for name, stimulus in samples.items():
+        write_wav(stimuli_path / name, stimulus)
+    with open(stimuli_path / 'manipulation_pause.csv', 'w', encoding='utf-8') as csv_file:
+        csv_file.write('nameNew\n' + ''.join(f'lilli_lisa_ch_pause_0_{level:03d}\n' for level in range(11)))
+
+    exp_config = {'task': 'pause',
+                  'stimuli_path': str(stimuli_path) + os.sep,
+                  'stim_prefix': 'lilli_lisa_ch_pause',
+                  'baseline': 0.0,
+                  'initial_difference': 0.009}
+    return exp_config, samples
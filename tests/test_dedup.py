@@ -0,0 +1,69 @@
+"""
+Tests of the deduplicated stimulus store (jnd_dedup.py).
+"""
+
+
+import os
+import numpy as np
+import pytest
+from jnd_dedup import DedupStore, build_segments, dedup_path_for, verify_store, write_store
+from jnd_pack import pack_path_for, pack_stimuli
+from jnd_stimuli import StimulusIndex
+
+
+def test_build_segments_stores_identical_stimuli_once():
+    first = np.arange(100, dtype='<i2')
+    other = first[::-1].copy()
+    segments, references = build_segments([first, other, first.copy(), np.zeros(0, dtype='<i2')])
+    assert len(segments) == 2
+    assert references == [[[0, 0, 100]], [[1, 0, 100]], [[0, 0, 100]], []]
+
+
+def test_store_round_trip_is_bit_exact(stimulus_set):
+    exp_config, samples = stimulus_set
+    directory_index = StimulusIndex(exp_config, use_pack=False)
+    sizes = write_store(directory_index)
+    # level 9 is a copy of level 4
+    assert sizes['shared_samples'] == len(samples['lilli_lisa_ch_pause_0_009.wav'])
+    assert sizes['samples'] == sum(len(stimulus) for stimulus in samples.values())
+
+    with DedupStore(dedup_path_for(exp_config['stimuli_path']), cached_segments=2) as store:
+        assert sorted(store.entries) == sorted(samples)
+        assert store.expected_levels == list(range(11))
+        for _ in range(2):  # decoded and from the cache of decoded segments
+            for name, stimulus in samples.items():
+                assert store.samples(name).dtype == np.dtype('<i2')
+                assert np.array_equal(store.samples(name), stimulus)
+                assert store.duration(name) == len(stimulus) / 44100
+        assert verify_store(store, directory_index) == []
+    with pytest.raises(ValueError):  # the store file is closed
+        store.samples('lilli_lisa_ch_pause_0_000.wav')
+
+
+def test_stimulus_index_reads_from_the_store(stimulus_set):
+    exp_config, samples = stimulus_set
+    directory_index = StimulusIndex(exp_config, use_pack=False)
+    write_store(directory_index)
+
+    index = StimulusIndex(exp_config)
+    assert isinstance(index.pack, DedupStore)
+    assert index.files == directory_index.files
+    for path in index.files.values():
+        assert np.array_equal(index.read_samples(path)[0], directory_index.read_samples(path)[0])
+    index.close()
+
+    # a pack is preferred to a store
+    pack_stimuli(directory_index)
+    index = StimulusIndex(exp_config)
+    assert index.pack.path == pack_path_for(exp_config['stimuli_path'])
+    index.close()
+
+
+def test_outdated_store_is_not_used(stimulus_set):
+    exp_config, samples = stimulus_set
+    write_store(StimulusIndex(exp_config, use_pack=False))
+    os.remove(os.path.join(exp_config['stimuli_path'], 'lilli_lisa_ch_pause_0_003.wav'))
+
+    index = StimulusIndex(exp_config)
+    assert index.pack is None
+    assert len(index.files) == len(samples) - 1
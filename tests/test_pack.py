@@ -0,0 +1,77 @@
+"""
+Tests of the single-file stimulus pack (jnd_pack.py) and its use by StimulusIndex (jnd_stimuli.py).
+"""
+
+
+import os
+import shutil
+import numpy as np
+from jnd_audio import read_wav
+from jnd_pack import StimulusPack, pack_path_for, pack_stimuli, verify_pack
+from jnd_stimuli import StimulusIndex
+
+
+def test_pack_round_trip_is_bit_exact(stimulus_set):
+    exp_config, samples = stimulus_set
+    directory_index = StimulusIndex(exp_config, use_pack=False)
+    pack_path = pack_stimuli(directory_index)
+    assert pack_path == pack_path_for(exp_config['stimuli_path'])
+
+    with StimulusPack(pack_path) as pack:
+        assert pack.sample_rate == 44100 and pack.channels == 1
+        assert sorted(pack.entries) == sorted(samples)
+        assert pack.expected_levels == list(range(11))
+        for name, stimulus in samples.items():
+            assert pack.samples(name).dtype == np.dtype('<i2')
+            assert np.array_equal(pack.samples(name), stimulus)
+            assert np.array_equal(pack.float_samples(name), read_wav(os.path.join(exp_config['stimuli_path'], name))[0])
+            assert pack.duration(name) == len(stimulus) / 44100
+        assert verify_pack(pack, directory_index) == []
+        pack.warm_up()
+
+
+def test_stimulus_index_reads_from_the_pack(stimulus_set):
+    exp_config, samples = stimulus_set
+    directory_index = StimulusIndex(exp_config, use_pack=False)
+    pack_stimuli(directory_index)
+
+    index = StimulusIndex(exp_config)
+    assert isinstance(index.pack, StimulusPack)
+    assert index.files == directory_index.files
+    assert index.expected_levels == directory_index.expected_levels
+    for path in index.files.values():
+        pack_samples, sample_rate = index.read_samples(path)
+        wav_samples, wav_sample_rate = directory_index.read_samples(path)
+        assert sample_rate == wav_sample_rate
+        assert np.array_equal(pack_samples, wav_samples)
+    index.close()
+    index.close()  # closing twice has no effect
+
+
+def test_outdated_pack_is_not_used(stimulus_set):
+    exp_config, samples = stimulus_set
+    pack_stimuli(StimulusIndex(exp_config, use_pack=False))
+    changed = os.path.join(exp_config['stimuli_path'], 'lilli_lisa_ch_pause_0_003.wav')
+
+    stat = os.stat(changed)
+    os.utime(changed, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    index = StimulusIndex(exp_config)
+    assert index.pack is None
+    assert len(index.files) == len(samples)
+
+    # a pack without the folder of wav files, e.g. on a booth computer, is used
+    shutil.rmtree(exp_config['stimuli_path'])
+    index = StimulusIndex(exp_config)
+    assert isinstance(index.pack, StimulusPack)
+    assert np.array_equal(index.pack.samples('lilli_lisa_ch_pause_0_003.wav'), samples['lilli_lisa_ch_pause_0_003.wav'])
+    index.close()
+
+
+def test_added_wav_file_makes_the_pack_outdated(stimulus_set):
+    exp_config, samples = stimulus_set
+    pack_stimuli(StimulusIndex(exp_config, use_pack=False))
+    with StimulusPack(pack_path_for(exp_config['stimuli_path'])) as pack:
+        assert pack.stale_sources(exp_config['stimuli_path']) == []
+        shutil.copy(os.path.join(exp_config['stimuli_path'], 'lilli_lisa_ch_pause_0_000.wav'),
+                    os.path.join(exp_config['stimuli_path'], 'lilli_lisa_ch_pause_0_010.wav'))
+        assert pack.stale_sources(exp_config['stimuli_path']) == ['lilli_lisa_ch_pause_0_010.wav']
@@ -0,0 +1,115 @@
+"""
+Tests of the results writer and the repair of cut-off results files (jnd_results.py).
+"""
+
+
+import csv
+import pytest
+from jnd_results import ResultsWriter, recover_results_file, recover_results_files, trial_columns
+
+
+def make_row(trial):
+    """A record with the columns of a trial session; the subject ID contains a comma, which must be quoted."""
+    return [f'experiment-{trial}', 'S,1'] + [str(trial)] * (len(trial_columns) - 2)
+
+
+def read_rows(path):
+    with open(path, newline='', encoding='utf-8') as results_file:
+        return list(csv.reader(results_file))
+
+
+def test_writer_writes_header_and_rows(tmp_path):
+    path = tmp_path / 'JND_pause_S1_20240101_120000.csv'
+    with ResultsWriter(str(path), trial_columns) as writer:
+        for trial in range(1, 51):
+            writer.write_row(make_row(trial))
+
+    rows = read_rows(path)
+    assert rows[0] == trial_columns
+    assert rows[1:] == [make_row(trial) for trial in range(1, 51)]
+
+
+def test_writer_appends_under_existing_header(tmp_path):
+    path = tmp_path / 'JND_pause_S1_20240101_120000.csv'
+    with ResultsWriter(str(path), trial_columns) as writer:
+        writer.write_row(make_row(1))
+    with ResultsWriter(str(path), trial_columns) as writer:
+        writer.write_row(make_row(2))
+
+    assert read_rows(path) == [trial_columns, make_row(1), make_row(2)]
+
+
+def test_writer_refuses_other_columns(tmp_path):
+    path = tmp_path / 'JND_pause_S1_20240101_120000.csv'
+    path.write_text(','.join(trial_columns[:-1]) + '\n', encoding='utf-8')
+    with pytest.raises(Exception, match='columns differ'):
+        ResultsWriter(str(path), trial_columns)
+
+
+def test_writer_rejects_records_of_wrong_length(tmp_path):
+    with ResultsWriter(str(tmp_path / 'results.csv'), trial_columns) as writer:
+        with pytest.raises(Exception, match='values'):
+            writer.write_row(['too', 'short'])
+
+
+class Unwritable:
+    """A value whose conversion to text fails, like a value the csv module cannot write."""
+
+    def __str__(self):
+        raise ValueError('cannot be written')
+
+
+def test_writer_reports_errors_of_the_writer_thread(tmp_path):
+    writer = ResultsWriter(str(tmp_path / 'results.csv'), trial_columns)
+    writer.write_row(make_row(1))
+    writer.write_row(make_row(2)[:-1] + [Unwritable()])
+
+    with pytest.raises(Exception, match='cannot be written'):
+        writer.close()
+    with pytest.raises(Exception, match='cannot be written'):
+        writer.write_row(make_row(3))
+    assert read_rows(tmp_path / 'results.csv') == [trial_columns, make_row(1)]
+
+
+def test_recover_removes_truncated_last_line(tmp_path):
+    path = tmp_path / 'JND_pause_S1_20240101_120000.csv'
+    with ResultsWriter(str(path), trial_columns) as writer:
+        for trial in range(1, 4):
+            writer.write_row(make_row(trial))
+    complete = path.read_bytes()
+    # the program stopped in the middle of the fourth record
+    path.write_bytes(complete + b'experiment-4,"S,1",4,4')
+
+    assert recover_results_file(str(path))
+    assert path.read_bytes() == complete
+    assert not recover_results_file(str(path))  # nothing left to repair
+
+    # the session continues in the repaired file
+    with ResultsWriter(str(path), trial_columns) as writer:
+        writer.write_row(make_row(4))
+    assert read_rows(path)[1:] == [make_row(trial) for trial in range(1, 5)]
+
+
+def test_recover_truncated_header_and_long_record(tmp_path):
+    path = tmp_path / 'JND_pause_S1_20240101_120000.csv'
+    path.write_bytes(b'experiment,subj')  # cut off in the header - no complete record at all
+    assert recover_results_file(str(path))
+    assert path.read_bytes() == b''
+
+    # an incomplete record longer than the 4096-byte search window
+    path.write_bytes(b'header\n' + b'x' * 10000)
+    assert recover_results_file(str(path))
+    assert path.read_bytes() == b'header\n'
+
+
+def test_recover_results_files_checks_subject_directories(tmp_path):
+    subject_path = tmp_path / 'S1'
+    subject_path.mkdir()
+    cut_off = subject_path / 'JND_pitch_S1_20240101_120000.csv'
+    cut_off.write_bytes(b'header\nrow 1\nrow')
+    complete = subject_path / 'JND_pause_S1_20240101_120000.csv'
+    complete.write_bytes(b'header\nrow 1\n')
+
+    assert recover_results_files(str(tmp_path)) == [str(cut_off)]
+    assert cut_off.read_bytes() == b'header\nrow 1\n'
+    assert complete.read_bytes() == b'header\nrow 1\n'
@@ -0,0 +1,119 @@
+"""
+Tests of restoring an interrupted staircase from its results file (jnd_resume.py).
+"""
+
+
+import os
+import random
+import pytest
+from jnd_configuration import get_task_specific_config, general_experiment_configs
+from jnd_results import ResultsWriter, trial_columns
+from jnd_resume import find_interrupted_session, read_results_file, restore_staircase
+from jnd_staircase import StaircaseEngine
+
+
+# state of the staircase that must be restored exactly
+restored_attributes = ['current_difference', 'step_size', 'trial_index', 'reversals', 'two_down_one_up',
+                       'correct_in_a_row', 'correct_count', 'differences', 'correct_responses', 'reversals_list',
+                       'previous_direction', 'smallest_step_reversals']
+
+
+def write_session(path, task, responses, subject='S1', date='2024-01-01 12:00', seed=0):
+    """
+    Run a staircase with the given responses and write its records like run_trial_session does. The AXB patterns
+    are drawn with the rule of draw_axb_order in jnd_task_setup.py, which is returned with the final state of its
+    list of the last two combinations.
+    """
+    rng = random.Random(seed)
+    exp_config = get_task_specific_config(task)
+    staircase = StaircaseEngine(task, exp_config["initial_difference"],
+                                num_trials=general_experiment_configs["num_trials"],
+                                stopping_rules=general_experiment_configs["stopping_rules"])
+    last_two_combinations = []
+    with ResultsWriter(str(path), trial_columns) as writer:
+        for correct in responses:
+            baseline, test = 'baseline.wav', f'test_{staircase.current_difference}.wav'
+            recording_A, recording_B = rng.sample([baseline, test], k=2)
+            x_key = rng.choice(['left', 'right'])
+            if len(last_two_combinations) < 2:
+                last_two_combinations.append(f"left{x_key}right")
+            elif last_two_combinations[0] == last_two_combinations[1]:
+                if f"left{x_key}right" == last_two_combinations[0]:  # not the same pattern three times in a row
+                    x_key = 'right' if x_key == 'left' else 'left'
+                last_two_combinations[:] = [last_two_combinations[1], f"left{x_key}right"]
+            recording_X = recording_B if x_key == 'left' else recording_A
+            trial = staircase.step(correct)
+            row = dict.fromkeys(trial_columns, '')
+            row.update({'experiment': 'JND', 'subjectID': subject, 'date': date, 'task': task,
+                        'session_type': 'trial', 'trial': str(staircase.trial_index),
+                        'recording_A': recording_A, 'recording_X': recording_X, 'recording_B': recording_B,
+                        'correct': str(correct), 'difference': str(trial['difference']),
+                        'step-size': str(trial['step_size']), 'reversals': str(trial['reversals']),
+                        'direction': trial['direction'], 'stop_rule': staircase.stop_reason or '',
+                        'procedure': staircase.procedure})
+            writer.write_row([row[column] for column in trial_columns])
+    return staircase, last_two_combinations
+
+
+@pytest.mark.parametrize('task', ['pitch', 'pause', 'FL'])
+@pytest.mark.parametrize('seed', range(5))
+def test_restore_staircase_round_trip(tmp_path, task, seed):
+    rng = random.Random(seed)
+    responses = [rng.random() < 0.75 for _ in range(40)]
+    path = tmp_path / f'JND_{task}_S1_20240101_120000.csv'
+    staircase, expected_combinations = write_session(path, task, responses, seed=seed)
+
+    restored, last_two_combinations = restore_staircase(read_results_file(str(path)), get_task_specific_config(task))
+
+    for attribute in restored_attributes:
+        assert getattr(restored, attribute) == getattr(staircase, attribute), attribute
+    assert restored.reversal_tracker.reversal_indices == staircase.reversal_tracker.reversal_indices
+    assert restored.reversal_tracker.threshold() == staircase.reversal_tracker.threshold()
+    assert last_two_combinations == expected_combinations
+
+    # the restored staircase continues exactly like the original one
+    for correct in [rng.random() < 0.75 for _ in range(20)]:
+        if staircase.finished:
+            break
+        assert restored.step(correct) == staircase.step(correct)
+    assert restored.differences == staircase.differences
+
+
+def test_restore_staircase_refuses_mismatching_records(tmp_path):
+    path = tmp_path / 'JND_pause_S1_20240101_120000.csv'
+    write_session(path, 'pause', [True, True, False])
+    rows = read_results_file(str(path))
+    rows[1]['difference'] = '0.123'
+    with pytest.raises(Exception, match='Cannot resume'):
+        restore_staircase(rows, get_task_specific_config('pause'))
+
+
+def test_find_interrupted_session(tmp_path):
+    subject_path = tmp_path / 'S1'
+    subject_path.mkdir()
+    date = '2024-01-01 12:00'
+    # pitch was completed (its staircase reached the baseline), pause was interrupted after 10 trials
+    write_session(subject_path / 'JND_pitch_S1_20240101_120000.csv', 'pitch', [True] * 200, date=date)
+    write_session(subject_path / 'JND_pause_S1_20240101_121500.csv', 'pause', [True, False] * 5, date=date)
+
+    session = find_interrupted_session(str(tmp_path), 'S1', ['pitch', 'FL', 'pause'])
+    assert session['task'] == 'pause'
+    assert session['completed_tasks'] == ['pitch']
+    assert len(session['rows']) == 10
+    assert session['date'] == date
+
+
+def test_find_interrupted_session_skips_old_and_other_version_files(tmp_path):
+    subject_path = tmp_path / 'S1'
+    subject_path.mkdir()
+    path = subject_path / 'JND_pause_S1_20240101_121500.csv'
+    write_session(path, 'pause', [True, False] * 5)
+
+    old = os.path.getmtime(path) - 3600 * (general_experiment_configs["resume_max_age_hours"] + 1)
+    os.utime(path, (old, old))
+    assert find_interrupted_session(str(tmp_path), 'S1', ['pause']) is None
+
+    os.utime(path, None)
+    content = path.read_text(encoding='utf-8').splitlines(keepends=True)
+    path.write_text(content[0].replace(',early_keys', '') + ''.join(content[1:]), encoding='utf-8')
+    assert find_interrupted_session(str(tmp_path), 'S1', ['pause']) is None
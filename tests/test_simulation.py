@@ -0,0 +1,71 @@
+"""
+Tests of the vectorized staircase simulation (jnd_simulation.py) against StaircaseEngine (jnd_staircase.py).
+"""
+
+
+import numpy as np
+import pytest
+from jnd_configuration import get_task_specific_config
+from jnd_simulation import simulate_staircase
+from jnd_staircase import StaircaseEngine
+from jnd_stimuli import quantize_level
+
+
+def replay(task, result, observer, num_trials, stopping_rules=None):
+    """Feed the simulated responses of one observer into a StaircaseEngine."""
+    staircase = StaircaseEngine(task, get_task_specific_config(task)["initial_difference"], num_trials=num_trials,
+                                stopping_rules=stopping_rules)
+    for correct in result['correct'][observer, :result['trial_counts'][observer]]:
+        assert not staircase.finished
+        staircase.step(bool(correct))
+    return staircase
+
+
+def assert_observer_matches(task, result, observer, staircase):
+    """Compare the simulated run of one observer with the run of the engine."""
+    trials = result['trial_counts'][observer]
+    assert staircase.finished
+    assert staircase.trial_index == trials
+    assert [quantize_level(difference, task) for difference in staircase.differences] == \
+        [quantize_level(difference, task) for difference in result['differences'][observer, :trials]]
+    assert np.isnan(result['differences'][observer, trials:]).all()
+    assert staircase.reversals == result['reversal_counts'][observer]
+    assert staircase.reversal_tracker.reversal_indices == \
+        np.flatnonzero(result['reversal_trials'][observer]).tolist()
+    mean_threshold, median_threshold, _ = staircase.reversal_tracker.threshold()
+    np.testing.assert_allclose([mean_threshold, median_threshold],
+                               [result['mean_thresholds'][observer], result['median_thresholds'][observer]],
+                               rtol=1e-9, equal_nan=True)
+
+
+@pytest.mark.parametrize('task', ['pitch', 'pause', 'FL'])
+def test_simulation_matches_engine(task):
+    initial_difference = get_task_specific_config(task)["initial_difference"]
+    threshold = initial_difference * np.geomspace(0.01, 0.5, 200)
+    result = simulate_staircase(task, 200, threshold, slope=2.0, lapse=0.02, num_trials=120, seed=1)
+
+    for observer in range(200):
+        staircase = replay(task, result, observer, num_trials=120)
+        assert_observer_matches(task, result, observer, staircase)
+        assert staircase.stop_reason in ('num_trials', 'max_reversals', 'baseline')
+    assert not result['stopped_early'].any()
+
+
+@pytest.mark.parametrize('task', ['pitch', 'pause', 'FL'])
+@pytest.mark.parametrize('stopping_rules', [{'reversal_spread': {'reversals': 6, 'tolerance': 0.15}},
+                                            {'smallest_step_reversals': 4},
+                                            {'reversal_spread': {'reversals': 4, 'tolerance': 0.3},
+                                             'smallest_step_reversals': 8}])
+def test_simulation_with_stopping_rules_matches_engine(task, stopping_rules):
+    initial_difference = get_task_specific_config(task)["initial_difference"]
+    threshold = initial_difference * np.geomspace(0.01, 0.5, 200)
+    result = simulate_staircase(task, 200, threshold, slope=2.0, lapse=0.02, num_trials=120,
+                                stopping_rules=stopping_rules, seed=2)
+
+    for observer in range(200):
+        staircase = replay(task, result, observer, num_trials=120, stopping_rules=stopping_rules)
+        assert_observer_matches(task, result, observer, staircase)
+        # a convergence rule only counts as early stop if no other stopping rule applies
+        stopped_early = staircase.stop_reason in ('reversal_spread', 'smallest_step_reversals')
+        assert stopped_early == result['stopped_early'][observer]
+    assert result['stopped_early'].any()
@@ -0,0 +1,210 @@
+"""
+Tests of StaircaseEngine and ReversalTracker (jnd_staircase.py) against the staircase rules and the threshold
+computation of the original run_trial_session.
+"""
+
+
+import math
+import random
+import pytest
+from jnd_configuration import get_step_size, get_task_specific_config
+from jnd_staircase import ReversalTracker, StaircaseEngine
+from jnd_stimuli import level_scales
+from jnd_visualization import calculate_threshold
+
+
+def original_staircase(task, initial_difference, uniforms, threshold, num_trials=120):
+    """
+    The staircase of the original run_trial_session, without the display and the results file: 1-up/1-down up to
+    the first incorrect response away from the initial difference, 2-down/1-up thereafter.
+
+    The response of trial i is correct if uniforms[i] is below the probability of a correct response of a Weibull
+    observer with the given threshold at the difference of the trial.
+    """
+    current_difference = initial_difference
+    differences, step_sizes = [], []
+    step_size = get_step_size(task)
+    two_down_one_up = False
+    correct_in_a_row = 1
+    correct_responses = []
+    trial_index = 0
+    reversals = 0
+    reversals_list = [reversals]
+    previous_direction = ['down']
+
+    while trial_index <= num_trials and reversals <= 18 and round(current_difference * level_scales[task]) != 0:
+        correct = uniforms[trial_index] < observer_probability(current_difference, threshold)
+        if correct:
+            correct_in_a_row += 1
+            correct_responses.append(correct)
+            if not two_down_one_up:
+                direction = 'down'
+                new_difference = current_difference - step_size
+            else:
+                if correct_in_a_row >= 2 and correct_in_a_row % 2 == 0:
+                    direction = 'down'
+                    new_difference = current_difference - step_size
+                else:
+                    direction = 'none'
+                    new_difference = current_difference
+        else:
+            correct_responses.append(correct)
+            if current_difference == initial_difference:  # no direction change if at max difference level
+                direction = 'none'
+                new_difference = current_difference
+            else:
+                two_down_one_up = True
+                correct_in_a_row = 0
+                direction = 'up'
+                new_difference = current_difference + step_size
+        differences.append(current_difference)
+        step_sizes.append(step_size)
+
+        trial_index += 1
+        current_difference = round(new_difference, 4)
+        step_size = get_step_size(task, test_difference=current_difference)
+        if (
+                (previous_direction[trial_index - 1] == 'down' and direction == 'up') or
+                (previous_direction[trial_index - 1] == 'up' and direction == 'down') or
+                (previous_direction[trial_index - 2] == 'down' and previous_direction[trial_index - 1] == 'none' and direction == 'up') or
+                (previous_direction[trial_index - 2] == 'up' and previous_direction[trial_index - 1] == 'none' and direction == 'down') or
+                (trial_index >= 3 and previous_direction[trial_index - 3] == 'up' and previous_direction[trial_index - 2] == 'none' and previous_direction[trial_index - 1] == 'none' and direction == 'down')
+        ):
+            reversals += 1
+        previous_direction.append(direction)
+        reversals_list.append(reversals)
+
+    return {'differences': differences, 'step_sizes': step_sizes, 'correct_responses': correct_responses,
+            'reversals_list': reversals_list, 'previous_direction': previous_direction}
+
+
+def observer_probability(difference, threshold):
+    """Probability of a correct AXB response of a Weibull observer with slope 2."""
+    return 0.5 + 0.5 * (1 - math.exp(-(max(difference, 0.0) / threshold) ** 2))
+
+
+def run_engine(task, initial_difference, uniforms, threshold, num_trials=120):
+    """Drive a StaircaseEngine with the same responses as original_staircase."""
+    staircase = StaircaseEngine(task, initial_difference, num_trials=num_trials)
+    step_sizes = []
+    while not staircase.finished:
+        correct = uniforms[staircase.trial_index] < observer_probability(staircase.current_difference, threshold)
+        step_sizes.append(staircase.step(correct)['step_size'])
+    return staircase, step_sizes
+
+
+@pytest.mark.parametrize('task', ['pitch', 'pause', 'FL'])
+@pytest.mark.parametrize('seed', range(20))
+def test_engine_matches_original_staircase(task, seed):
+    initial_difference = get_task_specific_config(task)["initial_difference"]
+    rng = random.Random(seed)
+    uniforms = [rng.random() for _ in range(200)]
+    threshold = initial_difference * rng.choice([0.02, 0.1, 0.3])
+
+    expected = original_staircase(task, initial_difference, uniforms, threshold)
+    staircase, step_sizes = run_engine(task, initial_difference, uniforms, threshold)
+
+    assert staircase.differences == expected['differences']
+    assert step_sizes == expected['step_sizes']
+    assert staircase.correct_responses == expected['correct_responses']
+    assert staircase.reversals_list == expected['reversals_list']
+    assert staircase.previous_direction == expected['previous_direction']
+
+
+@pytest.mark.parametrize('task', ['pitch', 'pause', 'FL'])
+def test_engine_matches_original_staircase_down_to_baseline(task):
+    initial_difference = get_task_specific_config(task)["initial_difference"]
+    uniforms = [0.0] * 200  # every response is correct
+
+    expected = original_staircase(task, initial_difference, uniforms, initial_difference)
+    staircase, step_sizes = run_engine(task, initial_difference, uniforms, initial_difference)
+
+    assert staircase.stop_reason == 'baseline'
+    assert staircase.differences == expected['differences']
+    assert step_sizes == expected['step_sizes']
+
+
+def test_reversal_spread_stops_after_settled_reversals():
+    staircase = StaircaseEngine('pause', 0.55, stopping_rules={'reversal_spread': {'reversals': 4, 'tolerance': 0.1}})
+    for correct in (True, False, True, True, False, True, True):
+        assert staircase.stop_reason is None
+        staircase.step(correct)
+    assert staircase.reversal_tracker.reversal_levels == [0.52, 0.55, 0.52, 0.55]
+    assert staircase.stop_reason == 'reversal_spread'
+
+
+def test_smallest_step_reversals_counts_only_reversals_at_the_smallest_step():
+    # the first step is always the largest; from 0.02 on the step size of the pause task is 0.001
+    staircase = StaircaseEngine('pause', 0.05, stopping_rules={'smallest_step_reversals': 3})
+    for correct in (True, False, True, True, False):
+        staircase.step(correct)
+    assert staircase.smallest_step_reversals == 3
+    assert staircase.stop_reason == 'smallest_step_reversals'
+
+    # the same responses far above the smallest step size do not stop the run
+    staircase = StaircaseEngine('pause', 0.5, stopping_rules={'smallest_step_reversals': 3})
+    for correct in (True, False, True, True, False):
+        staircase.step(correct)
+    assert staircase.reversals == 3
+    assert staircase.stop_reason is None
+
+
+def test_incorrect_response_at_initial_difference_does_not_move():
+    staircase = StaircaseEngine('pause', 0.55)
+    trial = staircase.step(False)
+    assert trial['direction'] == 'none'
+    assert staircase.current_difference == 0.55
+    assert not staircase.two_down_one_up
+
+
+def test_two_down_one_up_after_first_incorrect_response():
+    staircase = StaircaseEngine('pause', 0.55)
+    directions = [staircase.step(correct)['direction'] for correct in (True, False, True, True, True, True)]
+    assert directions == ['down', 'up', 'none', 'down', 'none', 'down']
+
+
+def test_practice_moves_down_after_every_further_correct_response():
+    staircase = StaircaseEngine('pause', 0.55, practice=True)
+    directions = [staircase.step(correct)['direction'] for correct in (True, False, True, True, True)]
+    assert directions == ['down', 'up', 'none', 'down', 'down']
+    assert staircase.stop_reason == 'practice_correct'
+    assert staircase.reversals == 0
+
+
+@pytest.mark.parametrize('seed', range(50))
+def test_reversal_tracker_matches_original_threshold(seed):
+    rng = random.Random(seed)
+    directions = [rng.choice(['down', 'none', 'up']) for _ in range(rng.randrange(0, 120))]
+    levels = [rng.randrange(1, 500) / 1000 for _ in directions]
+
+    tracker = ReversalTracker()
+    reversals_list = [0]
+    previous_direction = ['down']
+    reversals = 0
+    for trial_index, (direction, level) in enumerate(zip(directions, levels), 1):
+        tracker.update(direction, level)
+        # the reversal rule of the original run_trial_session
+        if (
+                (previous_direction[trial_index - 1] == 'down' and direction == 'up') or
+                (previous_direction[trial_index - 1] == 'up' and direction == 'down') or
+                (previous_direction[trial_index - 2] == 'down' and previous_direction[trial_index - 1] == 'none' and direction == 'up') or
+                (previous_direction[trial_index - 2] == 'up' and previous_direction[trial_index - 1] == 'none' and direction == 'down') or
+                (trial_index >= 3 and previous_direction[trial_index - 3] == 'up' and previous_direction[trial_index - 2] == 'none' and previous_direction[trial_index - 1] == 'none' and direction == 'down')
+        ):
+            reversals += 1
+        previous_direction.append(direction)
+        reversals_list.append(reversals)
+        assert tracker.reversals == reversals
+
+    # the threshold of the original experiment: calculate_threshold over the levels of the reversal trials
+    reversal_indices = [i - 1 for i in range(1, len(reversals_list)) if reversals_list[i] != reversals_list[i - 1]]
+    assert tracker.reversal_indices == reversal_indices
+    assert tracker.reversal_levels == [levels[index] for index in reversal_indices]
+    mean_threshold, median_threshold, selected_reversals = tracker.threshold()
+    if reversal_indices:
+        expected_mean, expected_median, expected_selected = calculate_threshold([levels[index] for index in reversal_indices])
+        assert mean_threshold == pytest.approx(expected_mean)
+        assert median_threshold == pytest.approx(expected_median)
+        assert selected_reversals == list(expected_selected)
+    else:
+        assert math.isnan(mean_threshold) and selected_reversals == []